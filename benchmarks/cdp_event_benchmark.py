@@ -0,0 +1,180 @@
+"""Measures how many CDP events per second pychrome tabs can take.
+
+A fake Chrome in a separate process floods a tab with events like those of
+a page load: mostly DOM.childNodeInserted and Debugger.scriptParsed, which
+scans do not listen to, and a share of Network events, which they do. The
+time is measured from the request for the events until the listener has
+seen the last Network event. Every kind of tab is measured with and
+without dropping unhandled events before they are decoded.
+
+    python benchmarks/cdp_event_benchmark.py --events 20000 --json orjson
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import multiprocessing
+import statistics
+import struct
+import threading
+import time
+
+import pychrome
+from pychrome import jsonlib
+
+
+HANDLED_EVENT = 'Network.requestWillBeSent'
+UNHANDLED_EVENTS = ['DOM.childNodeInserted', 'Debugger.scriptParsed']
+
+
+def make_event(method, i):
+    if method == 'Network.requestWillBeSent':
+        params = {
+            'requestId': str(i), 'loaderId': 'L1', 'documentURL': 'https://www.example.com/',
+            'request': {'url': 'https://cdn.example.net/static/{}.js'.format(i), 'method': 'GET',
+                        'headers': {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) Chrome/120.0',
+                                    'Referer': 'https://www.example.com/', 'Accept': '*/*'},
+                        'initialPriority': 'High', 'referrerPolicy': 'strict-origin-when-cross-origin'},
+            'timestamp': 1000.0 + i, 'wallTime': 1700000000.0 + i,
+            'initiator': {'type': 'parser', 'url': 'https://www.example.com/', 'lineNumber': i},
+            'type': 'Script', 'frameId': 'F1', 'hasUserGesture': False,
+        }
+    elif method == 'DOM.childNodeInserted':
+        params = {'parentNodeId': i, 'previousNodeId': i - 1, 'node': {
+            'nodeId': i + 1, 'backendNodeId': i + 1, 'nodeType': 1, 'nodeName': 'DIV',
+            'localName': 'div', 'nodeValue': '', 'childNodeCount': 2,
+            'attributes': ['class', 'item item-{}'.format(i), 'data-id', str(i)]}}
+    else:
+        params = {'scriptId': str(i), 'url': 'https://cdn.example.net/static/{}.js'.format(i),
+                  'startLine': 0, 'startColumn': 0, 'endLine': 120, 'endColumn': 40,
+                  'executionContextId': 1, 'hash': '{:040x}'.format(i),
+                  'executionContextAuxData': {'isDefault': True, 'type': 'default', 'frameId': 'F1'},
+                  'isLiveEdit': False, 'sourceMapURL': '', 'hasSourceURL': False,
+                  'isModule': False, 'length': 4800, 'scriptLanguage': 'JavaScript'}
+    return {'method': method, 'params': params}
+
+
+def make_events(num_events, handled_ratio):
+    events = []
+    num_handled = 0
+    for i in range(num_events):
+        if i * handled_ratio >= num_handled:
+            events.append(make_event(HANDLED_EVENT, i))
+            num_handled += 1
+        else:
+            events.append(make_event(UNHANDLED_EVENTS[i % len(UNHANDLED_EVENTS)], i))
+    return events, num_handled
+
+
+def encode_frame(message):
+    # Compact, like Chrome. Frames of the server are not masked.
+    data = json.dumps(message, separators=(',', ':')).encode()
+    if len(data) < 126:
+        header = struct.pack('!BB', 0x81, len(data))
+    elif len(data) < 1 << 16:
+        header = struct.pack('!BBH', 0x81, 126, len(data))
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, len(data))
+    return header + data
+
+
+async def serve_tab(reader, writer, frames):
+    request = await reader.readuntil(b'\r\n\r\n')
+    key = [line.split(b':', 1)[1].strip() for line in request.split(b'\r\n')
+           if line.lower().startswith(b'sec-websocket-key:')][0]
+    accept = base64.b64encode(hashlib.sha1(key + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11').digest())
+    writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                 b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+    while True:
+        try:
+            header = await reader.readexactly(2)
+        except asyncio.IncompleteReadError:
+            return
+        length = header[1] & 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', await reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await reader.readexactly(8))
+        mask_key = await reader.readexactly(4)
+        payload = bytes(b ^ mask_key[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+        if header[0] & 0x0f == 0x8:
+            writer.close()
+            return
+        message = json.loads(payload.decode())
+        if message['method'] == 'Bench.flood':
+            writer.write(frames)
+        writer.write(encode_frame({'id': message['id'], 'result': {}}))
+        await writer.drain()
+
+
+def run_fake_chrome(conn, num_events, handled_ratio):
+    events, _ = make_events(num_events, handled_ratio)
+    frames = b''.join(encode_frame(event) for event in events)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(
+        lambda reader, writer: serve_tab(reader, writer, frames), '127.0.0.1', 0))
+    conn.send(server.sockets[0].getsockname()[1])
+    loop.run_forever()
+
+
+def measure(tab_class, websocket_url, drop_unhandled_events, num_handled, timeout=120):
+    tab = tab_class(id='bench', webSocketDebuggerUrl=websocket_url)
+    tab.drop_unhandled_events = drop_unhandled_events
+    received = []
+    done = threading.Event()
+
+    def request_will_be_sent(**params):
+        received.append(params['requestId'])
+        if len(received) == num_handled:
+            done.set()
+
+    tab.Network.requestWillBeSent = request_will_be_sent
+    tab.start()
+    try:
+        start = time.perf_counter()
+        tab.Bench.flood(_timeout=timeout)
+        if not done.wait(timeout):
+            raise RuntimeError('Only {} of {} events arrived'.format(len(received), num_handled))
+        return time.perf_counter() - start
+    finally:
+        tab.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--events', type=int, default=20000, help='Number of events per run')
+    parser.add_argument('--handled-ratio', type=float, default=0.05,
+                        help='Share of the events that have a listener')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs')
+    parser.add_argument('--json', choices=['json', 'ujson', 'orjson'],
+                        help='JSON library of pychrome (default: the fastest one installed)')
+    args = parser.parse_args()
+
+    if args.json:
+        jsonlib.use(args.json)
+    _, num_handled = make_events(args.events, args.handled_ratio)
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=run_fake_chrome,
+                                     args=(child_conn, args.events, args.handled_ratio))
+    server.daemon = True
+    server.start()
+    websocket_url = 'ws://127.0.0.1:{}/devtools/page/bench'.format(parent_conn.recv())
+
+    print('{} events, {} with a listener, JSON library: {}'.format(
+        args.events, num_handled, jsonlib.name))
+    print('{:<10} {:<16} {:>10} {:>14}'.format('Tab', 'Unhandled events', 'Time', 'Events/s'))
+    for tab_class in [pychrome.Tab, pychrome.SyncTab]:
+        for drop_unhandled_events in [False, True]:
+            durations = [measure(tab_class, websocket_url, drop_unhandled_events, num_handled)
+                         for _ in range(args.repeat)]
+            duration = statistics.median(durations)
+            print('{:<10} {:<16} {:>9.3f}s {:>14,.0f}'.format(
+                tab_class.__name__, 'dropped' if drop_unhandled_events else 'decoded',
+                duration, args.events / duration))
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""Measures the time and peak memory of each extractor of chromedevtools.
+
+The extractors run on recorded page loads, without Chrome and without the
+network. By default, these are synthetic recordings of a page with 10,
+100, 1000 and 5000 requests. Recordings of real scans (see `record_cdp`
+in the README) are added with --recording. Each extractor gets the results
+of the extractors before it, like in a scan. Its time is the median of
+--repeat runs, reported per request of the page. Its peak memory is
+measured in a separate run, because tracing allocations slows it down.
+
+    python benchmarks/extractor_benchmark.py --config config.py --save-baseline
+    # ... change an extractor ...
+    python benchmarks/extractor_benchmark.py --config config.py --check
+
+--check fails if an extractor got more than --tolerance slower or needs
+more memory than in the baseline. Baselines depend on the machine, so
+save your own before you change something.
+"""
+import argparse
+import json
+import logging
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pychrome
+
+from privacyscanner.filehandlers import NoOpFileHandler
+from privacyscanner.result import Result
+from privacyscanner.scanmodules.chromedevtools import ChromeDevtoolsScanModule, \
+    _get_extractor_classes
+from privacyscanner.scanmodules.chromedevtools.chromescan import PageScanner
+from privacyscanner.scanner import load_config
+
+
+SYNTHETIC_SIZES = [10, 100, 1000, 5000]
+
+# They need a rendered page, which a synthetic recording does not have.
+SYNTHETIC_SKIP = ['ScreenshotExtractor', 'ImprintExtractor']
+
+DEFAULT_BASELINE = Path(__file__).parent / 'extractor_baseline.json'
+
+# Differences below these are noise, even if they exceed the tolerance.
+MIN_TIME_DIFFERENCE = 0.0005
+MIN_MEMORY_DIFFERENCE = 64 * 1024
+
+SITE_URL = 'https://example.com/'
+FINAL_URL = 'https://www.example.com/'
+FIRST_PARTY_HOSTS = ['www.example.com', 'static.example.com', 'img.example.com']
+THIRD_PARTY_HOSTS = [
+    'www.google-analytics.com', 'stats.g.doubleclick.net', 'www.googletagmanager.com',
+    'connect.facebook.net', 'cdn.jsdelivr.net', 'fonts.googleapis.com', 'fonts.gstatic.com',
+    'ib.adnxs.com', 'pixel.rubiconproject.com', 'ads.pubmatic.com', 'cdn.cookielaw.org',
+    'static.criteo.net', 'sb.scorecardresearch.com', 'bat.bing.com', 'cdnjs.cloudflare.com',
+]
+RESOURCE_TYPES = [
+    ('Script', 'application/javascript', 'js'),
+    ('Image', 'image/png', 'png'),
+    ('Stylesheet', 'text/css', 'css'),
+    ('XHR', 'application/json', 'json'),
+    ('Font', 'font/woff2', 'woff2'),
+]
+# The methods PageScanner._setup_tab() calls. Their responses are empty.
+SETUP_METHODS = [
+    'Emulation.setScriptExecutionDisabled', 'Emulation.setDeviceMetricsOverride',
+    'Network.setUserAgentOverride', 'Network.enable', 'Security.enable',
+    'Security.setIgnoreCertificateErrors', 'Page.addScriptToEvaluateOnNewDocument',
+    'Page.enable',
+]
+SECURITY_DETAILS = {
+    'protocol': 'TLS 1.3', 'keyExchange': '', 'keyExchangeGroup': 'X25519',
+    'cipher': 'AES_128_GCM', 'subjectName': 'www.example.com', 'issuer': 'Example CA',
+    'validFrom': 1700000000, 'validTo': 1800000000,
+}
+DOCUMENT_HEADERS = {
+    'Content-Type': 'text/html; charset=utf-8',
+    'Strict-Transport-Security': 'max-age=31536000; includeSubDomains',
+    'Content-Security-Policy': "default-src 'self'; script-src 'self' https:; img-src *",
+    'X-Frame-Options': 'SAMEORIGIN',
+    'X-Content-Type-Options': 'nosniff',
+    'Referrer-Policy': 'strict-origin-when-cross-origin',
+    'Set-Cookie': 'session=abc; Secure; HttpOnly',
+}
+
+
+def generate_recording(path, num_requests):
+    """Write a recording of a page load with num_requests requests.
+
+    The first two requests are the document and its redirect, the others
+    are resources of first and third parties. A few of them fail. The
+    page is the same for the same num_requests.
+    """
+    rng = random.Random(num_requests)
+    scan_start = time.time()
+    recorder = pychrome.Recorder(str(path))
+    recorder.annotate('result', {'site_url': SITE_URL})
+    recorder.annotate('scan_start', scan_start)
+    for method in SETUP_METHODS:
+        recorder.record_method(method, {}, {'result': {}})
+    recorder.record_method('Browser.getWindowBounds', {'windowId': 1},
+                           {'error': {'message': 'Browser window not found'}})
+    recorder.record_method('Browser.getVersion', {}, {'result': {
+        'userAgent': 'Mozilla/5.0 (X11; Linux x86_64) HeadlessChrome/120.0.0.0 Safari/537.36'}})
+
+    def request_will_be_sent(request_id, url, resource_type, **kwargs):
+        recorder.record_event('Network.requestWillBeSent', dict({
+            'requestId': request_id, 'loaderId': 'L1', 'documentURL': FINAL_URL,
+            'request': {'url': url, 'method': 'GET', 'headers': {'Referer': FINAL_URL},
+                        'initialPriority': 'Low', 'referrerPolicy': 'strict-origin'},
+            'timestamp': scan_start, 'wallTime': scan_start, 'initiator': {'type': 'parser'},
+            'type': resource_type, 'frameId': 'F1'}, **kwargs))
+
+    def response(url, mime_type, headers):
+        return {'url': url, 'status': 200, 'statusText': 'OK', 'headers': headers,
+                'mimeType': mime_type, 'remoteIPAddress': '192.0.2.1', 'remotePort': 443,
+                'protocol': 'h2', 'securityState': 'secure',
+                'securityDetails': SECURITY_DETAILS}
+
+    redirect_response = dict(response(SITE_URL, 'text/html', {'Location': FINAL_URL}),
+                             status=301, statusText='Moved Permanently')
+    request_will_be_sent('D1', SITE_URL, 'Document', documentURL=SITE_URL)
+    request_will_be_sent('D1', FINAL_URL, 'Document', documentURL=FINAL_URL,
+                         redirectResponse=redirect_response)
+    recorder.record_event('Network.responseReceived', {
+        'requestId': 'D1', 'loaderId': 'L1', 'timestamp': scan_start, 'type': 'Document',
+        'frameId': 'F1', 'response': response(FINAL_URL, 'text/html', DOCUMENT_HEADERS)})
+
+    hosts = set()
+    for i in range(num_requests - 2):
+        if rng.random() < 0.4:
+            host = rng.choice(FIRST_PARTY_HOSTS)
+        else:
+            host = rng.choice(THIRD_PARTY_HOSTS)
+        hosts.add(host)
+        resource_type, mime_type, extension = rng.choice(RESOURCE_TYPES)
+        if host in ('www.google-analytics.com', 'stats.g.doubleclick.net'):
+            url = 'https://{}/collect?v=1&tid=UA-12345-1&cid={}&aip={}'.format(
+                host, rng.randrange(10 ** 9), rng.choice(['0', '1']))
+        else:
+            url = 'https://{}/assets/{:x}/file{}.{}'.format(
+                host, rng.getrandbits(64), i, extension)
+        request_id = 'R{}'.format(i)
+        request_will_be_sent(request_id, url, resource_type)
+        outcome = rng.random()
+        if outcome < 0.03:
+            recorder.record_event('Network.loadingFailed', {
+                'requestId': request_id, 'timestamp': scan_start, 'type': resource_type,
+                'errorText': rng.choice(['net::ERR_BLOCKED_BY_CLIENT', 'net::ERR_ABORTED',
+                                         'net::ERR_CONNECTION_REFUSED'])})
+            continue
+        headers = {'Content-Type': mime_type, 'Cache-Control': 'max-age=3600'}
+        if outcome < 0.15:
+            headers['Set-Cookie'] = 'id={:x}; Max-Age=31536000; Secure'.format(
+                rng.getrandbits(32))
+        recorder.record_event('Network.responseReceived', {
+            'requestId': request_id, 'loaderId': 'L1', 'timestamp': scan_start,
+            'type': resource_type, 'frameId': 'F1', 'response': response(url, mime_type, headers)})
+
+    recorder.record_event('Security.securityStateChanged', {
+        'securityState': 'secure', 'schemeIsCryptographic': True, 'explanations': [],
+        'insecureContentStatus': {
+            'ranMixedContent': False, 'displayedMixedContent': False,
+            'containedMixedForm': False, 'ranContentWithCertErrors': False,
+            'displayedContentWithCertErrors': False, 'ranInsecureContentStyle': 'insecure',
+            'displayedInsecureContentStyle': 'neutral'},
+        'summary': 'This page is secure (valid HTTPS).'})
+    recorder.record_event('Page.loadEventFired', {'timestamp': scan_start})
+
+    cookies = []
+    for i in range(max(num_requests // 5, 2)):
+        host = rng.choice(sorted(hosts | {'www.example.com'}))
+        session = rng.random() < 0.3
+        cookies.append({
+            'name': 'cookie{}'.format(i), 'value': '{:x}'.format(rng.getrandbits(64)),
+            'domain': '.' + host.split('.', 1)[1] if rng.random() < 0.5 else host,
+            'path': '/', 'expires': -1 if session else scan_start + rng.randrange(60, 10 ** 8),
+            'size': 24, 'httpOnly': False, 'secure': True, 'session': session})
+    recorder.record_method('Network.getAllCookies', {}, {'result': {'cookies': cookies}})
+    recorder.close()
+
+
+def load_page(recording_file, extractor_classes, logger, options):
+    """Replay a recording and return the loaded page, its result and its tab."""
+    tab = pychrome.ReplayTab(str(recording_file))
+    result = Result(tab.annotations['result'], NoOpFileHandler())
+    page = PageScanner(extractor_classes).replay_page_load(tab, result, logger, options)
+    return page, result, tab
+
+
+def measure(recording_file, extractor_classes, logger, options, repeat):
+    """Return the number of requests of the page and the stats of each extractor."""
+    times = {extractor_class.__name__: [] for extractor_class in extractor_classes}
+    for _ in range(repeat):
+        page, result, tab = load_page(recording_file, extractor_classes, logger, options)
+        for extractor_class in extractor_classes:
+            extractor = extractor_class(page, result, logger, options)
+            start = time.perf_counter()
+            extractor.extract_information()
+            times[extractor_class.__name__].append(time.perf_counter() - start)
+        tab.stop()
+
+    stats = {}
+    page, result, tab = load_page(recording_file, extractor_classes, logger, options)
+    tracemalloc.start()
+    try:
+        for extractor_class in extractor_classes:
+            extractor = extractor_class(page, result, logger, options)
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+            extractor.extract_information()
+            stats[extractor_class.__name__] = {
+                'time': statistics.median(times[extractor_class.__name__]),
+                'peak_memory': tracemalloc.get_traced_memory()[1] - memory_before,
+            }
+    finally:
+        tracemalloc.stop()
+    tab.stop()
+    return len(page.request_log), stats
+
+
+def find_regressions(benchmarks, baseline, tolerance):
+    regressions = []
+    for fixture, benchmark in benchmarks.items():
+        baseline_stats = baseline.get(fixture, {}).get('extractors', {})
+        for extractor_name, stats in benchmark['extractors'].items():
+            if extractor_name not in baseline_stats:
+                continue
+            old_stats = baseline_stats[extractor_name]
+            for key, min_difference in (('time', MIN_TIME_DIFFERENCE),
+                                        ('peak_memory', MIN_MEMORY_DIFFERENCE)):
+                old, new = old_stats[key], stats[key]
+                if new > old * (1 + tolerance) and new - old > min_difference:
+                    regressions.append('{} {}: {} {} -> {}'.format(
+                        fixture, extractor_name, key, _format_stat(key, old),
+                        _format_stat(key, new)))
+    return regressions
+
+
+def _format_stat(key, value):
+    if key == 'time':
+        return '{:.3f} ms'.format(value * 1000)
+    return '{:.1f} KiB'.format(value / 1024)
+
+
+def get_options(config_file):
+    config = load_config(config_file)
+    module_options = config['SCAN_MODULE_OPTIONS']
+    options = dict(module_options.get('chromedevtools', {}))
+    for key, value in module_options['__all__'].items():
+        options.setdefault(key, value)
+    # Chrome is not started, the recordings replace it.
+    options.setdefault('chrome_executable', None)
+    options['record_cdp'] = False
+    scan_module = ChromeDevtoolsScanModule(options)
+    # Loading the lists of the extractors is not part of the benchmark.
+    scan_module.preload()
+    return scan_module.options
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--config', help='Configuration file')
+    parser.add_argument('--recording', action='append', default=[],
+                        help='Recording of a scan to benchmark, can be given several times')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SYNTHETIC_SIZES),
+                        help='Numbers of requests of the synthetic recordings, '
+                             'separated by commas, or "none"')
+    parser.add_argument('-e', '--extractor', action='append', default=[],
+                        help='Only benchmark this extractor, can be given several times. '
+                             'The extractors before it still run.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE,
+                        help='Baseline file (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Save the measurements as baseline')
+    parser.add_argument('--check', action='store_true',
+                        help='Fail if an extractor is slower or needs more memory than in '
+                             'the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative increase for --check (default: %(default)s)')
+    args = parser.parse_args()
+
+    logger = logging.Logger('extractor_benchmark')
+    options = get_options(args.config)
+    extractor_classes = _get_extractor_classes()
+    extractor_names = {extractor_class.__name__ for extractor_class in extractor_classes}
+    for extractor_name in args.extractor:
+        if extractor_name not in extractor_names:
+            parser.error('Unknown extractor: {}'.format(extractor_name))
+    if args.extractor:
+        # The extractors after the last one given are not needed.
+        last = max(i for i, extractor_class in enumerate(extractor_classes)
+                   if extractor_class.__name__ in args.extractor)
+        extractor_classes = extractor_classes[:last + 1]
+
+    sizes = [] if args.sizes == 'none' else [int(size) for size in args.sizes.split(',')]
+    benchmarks = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fixtures = []
+        for size in sizes:
+            recording_file = Path(temp_dir) / 'synthetic-{}.jsonl.gz'.format(size)
+            generate_recording(recording_file, size)
+            synthetic_classes = [extractor_class for extractor_class in extractor_classes
+                                 if extractor_class.__name__ not in SYNTHETIC_SKIP]
+            fixtures.append(('synthetic-{}'.format(size), recording_file, synthetic_classes,
+                             dict(options, disable_javascript=True)))
+        for recording_file in args.recording:
+            fixtures.append((Path(recording_file).name.split('.')[0], recording_file,
+                             extractor_classes, options))
+        for fixture, recording_file, fixture_classes, fixture_options in fixtures:
+            num_requests, stats = measure(recording_file, fixture_classes, logger,
+                                          fixture_options, args.repeat)
+            benchmarks[fixture] = {'num_requests': num_requests, 'extractors': stats}
+            print('{} ({} requests):'.format(fixture, num_requests))
+            for extractor_name, extractor_stats in stats.items():
+                if args.extractor and extractor_name not in args.extractor:
+                    continue
+                print('  {:28} {:10.3f} ms {:10.2f} us/request {:10.1f} KiB peak'.format(
+                    extractor_name, extractor_stats['time'] * 1000,
+                    extractor_stats['time'] / max(num_requests, 1) * 10 ** 6,
+                    extractor_stats['peak_memory'] / 1024))
+
+    if args.check:
+        try:
+            with args.baseline.open() as f:
+                baseline = json.load(f)
+        except IOError as e:
+            print('Could not read baseline: {}'.format(e), file=sys.stderr)
+            sys.exit(2)
+        regressions = find_regressions(benchmarks, baseline, args.tolerance)
+        if regressions:
+            print('\nRegressions compared to {}:'.format(args.baseline), file=sys.stderr)
+            for regression in regressions:
+                print('  ' + regression, file=sys.stderr)
+            sys.exit(1)
+        print('\nNo regressions compared to {}.'.format(args.baseline))
+    if args.save_baseline:
+        with args.baseline.open('w') as f:
+            json.dump(benchmarks, f, indent=2, sort_keys=True)
+        print('\nSaved baseline to {}.'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
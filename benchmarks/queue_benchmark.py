@@ -0,0 +1,176 @@
+"""Measures how long fetching a job from the queue takes for large queues.
+
+The benchmark creates its tables in an own schema of the given database
+(schema.sql with some synthetic scans), so that an existing queue is not
+touched. It compares the dependency check that was used before the ready
+queue with the ready queue itself. Every fetch is rolled back, so the
+size of the queue does not change during a run.
+
+    python benchmarks/queue_benchmark.py 'dbname=privacyscanner user=privacyscanner' \\
+        --jobs 1000000 --jobs 10000000
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+import psycopg2
+
+from privacyscanner.jobqueue import _CLAIM_JOBS_QUERY
+
+
+SCHEMA_FILE = Path(__file__).resolve().parent.parent / 'schema.sql'
+
+SCAN_MODULES = ('chromedevtools', 'dns', 'mail', 'serverleaks', 'testssl_https',
+                'testssl_mail', 'cookiebanner')
+
+# The dependency order of the modules above, as given by their dependencies.
+DEPENDENCY_ORDERS = (1, 2, 3, 2, 3, 3, 1)
+
+_OLD_FETCH_JOB_QUERY = """
+WITH job AS (
+  SELECT sj1.id, si.num_tries
+  FROM scanner_scanjob AS sj1,
+       scanner_scaninfo AS si
+  WHERE NOT EXISTS ( -- Make sure our dependencies are processed first
+    SELECT id
+    FROM scanner_scanjob AS sj2
+    WHERE sj2.dependency_order < sj1.dependency_order AND
+          sj2.scan_id = sj1.scan_id
+  ) AND sj1.scan_module IN %s
+    AND si.scan_id = sj1.scan_id
+    AND si.scan_module = sj1.scan_module
+    AND si.num_tries < %s
+    AND (sj1.not_before IS NULL OR sj1.not_before <= NOW())
+  ORDER BY sj1.priority DESC, sj1.scan_id, sj1.dependency_order
+  FOR UPDATE OF sj1 SKIP LOCKED
+  LIMIT 1
+)
+DELETE FROM scanner_scanjob
+WHERE id = (SELECT id FROM job)
+RETURNING id, scan_id, scan_module, (SELECT num_tries FROM job) AS num_tries, dependency_order, priority
+"""
+
+_FILL_QUERIES = [
+    """
+    INSERT INTO sites_site (id, url, is_private, date_created, num_views)
+    SELECT i::text, 'https://site' || i || '.example/', false, NOW(), 0
+    FROM generate_series(1, %(num_scans)s) AS i
+    """,
+    """
+    INSERT INTO scanner_scan (id, time_started, result, is_latest, site_id)
+    SELECT i, NOW(), jsonb_build_object('site_url', 'https://site' || i || '.example/'), true, i::text
+    FROM generate_series(1, %(num_scans)s) AS i
+    """,
+    """
+    INSERT INTO scanner_scaninfo (scan_module, scan_id, num_tries)
+    SELECT m.scan_module, i, 0
+    FROM generate_series(1, %(num_scans)s) AS i,
+         unnest(%(scan_modules)s::text[]) AS m(scan_module)
+    """,
+    """
+    INSERT INTO scanner_scanjob (scan_module, priority, dependency_order, scan_id)
+    SELECT m.scan_module, i %% 3, m.dependency_order, i
+    FROM generate_series(1, %(num_scans)s) AS i,
+         unnest(%(scan_modules)s::text[], %(dependency_orders)s::int[])
+           AS m(scan_module, dependency_order)
+    """,
+]
+
+
+def create_queue(conn, schema, num_jobs):
+    num_scans = max(1, num_jobs // len(SCAN_MODULES))
+    with conn.cursor() as c:
+        c.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(schema))
+        c.execute('CREATE SCHEMA {}'.format(schema))
+        c.execute('SET search_path TO {}'.format(schema))
+        c.execute(SCHEMA_FILE.read_text())
+        start = time.monotonic()
+        for query in _FILL_QUERIES:
+            c.execute(query, {
+                'num_scans': num_scans,
+                'scan_modules': list(SCAN_MODULES),
+                'dependency_orders': list(DEPENDENCY_ORDERS)
+            })
+        conn.commit()
+        fill_time = time.monotonic() - start
+        c.execute('ANALYZE')
+        c.execute('SELECT COUNT(*) FROM scanner_scanjob')
+        num_jobs = c.fetchone()[0]
+        c.execute('SELECT COUNT(*) FROM scanner_readyjob')
+        num_ready = c.fetchone()[0]
+    conn.commit()
+    return num_jobs, num_ready, fill_time
+
+
+def get_claim_params(scan_modules, max_tries=3):
+    return {
+        'scan_modules': scan_modules,
+        'max_tries': max_tries,
+        'limit': 1,
+        'claim_modules': list(scan_modules),
+        'claim_sizes': [1] * len(scan_modules),
+        'lease_owner': 'queue-benchmark',
+        'lease_worker': 0,
+        'lease_duration': 60
+    }
+
+
+def measure_fetch(conn, query, params, num_fetches):
+    latencies = []
+    with conn.cursor() as c:
+        for _ in range(num_fetches):
+            start = time.monotonic()
+            c.execute(query, params)
+            c.fetchone()
+            latencies.append(time.monotonic() - start)
+            conn.rollback()
+    return latencies
+
+
+def print_latencies(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print('  {:<28} median {:9.3f} ms   p95 {:9.3f} ms   max {:9.3f} ms'.format(
+        name, 1000 * statistics.median(latencies), 1000 * p95, 1000 * latencies[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('dsn', help='Database to create the benchmark schema in')
+    parser.add_argument('--jobs', type=int, action='append',
+                        help='Number of queued jobs (default: 1000000 and 10000000)')
+    parser.add_argument('--fetches', type=int, default=50,
+                        help='Number of fetches per query and scan module set')
+    parser.add_argument('--schema', default='queue_benchmark')
+    parser.add_argument('--keep', action='store_true', help='Do not drop the schema afterwards')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    module_sets = [
+        ('all modules', SCAN_MODULES),
+        ('cookiebanner only', ('cookiebanner',)),
+        ('testssl_https only', ('testssl_https',)),
+    ]
+    try:
+        for num_jobs in args.jobs or [1000000, 10000000]:
+            num_jobs, num_ready, fill_time = create_queue(conn, args.schema, num_jobs)
+            print('{} queued jobs, {} ready ({:.1f} s to insert)'.format(
+                num_jobs, num_ready, fill_time))
+            for set_name, scan_modules in module_sets:
+                print(' {}:'.format(set_name))
+                for name, query, params in (
+                        ('dependency check', _OLD_FETCH_JOB_QUERY, (scan_modules, 3)),
+                        ('ready queue', _CLAIM_JOBS_QUERY, get_claim_params(scan_modules))):
+                    latencies = measure_fetch(conn, query, params, args.fetches)
+                    print_latencies(name, latencies)
+    finally:
+        if not args.keep:
+            with conn.cursor() as c:
+                c.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(args.schema))
+            conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Measures how long starting a worker takes with spawn and with the forkserver.
+
+A started process does what a worker does before it fetches its first
+job, except connecting to the database: it imports the worker and loads
+the scan modules of the config. Each start method runs in a fresh
+interpreter, because the start method can only be set once.
+
+    python benchmarks/worker_start_benchmark.py --config config.py --workers 10
+"""
+import argparse
+import multiprocessing
+import statistics
+import subprocess
+import sys
+import time
+
+
+def _start_worker(conn, scan_module_list, scan_module_options):
+    from privacyscanner.preload import get_scan_modules
+    import privacyscanner.worker  # noqa: F401
+
+    get_scan_modules(scan_module_list, scan_module_options)
+    conn.send(time.monotonic())
+    conn.close()
+
+
+def measure(start_method, config_file, num_workers):
+    from privacyscanner.preload import set_preload
+    from privacyscanner.scanner import load_config
+
+    config = load_config(config_file)
+    multiprocessing.set_start_method(start_method)
+    if start_method == 'forkserver':
+        set_preload(config['SCAN_MODULES'], config['SCAN_MODULE_OPTIONS'])
+        multiprocessing.set_forkserver_preload(
+            ['privacyscanner.worker', 'privacyscanner.preload'] + config['WORKER_PRELOAD'])
+        # Starting the server is a one-time cost, which we report separately.
+        start = time.monotonic()
+        multiprocessing.forkserver.ensure_running()
+        process = multiprocessing.Process(target=time.sleep, args=(0,))
+        process.start()
+        process.join()
+        print('  server start {:9.3f} s'.format(time.monotonic() - start))
+    startup_times = []
+    for _ in range(num_workers):
+        read_conn, write_conn = multiprocessing.Pipe(duplex=False)
+        start = time.monotonic()
+        process = multiprocessing.Process(
+            target=_start_worker,
+            args=(write_conn, config['SCAN_MODULES'], config['SCAN_MODULE_OPTIONS']))
+        process.start()
+        write_conn.close()
+        startup_times.append(read_conn.recv() - start)
+        process.join()
+    print('  median {:9.3f} s   max {:9.3f} s   ({} workers)'.format(
+        statistics.median(startup_times), max(startup_times), num_workers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--config', help='Configuration file')
+    parser.add_argument('--workers', type=int, default=10, help='Number of workers to start')
+    parser.add_argument('--start-method', dest='start_method', choices=['spawn', 'forkserver'],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.start_method:
+        measure(args.start_method, args.config, args.workers)
+        return
+    for start_method in ('spawn', 'forkserver'):
+        print('{}:'.format(start_method))
+        command = [sys.executable, __file__, '--start-method', start_method,
+                   '--workers', str(args.workers)]
+        if args.config:
+            command += ['--config', args.config]
+        subprocess.run(command, check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+--
+-- Stores scan results per key instead of merging them into
+-- scanner_scan.result. Existing results stay in scanner_scan.result and are
+-- still found by the workers and by the scanner_scan_merged view.
+--
+BEGIN;
+
+CREATE TABLE scanner_scanresult (
+    scan_id integer NOT NULL REFERENCES scanner_scan(id),
+    key character varying(200) NOT NULL,
+    value jsonb,
+    scan_module character varying(80) NOT NULL,
+    PRIMARY KEY (scan_id, key)
+);
+
+-- Rebuilds the merged result document of a scan as it was stored in
+-- scanner_scan.result before.
+CREATE VIEW scanner_scan_merged AS
+SELECT s.id, s.time_started, s.time_finished,
+       COALESCE(s.result, '{}'::jsonb) || COALESCE(r.result, '{}'::jsonb) AS result,
+       s.is_latest, s.site_id
+FROM scanner_scan AS s
+LEFT JOIN LATERAL (
+    SELECT jsonb_object_agg(sr.key, sr.value) AS result
+    FROM scanner_scanresult AS sr
+    WHERE sr.scan_id = s.id
+) AS r ON true;
+
+COMMIT;
@@ -0,0 +1,85 @@
+--
+-- Adds the ready queue scanner_readyjob, which replaces the dependency
+-- check of every queued job when a worker fetches a job. Requires
+-- PostgreSQL 11 or newer (covering index).
+--
+BEGIN;
+
+-- Jobs whose dependencies are processed, i.e., the jobs with the lowest
+-- dependency_order of their scan. Maintained by the triggers on
+-- scanner_scanjob, so that fetching a job is an index-ordered pop.
+CREATE TABLE scanner_readyjob (
+    job_id integer NOT NULL PRIMARY KEY REFERENCES scanner_scanjob(id) ON DELETE CASCADE,
+    scan_module character varying(80) NOT NULL,
+    priority integer NOT NULL,
+    dependency_order integer NOT NULL,
+    scan_id integer NOT NULL,
+    not_before timestamp with time zone
+);
+
+CREATE INDEX scanner_readyjob_order ON scanner_readyjob(priority DESC, scan_id)
+    INCLUDE (job_id, scan_module, dependency_order, not_before);
+CREATE INDEX scanner_readyjob_scan ON scanner_readyjob(scan_id);
+
+CREATE FUNCTION update_ready_jobs() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+        DECLARE
+          next_order integer;
+        BEGIN
+          IF (TG_OP = 'INSERT') THEN
+            PERFORM pg_advisory_xact_lock(NEW.scan_id);
+            IF EXISTS (SELECT 1 FROM scanner_scanjob
+                       WHERE scan_id = NEW.scan_id AND dependency_order < NEW.dependency_order) THEN
+              RETURN NEW;
+            END IF;
+            -- Jobs which were ready before have to wait for the new job now.
+            DELETE FROM scanner_readyjob
+              WHERE scan_id = NEW.scan_id AND dependency_order > NEW.dependency_order;
+            INSERT INTO scanner_readyjob (job_id, scan_module, priority, dependency_order, scan_id, not_before)
+              VALUES (NEW.id, NEW.scan_module, NEW.priority, NEW.dependency_order, NEW.scan_id, NEW.not_before);
+            RETURN NEW;
+          ELSIF (TG_OP = 'UPDATE') THEN
+            UPDATE scanner_readyjob SET priority = NEW.priority, not_before = NEW.not_before
+              WHERE job_id = NEW.id;
+            RETURN NEW;
+          ELSIF (TG_OP = 'DELETE') THEN
+            -- Without the lock, the transactions deleting the last jobs of
+            -- a dependency_order at the same time would each still see the
+            -- other job and none of them would make the next ones ready.
+            -- The queries of this function see the jobs deleted by the
+            -- transaction holding the lock before, as it has committed.
+            PERFORM pg_advisory_xact_lock(OLD.scan_id);
+            IF EXISTS (SELECT 1 FROM scanner_scanjob
+                       WHERE scan_id = OLD.scan_id AND dependency_order <= OLD.dependency_order) THEN
+              RETURN OLD;
+            END IF;
+            -- The last job of this dependency_order is gone, so the next
+            -- ones are ready now.
+            SELECT MIN(dependency_order) FROM scanner_scanjob WHERE scan_id = OLD.scan_id INTO next_order;
+            IF next_order IS NOT NULL THEN
+              INSERT INTO scanner_readyjob (job_id, scan_module, priority, dependency_order, scan_id, not_before)
+                SELECT id, scan_module, priority, dependency_order, scan_id, not_before
+                FROM scanner_scanjob
+                WHERE scan_id = OLD.scan_id AND dependency_order = next_order
+                ON CONFLICT (job_id) DO NOTHING;
+            END IF;
+            RETURN OLD;
+          END IF;
+        END
+        $$;
+
+CREATE TRIGGER scanjob_ready AFTER INSERT OR DELETE OR UPDATE OF priority, not_before ON scanner_scanjob FOR EACH ROW EXECUTE PROCEDURE update_ready_jobs();
+
+-- Fill the ready queue with the jobs that are ready already.
+INSERT INTO scanner_readyjob (job_id, scan_module, priority, dependency_order, scan_id, not_before)
+SELECT sj1.id, sj1.scan_module, sj1.priority, sj1.dependency_order, sj1.scan_id, sj1.not_before
+FROM scanner_scanjob AS sj1
+WHERE NOT EXISTS (
+  SELECT id
+  FROM scanner_scanjob AS sj2
+  WHERE sj2.dependency_order < sj1.dependency_order AND
+        sj2.scan_id = sj1.scan_id
+);
+
+COMMIT;
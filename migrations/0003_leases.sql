@@ -0,0 +1,78 @@
+--
+-- Replaces the long transactions which held a fetched job until its result
+-- was reported with leases: claims are committed right away and the master
+-- of the worker extends the lease while the worker is alive.
+--
+BEGIN;
+
+ALTER TABLE scanner_scanjob
+    ADD COLUMN lease_owner character varying(80),
+    ADD COLUMN lease_worker integer,
+    ADD COLUMN lease_expires timestamp with time zone;
+
+CREATE INDEX scanner_scanjob_lease_expires ON scanner_scanjob(lease_expires) WHERE lease_expires IS NOT NULL;
+CREATE INDEX scanner_scanjob_lease_owner ON scanner_scanjob(lease_owner, lease_worker) WHERE lease_owner IS NOT NULL;
+
+ALTER TABLE scanner_readyjob ADD COLUMN lease_owner character varying(80);
+
+DROP INDEX scanner_readyjob_order;
+CREATE INDEX scanner_readyjob_order ON scanner_readyjob(priority DESC, scan_id)
+    INCLUDE (job_id, scan_module, dependency_order, not_before) WHERE lease_owner IS NULL;
+
+DROP TRIGGER scanjob_ready ON scanner_scanjob;
+
+CREATE OR REPLACE FUNCTION update_ready_jobs() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+        DECLARE
+          next_order integer;
+        BEGIN
+          IF (TG_OP = 'INSERT') THEN
+            PERFORM pg_advisory_xact_lock(NEW.scan_id);
+            IF EXISTS (SELECT 1 FROM scanner_scanjob
+                       WHERE scan_id = NEW.scan_id AND dependency_order < NEW.dependency_order) THEN
+              RETURN NEW;
+            END IF;
+            -- Jobs which were ready before have to wait for the new job now.
+            DELETE FROM scanner_readyjob
+              WHERE scan_id = NEW.scan_id AND dependency_order > NEW.dependency_order;
+            INSERT INTO scanner_readyjob (job_id, scan_module, priority, dependency_order, scan_id, not_before,
+                                          lease_owner)
+              VALUES (NEW.id, NEW.scan_module, NEW.priority, NEW.dependency_order, NEW.scan_id, NEW.not_before,
+                      NEW.lease_owner);
+            RETURN NEW;
+          ELSIF (TG_OP = 'UPDATE') THEN
+            UPDATE scanner_readyjob
+              SET priority = NEW.priority, not_before = NEW.not_before, lease_owner = NEW.lease_owner
+              WHERE job_id = NEW.id;
+            RETURN NEW;
+          ELSIF (TG_OP = 'DELETE') THEN
+            -- Without the lock, the transactions deleting the last jobs of
+            -- a dependency_order at the same time would each still see the
+            -- other job and none of them would make the next ones ready.
+            -- The queries of this function see the jobs deleted by the
+            -- transaction holding the lock before, as it has committed.
+            PERFORM pg_advisory_xact_lock(OLD.scan_id);
+            IF EXISTS (SELECT 1 FROM scanner_scanjob
+                       WHERE scan_id = OLD.scan_id AND dependency_order <= OLD.dependency_order) THEN
+              RETURN OLD;
+            END IF;
+            -- The last job of this dependency_order is gone, so the next
+            -- ones are ready now.
+            SELECT MIN(dependency_order) FROM scanner_scanjob WHERE scan_id = OLD.scan_id INTO next_order;
+            IF next_order IS NOT NULL THEN
+              INSERT INTO scanner_readyjob (job_id, scan_module, priority, dependency_order, scan_id, not_before,
+                                            lease_owner)
+                SELECT id, scan_module, priority, dependency_order, scan_id, not_before, lease_owner
+                FROM scanner_scanjob
+                WHERE scan_id = OLD.scan_id AND dependency_order = next_order
+                ON CONFLICT (job_id) DO NOTHING;
+            END IF;
+            RETURN OLD;
+          END IF;
+        END
+        $$;
+
+CREATE TRIGGER scanjob_ready AFTER INSERT OR DELETE OR UPDATE OF priority, not_before, lease_owner ON scanner_scanjob FOR EACH ROW EXECUTE PROCEDURE update_ready_jobs();
+
+COMMIT;
@@ -0,0 +1,9 @@
+--
+-- Stores how long the phases of the last try of a scan job took as
+-- {"phase/subphase": [seconds, count], ...}.
+--
+BEGIN;
+
+ALTER TABLE scanner_scaninfo ADD COLUMN spans jsonb;
+
+COMMIT;
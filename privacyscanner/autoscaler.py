@@ -0,0 +1,52 @@
+import os
+
+import psutil
+
+from privacyscanner.utils import get_tree_rss
+
+
+class Autoscaler:
+    """Decides how many workers should run based on the resources of the host.
+
+    Every interval seconds the master asks for the new number of workers.
+    A worker is added if all workers are busy, the load per CPU is below
+    max_load and the available memory would still be above memory_reserve
+    with one more worker. Workers are assumed to need as much memory as the
+    largest running worker (including its Chrome or testssl.sh processes).
+    A worker is removed if the available memory drops below memory_reserve
+    or the load per CPU is above max_load. The number of workers always
+    stays between min_workers and max_workers.
+
+    The memory values are given in MiB.
+    """
+    def __init__(self, min_workers=1, max_workers=None, memory_reserve=1024,
+                 max_load=1.0, interval=10):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.memory_reserve = memory_reserve * 1024 * 1024
+        self.max_load = max_load
+        self.interval = interval
+        self.last_sample = None
+
+    def get_num_workers(self, num_workers, worker_pids, num_busy):
+        sample = self._sample(worker_pids)
+        self.last_sample = sample
+        num_workers = min(max(num_workers, self.min_workers), self.max_workers)
+        if sample['available'] < self.memory_reserve or sample['load'] > self.max_load:
+            return max(num_workers - 1, self.min_workers)
+        free_memory = sample['available'] - self.memory_reserve
+        if (num_busy >= num_workers and sample['worker_rss'] < free_memory and
+                sample['load'] < self.max_load):
+            return min(num_workers + 1, self.max_workers)
+        return num_workers
+
+    def _sample(self, worker_pids):
+        load = psutil.getloadavg()[0] / (psutil.cpu_count() or 1)
+        worker_rss = max((get_tree_rss(pid) for pid in worker_pids), default=0)
+        return {
+            'load': load,
+            'available': psutil.virtual_memory().available,
+            'worker_rss': worker_rss
+        }
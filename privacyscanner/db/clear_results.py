@@ -21,7 +21,7 @@ def main(args: argparse.Namespace):
         config = load_config(args.config)
         db_config = config['QUEUE_DB_DSN']
         conn = PostgreSQLConnection(db_config=db_config)
-        query_string = '''TRUNCATE TABLE scanner_scaninfo, scanner_logentry, scanner_scanjob, scanner_scan, 
+        query_string = '''TRUNCATE TABLE scanner_scaninfo, scanner_logentry, scanner_scanjob, scanner_scanresult, scanner_scan, 
                           sites_site CASCADE;'''
         conn.cursor.execute(query_string)
         conn.conn.commit()
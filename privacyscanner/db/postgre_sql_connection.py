@@ -38,22 +38,24 @@ class PostgreSQLConnection:
         return results
 
     def insert_df_to_db(self, df: pd.DataFrame, table_name: str) -> None:
-        """Inserts a dataframe into a table by using a String buffer because this is fast.
+        """Inserts a dataframe into a table by using a String buffer because this is fast. The columns of the
+           dataframe have to be named like the ones of the table; columns of the table that the dataframe does not
+           have get their default value.
            See: https://github.com/NaysanSaran/pandas2postgresql/blob/master/notebooks/Psycopg2_Bulk_Insert_Speed_Benchmark.ipynb"""
         buffer = StringIO()
         df.to_csv(buffer, index=False, header=False, sep=";", quoting=csv.QUOTE_NONE)
         buffer.seek(0)
         string = buffer.getvalue()
-        self.cursor.copy_from(buffer, table_name, sep=";", null='NULL')
+        self.cursor.copy_from(buffer, table_name, sep=";", null='NULL', columns=list(df.columns))
         self.conn.commit()
 
     def query_live_db(self) -> list:
         """Returns a list of the sites in the database that have/will be scanned."""
         original_db_query = """
         select result, scanner_scaninfo.time_started, scanner_scaninfo.time_finished, sites_site.url
-        from scanner_scan, scanner_scaninfo, sites_site
-        where scanner_scan.id = scanner_scaninfo.scan_id and 
-        scanner_scan.site_id = sites_site.id and 
+        from scanner_scan_merged, scanner_scaninfo, sites_site
+        where scanner_scan_merged.id = scanner_scaninfo.scan_id and 
+        scanner_scan_merged.site_id = sites_site.id and 
         scan_module = 'cookiebanner';"""
         result = self.execute_query(original_db_query)
         return result
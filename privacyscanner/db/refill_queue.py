@@ -7,6 +7,7 @@ import pandas as pd
 
 from privacyscanner.db.postgre_sql_connection import PostgreSQLConnection
 from privacyscanner.db.utils import module_exists
+from privacyscanner.jobqueue import JOB_CHANNEL
 
 
 def _get_max_sequence_id(conn: PostgreSQLConnection, sequence_name: str) -> int:
@@ -115,6 +116,10 @@ def main(args: argparse.Namespace):
         _set_sequence_id(conn, 'scanner_scaninfo_id_seq', scanner_scan_id_seq_max_new)
         _set_sequence_id(conn, 'scanner_scanjob_id_seq', scanner_scan_id_seq_max_new)
 
+        # Wake up idle workers
+        conn.cursor.execute('NOTIFY {};'.format(JOB_CHANNEL))
+        conn.conn.commit()
+
         conn.close()
     except Exception as e:
         print('Could not insert sites to database.')
@@ -8,7 +8,40 @@ SCAN_MODULES = ['privacyscanner.scanmodules.chromedevtools.ChromeDevtoolsScanMod
                 'privacyscanner.scanmodules.testsslsh.TestsslshHttpsScanModule',
                 'privacyscanner.scanmodules.testsslsh.TestsslshMailScanModule',]
 NUM_WORKERS = 2
+# Set to a dict to adapt the number of workers to the load and the free
+# memory of the host, starting with NUM_WORKERS, e.g.
+# {'min_workers': 2, 'max_workers': 20, 'memory_reserve': 2048, 'max_load': 1.0}
+AUTOSCALE = None
+# Set to a dict to split the workers into pools which only process jobs of
+# some scan modules. See README.md.
+WORKER_POOLS = None
+# Replace a worker after this many jobs (None: no limit) ...
 MAX_EXECUTIONS = 100
+# ... or as soon as it grew too much, e.g.
+# {'max_rss_growth': 512, 'max_fds': 256, 'max_threads': 64} (RSS in MiB)
+WORKER_RECYCLING = None
+# 'spawn' starts every worker in a fresh interpreter. 'forkserver' forks
+# them from a server process which has already imported WORKER_PRELOAD and
+# loaded the scan modules and their data, e.g. tracker lists.
+WORKER_START_METHOD = 'spawn'
+WORKER_PRELOAD = ['psycopg2', 'toposort', 'dns.resolver', 'tldextract', 'cryptography',
+                  'PIL.Image', 'pychrome', 'websocket', 'requests']
 RAVEN_DSN = None
 MAX_TRIES = 3
+# Number of scan modules which `privacyscanner scan` and `scan_list` run at
+# the same time on a site if they do not depend on each other.
+MAX_CONCURRENT_MODULES = 1
+# Number of sites which every process of `privacyscanner scan_list` scans
+# at the same time. With the option browser_pool of the chromedevtools scan
+# module they share one Chrome, each in its own browser context.
+CONCURRENT_SITES = 1
+# Set to 'zstd' to compress the results of `privacyscanner scan` and
+# `scan_list` (requires the zstandard package).
+RESULTS_COMPRESSION = None
+# Seconds until a claimed job returns to the queue if the node running it
+# stops extending its lease, e.g., because it died.
+LEASE_DURATION = 60
+# Set to (host, port) to serve Prometheus metrics of the workers, e.g.
+# ('127.0.0.1', 9465).
+METRICS_ADDRESS = None
 STORAGE_PATH = '~/.local/share/privacyscanner'
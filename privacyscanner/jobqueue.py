@@ -1,58 +1,152 @@
+import os
+import select
+import socket
+import time
+from datetime import datetime
 from typing import NamedTuple
 
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import Json, execute_values
 
+from privacyscanner.spans import Spans
 from privacyscanner.utils.unicodehelper import eliminate_nullbytes
 
 
-_FETCH_JOB_QUERY = """
-WITH job AS (
-  SELECT sj1.id, si.num_tries
-  FROM scanner_scanjob AS sj1,
+# Claims up to %(limit)s ready jobs in one round trip, but never more than the
+# claim size of their scan module. The claim is committed right away as a
+# lease of the worker, which keeps the job in the queue (so that its
+# dependents wait for it), but hides it from other workers. The master of
+# the worker extends the lease until the job is done. If the node dies, the
+# lease expires and any master returns the job to the queue. The try is
+# counted in the same statement, so that a job which crashes its worker
+# cannot run more than max_tries times, even if the bookkeeping of the
+# master is late.
+_CLAIM_JOBS_QUERY = """
+WITH candidate AS (
+  SELECT rj.job_id AS id, rj.scan_module, si.num_tries, rj.priority, rj.scan_id, rj.dependency_order
+  FROM scanner_readyjob AS rj,
        scanner_scaninfo AS si
-  WHERE NOT EXISTS ( -- Make sure our dependencies are processed first
-    SELECT id
-    FROM scanner_scanjob AS sj2
-    WHERE sj2.dependency_order < sj1.dependency_order AND
-          sj2.scan_id = sj1.scan_id
-  ) AND sj1.scan_module IN %s
-    AND si.scan_id = sj1.scan_id
-    AND si.scan_module = sj1.scan_module
-    AND si.num_tries < %s
-    AND (sj1.not_before IS NULL OR sj1.not_before <= NOW())
-  ORDER BY sj1.priority DESC, sj1.scan_id, sj1.dependency_order
-  FOR UPDATE OF sj1 SKIP LOCKED
-  LIMIT 1
+  WHERE rj.lease_owner IS NULL
+    AND rj.scan_module IN %(scan_modules)s
+    AND si.scan_id = rj.scan_id
+    AND si.scan_module = rj.scan_module
+    AND si.num_tries < %(max_tries)s
+    AND (rj.not_before IS NULL OR rj.not_before <= NOW())
+  ORDER BY rj.priority DESC, rj.scan_id
+  FOR UPDATE OF rj SKIP LOCKED
+  LIMIT %(limit)s
+), job AS (
+  SELECT c.id, c.num_tries, c.scan_id, c.scan_module
+  FROM (
+    SELECT candidate.*, row_number() OVER (
+      PARTITION BY scan_module
+      ORDER BY priority DESC, scan_id, dependency_order
+    ) AS claim_rank
+    FROM candidate
+  ) AS c
+  JOIN unnest(%(claim_modules)s::text[], %(claim_sizes)s::int[])
+    AS m(scan_module, claim_size) ON m.scan_module = c.scan_module
+  WHERE c.claim_rank <= m.claim_size
+), tries AS (
+  UPDATE scanner_scaninfo AS si
+  SET num_tries = si.num_tries + 1
+  FROM job
+  WHERE si.scan_id = job.scan_id AND si.scan_module = job.scan_module
 )
+UPDATE scanner_scanjob AS sj
+SET lease_owner = %(lease_owner)s,
+    lease_worker = %(lease_worker)s,
+    lease_expires = NOW() + %(lease_duration)s * INTERVAL '1 second'
+FROM job
+WHERE sj.id = job.id
+RETURNING sj.id, sj.scan_id, sj.scan_module, job.num_tries, sj.dependency_order, sj.priority,
+  (SELECT s.time_started FROM scanner_scan AS s WHERE s.id = sj.scan_id) AS scan_created
+"""
+
+# Deleting or releasing a job only works while we hold its lease. If our
+# lease expired in the meantime, the job belongs to someone else now.
+_DELETE_JOB_QUERY = """
 DELETE FROM scanner_scanjob
-WHERE id = (SELECT id FROM job)
-RETURNING id, scan_id, scan_module, (SELECT num_tries FROM job) AS num_tries, dependency_order, priority
+WHERE id = %s AND lease_owner = %s AND lease_worker = %s
 """
 
-_FETCH_RESULT_QUERY = """
-SELECT (kv).key, (kv).value
-FROM (
-  SELECT jsonb_each(result) AS kv
-  FROM scanner_scan
-  WHERE id = %s
-) AS s
-WHERE (kv).key IN %s
+_RELEASE_JOBS_QUERY = """
+UPDATE scanner_scanjob
+SET lease_owner = NULL,
+    lease_worker = NULL,
+    lease_expires = NULL
+WHERE id IN %s AND lease_owner = %s AND lease_worker = %s
 """
 
-# _UPDATE_RESULT_QUERY = """
-# UPDATE scanner_scan
-# SET result = result || %s::jsonb
-# WHERE id = %s
-# """
+# Claimed jobs which were never started do not count as a try.
+_UNCOUNT_TRIES_QUERY = """
+UPDATE scanner_scaninfo AS si
+SET num_tries = GREATEST(0, si.num_tries - 1)
+FROM scanner_scanjob AS sj
+WHERE sj.id IN %s AND sj.lease_owner = %s AND sj.lease_worker = %s
+  AND si.scan_id = sj.scan_id AND si.scan_module = sj.scan_module
+"""
+
+_RELEASE_WORKER_JOBS_QUERY = """
+UPDATE scanner_scanjob
+SET lease_owner = NULL,
+    lease_worker = NULL,
+    lease_expires = NULL
+WHERE lease_owner = %s AND lease_worker = %s
+"""
+
+_EXTEND_LEASES_QUERY = """
+UPDATE scanner_scanjob
+SET lease_expires = NOW() + %s * INTERVAL '1 second'
+WHERE lease_owner = %s AND lease_worker = ANY(%s)
+"""
+
+_REAP_LEASES_QUERY = """
+WITH expired AS (
+  SELECT id, lease_owner
+  FROM scanner_scanjob
+  WHERE lease_expires < NOW()
+  FOR UPDATE SKIP LOCKED
+)
+UPDATE scanner_scanjob AS sj
+SET lease_owner = NULL,
+    lease_worker = NULL,
+    lease_expires = NULL
+FROM expired
+WHERE sj.id = expired.id
+RETURNING sj.id, expired.lease_owner
+"""
+
+# Results are stored per key in scanner_scanresult, so that a module only
+# writes its own updates and dependents only read the keys they need.
+# scanner_scan.result only holds the initial data of the scan (e.g. the
+# site_url) and results written before scanner_scanresult existed.
+_FETCH_RESULT_QUERY = """
+SELECT key, value
+FROM scanner_scanresult
+WHERE scan_id = %(scan_id)s AND key = ANY(%(keys)s)
+UNION ALL
+SELECT k.key, s.result -> k.key
+FROM scanner_scan AS s,
+     unnest(%(keys)s::text[]) AS k(key)
+WHERE s.id = %(scan_id)s AND s.result ? k.key AND NOT EXISTS (
+  SELECT 1
+  FROM scanner_scanresult AS sr
+  WHERE sr.scan_id = s.id AND sr.key = k.key
+)
+"""
 
 _UPDATE_RESULT_QUERY = """
-UPDATE scanner_scan
-SET result = regexp_replace(result::text, '\\u0000', '', 'g')::jsonb || regexp_replace(%s::text, '\\u0000', '', 'g')::jsonb
-WHERE id = %s
+INSERT INTO scanner_scanresult (scan_id, key, value, scan_module)
+VALUES %s
+ON CONFLICT (scan_id, key) DO UPDATE
+SET value = EXCLUDED.value,
+    scan_module = EXCLUDED.scan_module
 """
-#(regexp_replace(the_string::text, '
-#u0000', '', 'g'))::json
+
+_UPDATE_RESULT_TEMPLATE = '(%s, %s, %s::jsonb, %s)'
+
 _RESCHEDULE_JOB_QUERY = """
 INSERT INTO scanner_scanjob
 (scan_module, priority, dependency_order, scan_id, not_before)
@@ -65,6 +159,30 @@ SET num_tries = GREATEST(0, num_tries - 1)
 WHERE scan_id = %s AND scan_module = %s
 """
 
+# Workers LISTEN on this channel while they are idle. Everything that makes
+# a job ready to be fetched should NOTIFY it.
+JOB_CHANNEL = 'scanner_scanjob'
+
+_LISTEN_QUERY = 'LISTEN {}'.format(JOB_CHANNEL)
+
+_NOTIFY_QUERY = 'NOTIFY {}'.format(JOB_CHANNEL)
+
+# Finishing a job only makes other jobs ready if the same scan has jobs
+# which have been waiting for it.
+_NOTIFY_DEPENDENTS_QUERY = """
+SELECT pg_notify('{}', '')
+WHERE EXISTS (
+  SELECT id
+  FROM scanner_scanjob
+  WHERE scan_id = %s AND dependency_order > %s
+)
+""".format(JOB_CHANNEL)
+
+DEFAULT_LEASE_DURATION = 60
+
+_CONNECT_TIMEOUT = 5
+
+
 class Job(NamedTuple):
     scan_id: int
     scan_module: object
@@ -72,59 +190,267 @@ class Job(NamedTuple):
     num_tries: int
     dependency_order: int
     priority: int
+    job_id: int = None
+    scan_created: datetime = None
+
+
+class ClaimedJob(NamedTuple):
+    job_id: int
+    scan_id: int
+    scan_module_name: str
+    num_tries: int
+    dependency_order: int
+    priority: int
+    scan_created: datetime
+    expires: float
 
 
 class JobQueue:
-    def __init__(self, dsn, scan_modules, max_tries):
+    def __init__(self, dsn, scan_modules, max_tries, lease_owner=None, lease_worker=None,
+                 lease_duration=DEFAULT_LEASE_DURATION):
         self._dsn = dsn
         self._scan_modules = scan_modules
         self._available_modules = tuple(self._scan_modules.keys())
         self._max_tries = max_tries
+        if lease_owner is None:
+            lease_owner = socket.gethostname()
+        if lease_worker is None:
+            lease_worker = os.getpid()
+        self._lease_owner = lease_owner
+        self._lease_worker = lease_worker
+        self._lease_duration = lease_duration
+        self._claim_sizes = {}
+        self._claim_leases = {}
+        for scan_module in self._scan_modules.values():
+            self._claim_sizes[scan_module.name] = max(1, scan_module.options.get('claim_size', 1))
+            self._claim_leases[scan_module.name] = scan_module.options.get('claim_lease', 60)
+        self._buffer = []
         self._last_job = None
+        # The worker sets new spans for every job to time our queries.
+        self.spans = Spans()
         self._conn = None
+        self._listen_conn = None
         self._connect()
+        self._listen()
 
     def report_result(self, updates):
+        """Store the results of the last job and remove it from the queue.
+
+        Returns False if the lease of the job expired in the meantime.
+        The job belongs to someone else then, so the results are dropped.
+        """
         assert self._last_job is not None
-        with self._conn.cursor() as c:
-            updates = eliminate_nullbytes(updates)
-            c.execute(_UPDATE_RESULT_QUERY, (Json(updates), self._last_job.scan_id))
+        job = self._last_job
         self._last_job = None
-        self._conn.commit()
+        with self.spans.span('db_report_result'):
+            with self._conn.cursor() as c:
+                c.execute(_DELETE_JOB_QUERY, (job.job_id, self._lease_owner, self._lease_worker))
+                if c.rowcount == 0:
+                    self._conn.rollback()
+                    print('Dropped the result of {} for scan {}: its lease has expired.'.format(
+                        job.scan_module.name, job.scan_id))
+                    return False
+                updates = eliminate_nullbytes(updates)
+                if updates:
+                    rows = [(job.scan_id, key, Json(value), job.scan_module.name)
+                            for key, value in updates.items()]
+                    execute_values(c, _UPDATE_RESULT_QUERY, rows,
+                                   template=_UPDATE_RESULT_TEMPLATE)
+                c.execute(_NOTIFY_DEPENDENTS_QUERY, (job.scan_id, job.dependency_order))
+            self._conn.commit()
+        return True
 
     def report_failure(self):
         assert self._last_job is not None
+        with self.spans.span('db_report_failure'):
+            self._conn.rollback()
+            self._release_jobs([self._last_job.job_id])
         self._last_job = None
-        self._conn.rollback()
+
+    def release(self):
+        """Return all buffered jobs that have not been started to the queue."""
+        if self._buffer:
+            job_ids = [claimed_job.job_id for claimed_job in self._buffer]
+            self._buffer = []
+            self._release_jobs(job_ids, started=False)
+
+    def wait_for_job(self, timeout):
+        """Block until a new job is announced or timeout seconds passed.
+
+        Returns True if we have been notified, i.e., it is worth to ask
+        for a job again. Notifications that arrived while we were busy
+        will make this return immediately.
+        """
+        if self._listen_conn is None or self._listen_conn.closed:
+            try:
+                self._listen()
+            except psycopg2.OperationalError:
+                time.sleep(timeout)
+                return False
+        try:
+            self._listen_conn.poll()
+            if not self._listen_conn.notifies:
+                readable, _, _ = select.select([self._listen_conn], [], [], timeout)
+                if readable:
+                    self._listen_conn.poll()
+        except psycopg2.OperationalError:
+            self._listen_conn.close()
+            return False
+        notified = bool(self._listen_conn.notifies)
+        self._listen_conn.notifies.clear()
+        return notified
 
     def _connect(self):
         self._conn = psycopg2.connect(self._dsn)
 
+    def _listen(self):
+        self._listen_conn = psycopg2.connect(self._dsn)
+        self._listen_conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with self._listen_conn.cursor() as c:
+            c.execute(_LISTEN_QUERY)
+
     def get_job_nowait(self):
         assert self._last_job is None
         if self._conn.closed:
             self._connect()
-        with self._conn.cursor() as c:
-            c.execute(_FETCH_JOB_QUERY, (self._available_modules, self._max_tries))
-            job = c.fetchone()
-            if job:
-                job_id, scan_id, scan_module_name, num_tries, dependency_order, priority = job
-                scan_module = self._scan_modules[scan_module_name]
-                if scan_module.required_keys:
-                    c.execute(_FETCH_RESULT_QUERY, (scan_id, tuple(scan_module.required_keys)))
-                    result = dict(c.fetchall())
-                else:
-                    result = {}
-                job = Job(scan_id, scan_module, result, num_tries, dependency_order, priority)
-                self._last_job = job
-                return job
+        if not self._buffer:
+            self._claim_jobs()
+        expired_job_ids = []
+        job = None
+        while self._buffer:
+            claimed_job = self._buffer.pop(0)
+            if claimed_job.expires < time.monotonic():
+                expired_job_ids.append(claimed_job.job_id)
+                continue
+            with self._conn.cursor() as c:
+                job = self._make_job(c, claimed_job.job_id, claimed_job.scan_id,
+                                     claimed_job.scan_module_name, claimed_job.num_tries,
+                                     claimed_job.dependency_order, claimed_job.priority,
+                                     claimed_job.scan_created)
+            # Our claim is already committed, so do not keep the snapshot
+            # open while the job is running.
+            self._conn.commit()
+            self._last_job = job
+            break
+        if expired_job_ids:
+            self._release_jobs(expired_job_ids, started=False)
+        return job
+
+    def _claim_jobs(self):
+        if not self._claim_sizes:
+            return
+        claim_modules = list(self._claim_sizes)
+        params = {
+            'scan_modules': self._available_modules,
+            'max_tries': self._max_tries,
+            'limit': max(self._claim_sizes.values()),
+            'claim_modules': claim_modules,
+            'claim_sizes': [self._claim_sizes[name] for name in claim_modules],
+            'lease_owner': self._lease_owner,
+            'lease_worker': self._lease_worker,
+            'lease_duration': self._lease_duration
+        }
+        with self.spans.span('db_claim'):
+            with self._conn.cursor() as c:
+                c.execute(_CLAIM_JOBS_QUERY, params)
+                rows = c.fetchall()
+            self._conn.commit()
+        # The returned rows are unordered, so restore the queue order.
+        rows.sort(key=lambda row: (-row[5], row[1], row[4]))
+        now = time.monotonic()
+        for (job_id, scan_id, scan_module_name, num_tries, dependency_order, priority,
+             scan_created) in rows:
+            expires = now + self._claim_leases[scan_module_name]
+            self._buffer.append(ClaimedJob(job_id, scan_id, scan_module_name, num_tries,
+                                           dependency_order, priority, scan_created, expires))
+
+    def _release_jobs(self, job_ids, started=True):
+        if self._conn.closed:
+            self._connect()
+        with self.spans.span('db_release'):
+            with self._conn.cursor() as c:
+                if not started:
+                    c.execute(_UNCOUNT_TRIES_QUERY, (tuple(job_ids), self._lease_owner,
+                                                     self._lease_worker))
+                c.execute(_RELEASE_JOBS_QUERY, (tuple(job_ids), self._lease_owner,
+                                                self._lease_worker))
+                c.execute(_NOTIFY_QUERY)
+            self._conn.commit()
+
+    def _make_job(self, cursor, job_id, scan_id, scan_module_name, num_tries,
+                  dependency_order, priority, scan_created=None):
+        scan_module = self._scan_modules[scan_module_name]
+        with self.spans.span('db_fetch_result'):
+            if scan_module.required_keys:
+                cursor.execute(_FETCH_RESULT_QUERY, {'scan_id': scan_id,
+                                                     'keys': list(scan_module.required_keys)})
+                result = dict(cursor.fetchall())
+            else:
+                result = {}
+        return Job(scan_id, scan_module, result, num_tries, dependency_order, priority, job_id,
+                   scan_created)
 
     def reschedule(self, not_before=None):
         assert self._last_job is not None
-        with self._conn.cursor() as c:
-            params = (self._last_job.scan_module.name, self._last_job.priority,
-                      self._last_job.dependency_order, self._last_job.scan_id,
-                      not_before)
-            c.execute(_RESCHEDULE_JOB_QUERY, params)
-            c.execute(_INCREASE_TRIES_QUERY, (self._last_job.scan_id,
-                                              self._last_job.scan_module.name))
+        with self.spans.span('db_reschedule'):
+            with self._conn.cursor() as c:
+                params = (self._last_job.scan_module.name, self._last_job.priority,
+                          self._last_job.dependency_order, self._last_job.scan_id,
+                          not_before)
+                c.execute(_RESCHEDULE_JOB_QUERY, params)
+                c.execute(_INCREASE_TRIES_QUERY, (self._last_job.scan_id,
+                                                  self._last_job.scan_module.name))
+                # Delivered when the result is reported. Jobs which have to wait
+                # are picked up by the fallback polling of idle workers.
+                if not_before is None:
+                    c.execute(_NOTIFY_QUERY)
+
+
+class LeaseKeeper:
+    """Keeps the leases of the jobs of our workers and reaps expired leases.
+
+    The master calls extend() regularly for all of its workers, so that
+    their jobs stay leased as long as the workers are alive. reap() returns
+    jobs whose leases expired, e.g., because their node died, to the queue.
+    Database problems are reported, but do not stop the master; a lease
+    simply expires if it could not be extended for lease_duration seconds.
+    """
+    def __init__(self, dsn, lease_owner, lease_duration=DEFAULT_LEASE_DURATION):
+        self._dsn = dsn
+        self.lease_owner = lease_owner
+        self.lease_duration = lease_duration
+        self._conn = None
+
+    def extend(self, worker_pids):
+        if worker_pids:
+            self._execute(_EXTEND_LEASES_QUERY, (self.lease_duration, self.lease_owner,
+                                                 list(worker_pids)))
+
+    def release_worker(self, worker_pid):
+        """Return all jobs of a worker which is gone to the queue."""
+        self._execute(_RELEASE_WORKER_JOBS_QUERY, (self.lease_owner, worker_pid), notify=True)
+
+    def reap(self):
+        rows = self._execute(_REAP_LEASES_QUERY, notify=True)
+        if rows:
+            owners = sorted({owner for _, owner in rows})
+            print('Returned {} jobs with expired leases of {} to the queue.'.format(
+                len(rows), ', '.join(owners)))
+        return rows
+
+    def _execute(self, query, params=None, notify=False):
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn = psycopg2.connect(self._dsn, connect_timeout=_CONNECT_TIMEOUT)
+            with self._conn.cursor() as c:
+                c.execute(query, params)
+                rows = c.fetchall() if c.description else None
+                if notify and (rows is None or rows):
+                    c.execute(_NOTIFY_QUERY)
+            self._conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if self._conn is not None and not self._conn.closed:
+                self._conn.close()
+            print('Could not update job leases: {}'.format(e))
+            return None
+        return rows
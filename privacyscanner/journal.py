@@ -0,0 +1,96 @@
+"""Writes the results of `privacyscanner scan` and `scan_list` to disk.
+
+While a site is scanned, the updates of every scan module are appended
+to a journal in the JSON Lines format, so that a scan module does not
+rewrite the results of all others. When the scan is finished, the
+results are written once as a compact JSON document and the journal is
+removed. If the scan was interrupted, replaying the journal restores the
+results of the scan modules which finished.
+"""
+import importlib.util
+import json
+import os
+
+# zstandard is only imported when results are compressed, so that it does
+# not slow down the start of every command.
+has_zstandard = importlib.util.find_spec('zstandard') is not None
+
+
+JOURNAL_FILENAME = 'results.jsonl'
+RESULTS_FILENAME = 'results.json'
+COMPRESSIONS = {None: RESULTS_FILENAME, 'zstd': RESULTS_FILENAME + '.zst'}
+
+
+class ResultJournal:
+    def __init__(self, results_dir):
+        self.results_dir = results_dir
+        self.path = results_dir / JOURNAL_FILENAME
+        self._file = None
+
+    def exists(self):
+        return self.path.exists()
+
+    def start(self, result_dict):
+        """Start a new journal with the results before the first scan module."""
+        self.close()
+        for filename in COMPRESSIONS.values():
+            try:
+                (self.results_dir / filename).unlink()
+            except FileNotFoundError:
+                pass
+        self._file = self.path.open('w')
+        self.append(None, result_dict)
+
+    def append(self, scan_module_name, updates, removed=()):
+        """Append the keys a scan module updated and the keys it removed."""
+        if self._file is None:
+            self._file = self.path.open('a')
+        entry = {'scan_module': scan_module_name, 'updates': updates}
+        if removed:
+            entry['removed'] = sorted(removed)
+        self._file.write(json.dumps(entry, separators=(',', ':'), sort_keys=True) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def replay(self):
+        """Return the results of the journal."""
+        result_dict = {}
+        with self.path.open() as f:
+            lines = f.readlines()
+        for i, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last entry is incomplete if the scan was interrupted
+                # while writing it.
+                if i == len(lines) - 1:
+                    break
+                raise
+            result_dict.update(entry['updates'])
+            for key in entry.get('removed', ()):
+                result_dict.pop(key, None)
+        return result_dict
+
+    def materialize(self, result_dict, compression=None):
+        """Write the results as one document and remove the journal.
+
+        Returns the path of the document.
+        """
+        self.close()
+        results_file = self.results_dir / COMPRESSIONS[compression]
+        temp_file = results_file.with_name(results_file.name + '.tmp')
+        data = json.dumps(result_dict, separators=(',', ':'), sort_keys=True).encode()
+        if compression == 'zstd':
+            import zstandard
+            data = zstandard.ZstdCompressor().compress(data)
+        with temp_file.open('wb') as f:
+            f.write(data)
+        temp_file.replace(results_file)
+        self.path.unlink()
+        return results_file
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
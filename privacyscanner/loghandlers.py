@@ -2,16 +2,15 @@ import logging
 
 
 class WorkerWritePipeHandler(logging.Handler):
-    def __init__(self, pid, write_pipe, *args, **kwargs):
+    def __init__(self, master_connection, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.pid = pid
-        self.write_pipe = write_pipe
+        self.master_connection = master_connection
         fmt = '%(message)s (%(filename)s:%(lineno)d)'
         self.setFormatter(logging.Formatter(fmt))
 
     def emit(self, record):
         message = self.format(record)
-        self.write_pipe.send((self.pid, 'log', (record.created, record.levelno, message)))
+        self.master_connection.send('log', (record.created, record.levelno, message))
 
 
 class ScanFileHandler(logging.FileHandler):
@@ -0,0 +1,60 @@
+"""Loads the scan modules and their datasets in the forkserver.
+
+The forkserver of multiprocessing can only import modules before it forks
+the workers. The master therefore puts its scan modules and their options
+into the environment of the server, and importing this module in the
+server loads them, including the read-only datasets of the scan modules
+(see ScanModule.preload). Workers forked from the server share them and
+do not have to load them again.
+"""
+import base64
+import os
+import pickle
+import sys
+import traceback
+from copy import deepcopy
+
+from privacyscanner.scanmodules import load_modules
+
+
+_ENVIRON_KEY = 'PRIVACYSCANNER_PRELOAD'
+
+# The scan modules loaded in the forkserver, or None if nothing was
+# preloaded, e.g., if the workers are spawned.
+scan_modules = None
+_scan_module_args = None
+
+
+def set_preload(scan_module_list, scan_module_options):
+    """Make the forkserver load these scan modules when it starts."""
+    value = pickle.dumps((scan_module_list, scan_module_options))
+    os.environ[_ENVIRON_KEY] = base64.b64encode(value).decode()
+
+
+def get_scan_modules(scan_module_list, scan_module_options):
+    """Return the preloaded scan modules if they match the arguments, else load them."""
+    if scan_modules is not None and _scan_module_args == (scan_module_list, scan_module_options):
+        return scan_modules
+    return load_modules(scan_module_list, scan_module_options)
+
+
+def _preload():
+    global scan_modules, _scan_module_args
+
+    args = pickle.loads(base64.b64decode(os.environ[_ENVIRON_KEY]))
+    # load_modules() modifies the options.
+    loaded_modules = load_modules(*deepcopy(args))
+    for scan_module in loaded_modules.values():
+        scan_module.preload()
+    scan_modules = loaded_modules
+    _scan_module_args = args
+
+
+if _ENVIRON_KEY in os.environ:
+    # An exception would stop the forkserver and with it every worker, so
+    # the workers rather load what is missing themselves.
+    try:
+        _preload()
+    except Exception:
+        print('Could not preload the scan modules:', file=sys.stderr)
+        traceback.print_exc()
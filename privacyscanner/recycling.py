@@ -0,0 +1,51 @@
+import psutil
+
+
+class ResourceUsage:
+    def __init__(self, rss, num_fds, num_threads):
+        self.rss = rss
+        self.num_fds = num_fds
+        self.num_threads = num_threads
+
+    @classmethod
+    def measure(cls, process):
+        with process.oneshot():
+            return cls(process.memory_info().rss, process.num_fds(), process.num_threads())
+
+
+class RecyclingPolicy:
+    """Decides when a worker should be replaced by a fresh one.
+
+    Some scan modules leave memory, file descriptors or threads behind in
+    the worker. Instead of replacing workers after a fixed number of jobs,
+    a worker is replaced if its RSS grew by more than max_rss_growth MiB
+    since its first job, or if it has more than max_fds open files or
+    more than max_threads threads. Limits which are None are not checked.
+    """
+    def __init__(self, max_rss_growth=None, max_fds=None, max_threads=None):
+        self.max_rss_growth = None
+        if max_rss_growth is not None:
+            self.max_rss_growth = max_rss_growth * 1024 * 1024
+        self.max_fds = max_fds
+        self.max_threads = max_threads
+        self._process = psutil.Process()
+        self._baseline_rss = None
+
+    def measure(self):
+        return ResourceUsage.measure(self._process)
+
+    def get_recycle_reason(self, usage):
+        """Return why the worker should be replaced or None if it may continue."""
+        # Caches and lazily imported modules are filled during the first
+        # job. This is not a leak, so we only count the growth after it.
+        if self._baseline_rss is None:
+            self._baseline_rss = usage.rss
+            return None
+        growth = usage.rss - self._baseline_rss
+        if self.max_rss_growth is not None and growth > self.max_rss_growth:
+            return 'RSS grew by {} MiB'.format(growth // 2**20)
+        if self.max_fds is not None and usage.num_fds > self.max_fds:
+            return '{} open file descriptors'.format(usage.num_fds)
+        if self.max_threads is not None and usage.num_threads > self.max_threads:
+            return '{} threads'.format(usage.num_threads)
+        return None
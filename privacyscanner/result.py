@@ -1,3 +1,6 @@
+from copy import deepcopy
+
+
 class Result(object):
     def __init__(self, result_dict, file_handler):
         self._result_dict = result_dict
@@ -27,6 +30,10 @@ class Result(object):
         self.mark_dirty(key)
         self._result_dict[key] = value
 
+    def __delitem__(self, key):
+        self._updated_keys.discard(key)
+        del self._result_dict[key]
+
     def __contains__(self, key):
         return key in self._result_dict
 
@@ -60,8 +67,15 @@ class Result(object):
     def mark_dirty(self, key):
         self._updated_keys.add(key)
 
+    def copy(self):
+        """Return a result with a deep copy of the results and no updates."""
+        return Result(deepcopy(self._result_dict), self._file_handler)
+
     def get_updates(self):
         return {key: self._result_dict[key] for key in self._updated_keys}
 
+    def clear_updates(self):
+        self._updated_keys = set()
+
     def get_results(self):
         return self._result_dict
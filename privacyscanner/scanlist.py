@@ -0,0 +1,362 @@
+"""Scans a list of sites with a local pool of processes.
+
+This is `privacyscanner scan_list`, the counterpart of `privacyscanner
+scan` for many sites which does not need a PostgreSQL database. The
+state of every site is kept in a SQLite database in the results
+directory, so an interrupted run continues where it stopped when it is
+started again with the same results directory.
+
+Every process of the pool scans up to CONCURRENT_SITES sites at the same
+time in threads. Most of the time of a scan is spent waiting for pages,
+so with the option browser_pool of the chromedevtools scan module these
+sites share one Chrome, each in its own browser context.
+"""
+import csv
+import errno
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from multiprocessing.util import Finalize
+from pathlib import Path
+from urllib.parse import urlparse
+
+from privacyscanner.filehandlers import DirectoryFileHandler
+from privacyscanner.journal import ResultJournal
+from privacyscanner.result import Result
+from privacyscanner.scanmodules import load_modules
+from privacyscanner.scanner import CommandError, QueueEntry, create_scan_queue, \
+    get_results_dir_name, order_scan_modules, run_scan_queue
+from privacyscanner.spans import Spans
+
+
+QUEUE_FILENAME = 'queue.sqlite3'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS site (
+    id INTEGER PRIMARY KEY,
+    site_url TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'pending',
+    scan_queue TEXT,
+    not_before REAL,
+    has_error INTEGER NOT NULL DEFAULT 0,
+    time_started REAL,
+    time_finished REAL
+);
+CREATE INDEX IF NOT EXISTS site_state ON site (state, not_before);
+'''
+
+
+def read_site_list(filename, number_of_entries=None):
+    """Read the sites of a list in the format of `privacyscanner insert`.
+
+    The list is either one domain or URL per line or a CSV file with the
+    header `rank,domain`. Domains are scanned with https.
+    """
+    site_urls = []
+    try:
+        with open(filename, newline='') as f:
+            rows = [row for row in csv.reader(f) if row]
+    except IOError as e:
+        raise CommandError('Could not open site list: {}'.format(e)) from e
+    if rows and [value.strip() for value in rows[0]] == ['rank', 'domain']:
+        rows = [row[1:] for row in rows[1:]]
+    for row in rows:
+        if len(row) != 1:
+            raise CommandError('Site list must contain one site per line or the '
+                               'columns rank,domain: {}'.format(','.join(row)))
+        site_url = row[0].strip()
+        if '://' not in site_url:
+            site_url = 'https://' + site_url
+        if urlparse(site_url).scheme not in ('http', 'https'):
+            raise CommandError('Invalid site: {}'.format(site_url))
+        site_urls.append(site_url)
+        if number_of_entries is not None and len(site_urls) == number_of_entries:
+            break
+    return site_urls
+
+
+class SiteQueue:
+    """The state of the sites of a scan_list run in a SQLite database.
+
+    A site is pending until a process scans it, then running and finally
+    finished. A site whose next scan module raised RescheduleLater is
+    pending again with the remaining scan modules in scan_queue and is
+    not claimed before not_before. Only one process can open a queue.
+    """
+    def __init__(self, filename):
+        self._lock_file = open(str(filename) + '.lock', 'wb')
+        try:
+            fcntl.lockf(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            self._lock_file.close()
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                raise CommandError('Another scan_list is running in this results directory.')
+            raise
+        self._conn = sqlite3.connect(str(filename))
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+        self._lock_file.close()
+
+    def add_sites(self, site_urls):
+        """Add the sites which are not in the queue yet and return their number."""
+        num_sites = self.count()
+        with self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO site (site_url) VALUES (?)',
+                                   ((site_url,) for site_url in site_urls))
+        return self.count() - num_sites
+
+    def reset_running(self):
+        """Make the sites pending again which a previous run did not finish."""
+        with self._conn:
+            cursor = self._conn.execute(
+                "UPDATE site SET state = 'pending' WHERE state = 'running'")
+        return cursor.rowcount
+
+    def claim(self, limit):
+        """Return up to limit sites which can be scanned now and mark them running.
+
+        Every site is returned as (id, site_url, scan_queue, has_error),
+        where scan_queue is None if no scan module of it ran yet.
+        """
+        with self._conn:
+            rows = self._conn.execute(
+                "SELECT id, site_url, scan_queue, has_error FROM site "
+                "WHERE state = 'pending' AND (not_before IS NULL OR not_before <= ?) "
+                "ORDER BY not_before IS NOT NULL, not_before, id LIMIT ?",
+                (time.time(), limit)).fetchall()
+            self._conn.executemany(
+                "UPDATE site SET state = 'running', time_started = COALESCE(time_started, ?) "
+                "WHERE id = ?", ((time.time(), row[0]) for row in rows))
+        return [(site_id, site_url, _load_scan_queue(scan_queue), bool(has_error))
+                for site_id, site_url, scan_queue, has_error in rows]
+
+    def release(self, site_id, scan_queue, has_error):
+        """Make a site pending again until its next scan module may run."""
+        not_before = scan_queue[-1].not_before
+        with self._conn:
+            self._conn.execute(
+                "UPDATE site SET state = 'pending', scan_queue = ?, not_before = ?, "
+                "has_error = ? WHERE id = ?",
+                (_dump_scan_queue(scan_queue), _to_timestamp(not_before), has_error, site_id))
+
+    def finish(self, site_id, has_error):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE site SET state = 'finished', scan_queue = '[]', not_before = NULL, "
+                "has_error = ?, time_finished = ? WHERE id = ?",
+                (has_error, time.time(), site_id))
+
+    def get_next_not_before(self):
+        """Return when the next pending site may be scanned or None if none is pending."""
+        row = self._conn.execute(
+            "SELECT COUNT(*), MIN(COALESCE(not_before, 0)) FROM site "
+            "WHERE state = 'pending'").fetchone()
+        return row[1] if row[0] else None
+
+    def count(self, state=None, has_error=None):
+        query = 'SELECT COUNT(*) FROM site WHERE 1 = 1'
+        params = []
+        if state is not None:
+            query += ' AND state = ?'
+            params.append(state)
+        if has_error is not None:
+            query += ' AND has_error = ?'
+            params.append(has_error)
+        return self._conn.execute(query, params).fetchone()[0]
+
+
+def _to_timestamp(not_before):
+    # RescheduleLater.not_before is a naive datetime in UTC.
+    if not_before is None:
+        return None
+    return (not_before - datetime(1970, 1, 1)).total_seconds()
+
+
+def _dump_scan_queue(scan_queue):
+    return json.dumps([(entry.scan_module_name, entry.num_try, _to_timestamp(entry.not_before))
+                       for entry in scan_queue])
+
+
+def _load_scan_queue(value):
+    if value is None:
+        return None
+    return [QueueEntry(scan_module_name, num_try,
+                       datetime.utcfromtimestamp(not_before) if not_before is not None else None)
+            for scan_module_name, num_try, not_before in json.loads(value)]
+
+
+# The scan modules of a process of the pool, which are loaded once by
+# _init_process and then scan all sites the process gets.
+_scan_modules = None
+_config = None
+
+
+def _init_process(config):
+    global _scan_modules, _config
+
+    _config = config
+    _scan_modules = load_modules(config['SCAN_MODULES'], config['SCAN_MODULE_OPTIONS'])
+    # The processes of the pool do not run atexit handlers, only finalizers.
+    Finalize(None, _close_scan_modules, exitpriority=10)
+    if config['CONCURRENT_SITES'] > 1:
+        # The sites of a process cannot have a working directory each.
+        temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(temp_dir.name)
+        Finalize(None, temp_dir.cleanup, exitpriority=0)
+
+
+def _close_scan_modules():
+    for scan_module in _scan_modules.values():
+        scan_module.close()
+
+
+def _scan_sites(sites, scan_module_names):
+    """Scan sites at the same time in a process of the pool.
+
+    sites is a list of (site_url, results_dir, scan_queue, has_error).
+    Returns the result of _scan_site() for every site. A site whose scan
+    raised an exception is finished with an error, the others go on.
+    """
+    if len(sites) == 1:
+        return [_scan_site_safely(*sites[0], scan_module_names=scan_module_names)]
+    with ThreadPoolExecutor(len(sites)) as executor:
+        futures = [executor.submit(_scan_site_safely, *site, scan_module_names=scan_module_names)
+                   for site in sites]
+        return [future.result() for future in futures]
+
+
+def _scan_site_safely(site_url, results_dir, scan_queue, has_error, scan_module_names):
+    try:
+        return _scan_site(site_url, results_dir, scan_module_names, scan_queue, has_error)
+    except Exception:
+        logging.exception('Could not scan %s', site_url)
+        return [], True
+
+
+def _scan_site(site_url, results_dir, scan_module_names, scan_queue, has_error):
+    """Run the scan modules of scan_queue on a site in a process of the pool.
+
+    Returns the scan modules which still have to run and whether a scan
+    module failed.
+    """
+    results_dir.mkdir(exist_ok=True)
+    journal = ResultJournal(results_dir)
+    if scan_queue is not None and journal.exists():
+        # Scan modules which depend on others need their results.
+        result_json = journal.replay()
+    else:
+        scan_queue = create_scan_queue(scan_module_names)
+        result_json = {'site_url': site_url}
+        journal.start(result_json)
+    result = Result(result_json, DirectoryFileHandler(results_dir))
+    logs_dir = results_dir / 'logs'
+    logs_dir.mkdir(exist_ok=True)
+    lock_dir = _config['STORAGE_PATH'] / 'locks'
+    lock_dir.mkdir(exist_ok=True)
+    try:
+        has_error |= run_scan_queue(scan_queue, _scan_modules, result, journal, logs_dir,
+                                    lock_dir, _config['MAX_TRIES'], Spans(), wait=False,
+                                    max_concurrency=_config['MAX_CONCURRENT_MODULES'],
+                                    change_dir=_config['CONCURRENT_SITES'] == 1)
+    finally:
+        journal.close()
+    if not scan_queue:
+        journal.materialize(result.get_results(), _config['RESULTS_COMPRESSION'])
+    return scan_queue, has_error
+
+
+def scan_list(config, site_urls, results_dir, num_processes, scan_module_names=None,
+              skip_dependencies=False, concurrent_sites=1):
+    results_dir = Path(results_dir).resolve()
+    try:
+        results_dir.mkdir(exist_ok=True)
+    except IOError as e:
+        raise CommandError('Could not create results directory: {}'.format(e)) from e
+
+    # Loaded here only to check the names of the scan modules and to
+    # order them. The processes of the pool load their own.
+    scan_module_names = order_scan_modules(
+        load_modules(config['SCAN_MODULES'], config['SCAN_MODULE_OPTIONS']),
+        scan_module_names, skip_dependencies)
+
+    site_queue = SiteQueue(results_dir / QUEUE_FILENAME)
+    try:
+        num_reset = site_queue.reset_running()
+        if num_reset:
+            print('Resuming {} sites of an interrupted run.'.format(num_reset))
+        num_added = site_queue.add_sites(site_urls)
+        num_total = site_queue.count()
+        num_finished = site_queue.count(state='finished')
+        print('{} sites added, {} of {} sites are finished.'.format(
+            num_added, num_finished, num_total))
+        # The processes of the pool get only what they need of the config.
+        process_config = {key: config[key] for key in (
+            'SCAN_MODULES', 'SCAN_MODULE_OPTIONS', 'STORAGE_PATH', 'MAX_TRIES',
+            'MAX_CONCURRENT_MODULES', 'RESULTS_COMPRESSION')}
+        process_config['CONCURRENT_SITES'] = concurrent_sites
+        try:
+            _run_pool(site_queue, process_config, results_dir, scan_module_names, num_processes,
+                      concurrent_sites, num_finished, num_total)
+        except KeyboardInterrupt:
+            raise CommandError('\nInterrupted. Run the same command again to continue.')
+        print('\n{} sites finished, {} of them with errors. Results are in {}.'.format(
+            site_queue.count(state='finished'), site_queue.count(has_error=True), results_dir))
+    finally:
+        site_queue.close()
+
+
+def _run_pool(site_queue, config, results_dir, scan_module_names, num_processes,
+              concurrent_sites, num_finished, num_total):
+    running = {}
+    with ProcessPoolExecutor(num_processes, initializer=_init_process,
+                             initargs=(config,)) as executor:
+        while True:
+            num_idle = num_processes - len(running)
+            if num_idle:
+                claimed = site_queue.claim(num_idle * concurrent_sites)
+                # Spread the sites over the idle processes instead of
+                # filling one process after the other.
+                for batch in (claimed[i::num_idle] for i in range(num_idle)):
+                    if not batch:
+                        continue
+                    sites = [(site_url, results_dir / get_results_dir_name(site_url),
+                              scan_queue, has_error)
+                             for site_id, site_url, scan_queue, has_error in batch]
+                    future = executor.submit(_scan_sites, sites, scan_module_names)
+                    running[future] = [(site_id, site_url) for site_id, site_url, _, _ in batch]
+            if not running:
+                next_not_before = site_queue.get_next_not_before()
+                if next_not_before is None:
+                    break
+                time.sleep(min(max(next_not_before - time.time(), 0.1), 1))
+                continue
+            done, _ = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = running.pop(future)
+                try:
+                    outcomes = future.result()
+                except BrokenProcessPool as e:
+                    raise CommandError('A process of the pool died. Run the same command '
+                                       'again to continue.') from e
+                except Exception:
+                    logging.exception('Could not scan %s', ', '.join(
+                        site_url for _, site_url in batch))
+                    outcomes = [([], True)] * len(batch)
+                for (site_id, site_url), (scan_queue, has_error) in zip(batch, outcomes):
+                    if scan_queue:
+                        site_queue.release(site_id, scan_queue, has_error)
+                        status = 'rescheduled'
+                    else:
+                        site_queue.finish(site_id, has_error)
+                        num_finished += 1
+                        status = 'failed' if has_error else 'finished'
+                    print('[{}/{}] {} {}'.format(num_finished, num_total, site_url, status))
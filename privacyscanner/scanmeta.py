@@ -1,8 +1,17 @@
+from privacyscanner.spans import Spans
+
+
 class ScanMeta:
-    def __init__(self, worker_id, num_tries):
+    def __init__(self, worker_id, num_tries, spans=None):
         self.worker_id = worker_id
         self.num_tries = num_tries
+        if spans is None:
+            spans = Spans()
+        self.spans = spans
 
     @property
     def is_first_try(self):
         return self.num_tries == 1
+
+    def span(self, name):
+        return self.spans.span(name)
@@ -1,5 +1,6 @@
 import importlib
 import logging
+import threading
 from typing import Any, Dict, List
 
 
@@ -11,12 +12,22 @@ class ScanModule:
     name = None  # type: str
     dependencies = None  # type: List[str]
     required_keys = None  # type: List[str]
-    logger = None  # type: logging.Logger
     options = None  # type: Dict[str, Any]
 
     def __init__(self, options):
         self.options = options
-        self.logger = logging.Logger(self.name)
+        # Sites which are scanned at the same time (CONCURRENT_SITES) share
+        # the scan module, so the logger of a scan belongs to its thread.
+        self._local = threading.local()
+        self._default_logger = logging.Logger(self.name)
+
+    @property
+    def logger(self):  # type: () -> logging.Logger
+        return getattr(self._local, 'logger', self._default_logger)
+
+    @logger.setter
+    def logger(self, logger):
+        self._local.logger = logger
 
     def scan_site(self, result, meta):
         raise NotImplemented
@@ -24,6 +35,14 @@ class ScanModule:
     def update_dependencies(self):
         pass
 
+    def preload(self):
+        """Load read-only data, e.g., lists of trackers, before the first scan."""
+        pass
+
+    def close(self):
+        """Release resources which are kept between scans."""
+        pass
+
 
 def load_modules(module_list, module_options):
     scan_modules = {}
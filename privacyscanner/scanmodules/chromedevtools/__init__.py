@@ -3,27 +3,37 @@ from pathlib import Path
 from privacyscanner.filehandlers import NoOpFileHandler
 from privacyscanner.result import Result
 from privacyscanner.scanmodules import ScanModule
-from privacyscanner.scanmodules.chromedevtools.chromescan import ChromeScan, find_chrome_executable
-from privacyscanner.scanmodules.chromedevtools.extractors import FinalUrlExtractor, \
-    GoogleAnalyticsExtractor, CookiesExtractor, RequestsExtractor, RedirectChainExtractor, \
-    TLSDetailsExtractor, CertificateExtractor, ThirdPartyExtractor, InsecureContentExtractor, \
-    FailedRequestsExtractor, SecurityHeadersExtractor, TrackerDetectExtractor, \
-    CookieStatsExtractor, JavaScriptLibsExtractor, ScreenshotExtractor, ImprintExtractor, \
-    HSTSPreloadExtractor, FingerprintingExtractor
-from privacyscanner.scanmodules.chromedevtools.utils import TLDEXTRACT_CACHE_FILE, parse_domain
+from privacyscanner.scanmodules.chromedevtools.utils import TLDEXTRACT_CACHE_FILE, parse_domain, \
+    find_chrome_executable
 from privacyscanner.utils import file_is_outdated, set_default_options, calculate_jaccard_index
 
 
-EXTRACTOR_CLASSES = [FinalUrlExtractor, RedirectChainExtractor, GoogleAnalyticsExtractor,
-                     CookiesExtractor, RequestsExtractor, TLSDetailsExtractor,
-                     CertificateExtractor, ThirdPartyExtractor, InsecureContentExtractor,
-                     FailedRequestsExtractor, SecurityHeadersExtractor, TrackerDetectExtractor,
-                     CookieStatsExtractor, JavaScriptLibsExtractor, ScreenshotExtractor,
-                     ImprintExtractor, HSTSPreloadExtractor, FingerprintingExtractor]
+# The browser and the extractors are imported when they are needed, so
+# that loading the scan module, e.g., in `privacyscanner print_master_config`,
+# or importing parse_domain from here does not import their libraries.
+def _get_extractor_classes():
+    from privacyscanner.scanmodules.chromedevtools.extractors import FinalUrlExtractor, \
+        GoogleAnalyticsExtractor, CookiesExtractor, RequestsExtractor, RedirectChainExtractor, \
+        TLSDetailsExtractor, CertificateExtractor, ThirdPartyExtractor, InsecureContentExtractor, \
+        FailedRequestsExtractor, SecurityHeadersExtractor, TrackerDetectExtractor, \
+        CookieStatsExtractor, JavaScriptLibsExtractor, ScreenshotExtractor, ImprintExtractor, \
+        HSTSPreloadExtractor, FingerprintingExtractor
 
-EXTRACTOR_CLASSES_HTTPS_RUN = [FinalUrlExtractor, TLSDetailsExtractor, CertificateExtractor,
-                               InsecureContentExtractor, SecurityHeadersExtractor,
-                               HSTSPreloadExtractor]
+    return [FinalUrlExtractor, RedirectChainExtractor, GoogleAnalyticsExtractor,
+            CookiesExtractor, RequestsExtractor, TLSDetailsExtractor,
+            CertificateExtractor, ThirdPartyExtractor, InsecureContentExtractor,
+            FailedRequestsExtractor, SecurityHeadersExtractor, TrackerDetectExtractor,
+            CookieStatsExtractor, JavaScriptLibsExtractor, ScreenshotExtractor,
+            ImprintExtractor, HSTSPreloadExtractor, FingerprintingExtractor]
+
+
+def _get_extractor_classes_https_run():
+    from privacyscanner.scanmodules.chromedevtools.extractors import FinalUrlExtractor, \
+        TLSDetailsExtractor, CertificateExtractor, InsecureContentExtractor, \
+        SecurityHeadersExtractor, HSTSPreloadExtractor
+
+    return [FinalUrlExtractor, TLSDetailsExtractor, CertificateExtractor,
+            InsecureContentExtractor, SecurityHeadersExtractor, HSTSPreloadExtractor]
 
 
 class ChromeDevtoolsScanModule(ScanModule):
@@ -38,13 +48,21 @@ class ChromeDevtoolsScanModule(ScanModule):
             'disable_javascript': False,
             'https_same_content_threshold': 0.9,
             'profile_directory': None,
+            'browser_pool': False,
+            'browser_pool_max_scans': 50,
+            'browser_pool_max_rss': None,
+            'record_cdp': False,
+            'async_cdp': False,
+            'flatten_cdp': False,
         })
         super().__init__(options)
         cache_file = self.options['storage_path'] / TLDEXTRACT_CACHE_FILE
         parse_domain.cache_file = str(cache_file)
 
     def scan_site(self, result, meta):
-        chrome_scan = ChromeScan(EXTRACTOR_CLASSES)
+        from privacyscanner.scanmodules.chromedevtools.chromescan import ChromeScan
+
+        chrome_scan = ChromeScan(_get_extractor_classes())
         debugging_port = self.options.get('start_port', 9222) + meta.worker_id
         content = chrome_scan.scan(result, self.logger, self.options, meta, debugging_port)
         if not result['reachable']:
@@ -57,9 +75,10 @@ class ChromeDevtoolsScanModule(ScanModule):
             # insecure content details if there is not redirect to https
             site_url = 'https://' + result['site_url'][len('http://'):]
             extra_result = Result({'site_url': site_url}, NoOpFileHandler())
-            chrome_scan = ChromeScan(EXTRACTOR_CLASSES_HTTPS_RUN)
-            https_content = chrome_scan.scan(extra_result, self.logger, self.options, meta,
-                                             debugging_port)
+            chrome_scan = ChromeScan(_get_extractor_classes_https_run())
+            with meta.span('https_run'):
+                https_content = chrome_scan.scan(extra_result, self.logger, self.options, meta,
+                                                 debugging_port)
             if not extra_result['reachable']:
                 return
             similarity = calculate_jaccard_index(content, https_content)
@@ -71,12 +90,22 @@ class ChromeDevtoolsScanModule(ScanModule):
             result['https']['same_content_score'] = similarity
             result['https']['same_content'] = same_content
 
+    def close(self):
+        from privacyscanner.scanmodules.chromedevtools.chromescan import stop_persistent_browsers
+
+        stop_persistent_browsers()
+
+    def preload(self):
+        for extractor_class in _get_extractor_classes():
+            if hasattr(extractor_class, 'preload'):
+                extractor_class.preload(self.options)
+
     def update_dependencies(self):
         max_age = 14 * 24 * 3600
         cache_file = Path(parse_domain.cache_file)
         cache_file.parent.mkdir(parents=True, exist_ok=True)
         if file_is_outdated(cache_file, max_age):
             parse_domain.update(fetch_now=True)
-        for extractor_class in EXTRACTOR_CLASSES:
+        for extractor_class in _get_extractor_classes():
             if hasattr(extractor_class, 'update_dependencies'):
                 extractor_class.update_dependencies(self.options)
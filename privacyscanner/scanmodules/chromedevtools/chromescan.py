@@ -1,6 +1,9 @@
+import atexit
 import json
+import os
 import random
 import shutil
+import socket
 import subprocess
 import tempfile
 import threading
@@ -8,16 +11,23 @@ import time
 import warnings
 from base64 import b64decode
 from collections import defaultdict
+from contextlib import ExitStack, contextmanager, suppress
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
 
+import psutil
 import pychrome
+import websocket
 from requests.exceptions import ConnectionError
 
 from privacyscanner.exceptions import RetryScan
-from privacyscanner.scanmodules.chromedevtools.utils import scripts_disabled
-from privacyscanner.utils import kill_everything
+from privacyscanner.filehandlers import NoOpFileHandler
+from privacyscanner.result import Result
+from privacyscanner.scanmodules.chromedevtools.utils import ChromeBrowserStartupError, \
+    find_chrome_executable, scripts_disabled
+from privacyscanner.spans import Spans
+from privacyscanner.utils import get_tree_rss, kill_everything, persistent_children
 
 
 CHANGE_WAIT_TIME = 15
@@ -180,10 +190,6 @@ EXTRACT_ARGUMENTS_JAVASCRIPT = '''
 ON_NEW_DOCUMENT_JAVASCRIPT_LINENO = 7
 
 
-class ChromeBrowserStartupError(Exception):
-    pass
-
-
 class NotReachableError(Exception):
     pass
 
@@ -194,12 +200,21 @@ class DNSNotResolvedError(Exception):
 
 class ChromeBrowser:
     def __init__(self, debugging_port=9222, chrome_executable=None,
-                       profile_directory=None):
+                       profile_directory=None, chrome_options=None, prefs=None,
+                       tab_class=pychrome.Tab, flatten=False):
         self._debugging_port = debugging_port
+        self._tab_class = tab_class
+        self._flatten = flatten
         if chrome_executable is None:
             chrome_executable = find_chrome_executable()
         self._chrome_executable = chrome_executable
         self._profile_directory = profile_directory
+        if chrome_options is None:
+            chrome_options = CHROME_OPTIONS
+        self._chrome_options = chrome_options
+        if prefs is None:
+            prefs = PREFS
+        self._prefs = prefs
 
     def __enter__(self):
         self._temp_dir = tempfile.TemporaryDirectory()
@@ -210,7 +225,7 @@ class ChromeBrowser:
             default_dir = user_data_dir / 'Default'
             default_dir.mkdir()
             with (default_dir / 'Preferences').open('w') as f:
-                json.dump(PREFS, f)
+                json.dump(self._prefs, f)
         else:
             shutil.copytree(self._profile_directory, user_data_dir)
         self._start_chrome(user_data_dir)
@@ -221,12 +236,15 @@ class ChromeBrowser:
             '--remote-debugging-port={}'.format(self._debugging_port),
             '--user-data-dir={}'.format(user_data_dir)
         ]
-        command = [self._chrome_executable] + CHROME_OPTIONS + extra_opts
+        command = [self._chrome_executable] + self._chrome_options + extra_opts
         self._p = subprocess.Popen(command, stdout=subprocess.DEVNULL,
                                    stderr=subprocess.DEVNULL)
 
-        self.browser = pychrome.Browser(url='http://127.0.0.1:{}'.format(
-            self._debugging_port))
+        url = 'http://127.0.0.1:{}'.format(self._debugging_port)
+        if self._flatten:
+            self.browser = pychrome.FlatBrowser(url)
+        else:
+            self.browser = pychrome.Browser(url, tab_class=self._tab_class)
 
         # Wait until Chrome is ready
         max_tries = 100
@@ -241,21 +259,287 @@ class ChromeBrowser:
             raise ChromeBrowserStartupError('Could not connect to Chrome')
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._flatten:
+            self.browser.close()
         kill_everything(self._p.pid)
         self._temp_dir.cleanup()
 
 
+class PersistentChromeBrowser(ChromeBrowser):
+    """A Chrome process that is reused for many scans.
+
+    Every scan runs in its own browser context, which is like a fresh
+    incognito window: cookies, caches and storage are not shared between
+    scans. Chrome is restarted after max_scans scans, if its processes use
+    more than max_rss bytes of memory, or if it has crashed.
+
+    Scans in several threads can use the browser at the same time, each in
+    its own context. Chrome is then only restarted when none of them has a
+    context open anymore; a context that fails is disposed of without
+    affecting the others.
+    """
+    def __init__(self, debugging_port=9222, chrome_executable=None,
+                 profile_directory=None, chrome_options=None, prefs=None,
+                 max_scans=50, max_rss=None):
+        super().__init__(debugging_port, chrome_executable, profile_directory,
+                         chrome_options, prefs)
+        self.max_scans = max_scans
+        self.max_rss = max_rss
+        self.num_scans = 0
+        self._p = None
+        self._browser_tab = None
+        self._num_contexts = 0
+        self._condition = threading.Condition()
+
+    def start(self):
+        self.__enter__()
+        persistent_children.add(self._p.pid)
+        # Browser contexts can only be managed with the browser target,
+        # not with the targets of the individual tabs.
+        version = self.browser.version()
+        self._browser_tab = pychrome.BrowserTab(webSocketDebuggerUrl=version['webSocketDebuggerUrl'])
+        self._browser_tab.start()
+        self.num_scans = 0
+
+    def stop(self):
+        if self._p is None:
+            return
+        if self._browser_tab is not None:
+            with suppress(pychrome.PyChromeException):
+                self._browser_tab.stop()
+            self._browser_tab = None
+        persistent_children.discard(self._p.pid)
+        with suppress(psutil.NoSuchProcess):
+            kill_everything(self._p.pid)
+        self._temp_dir.cleanup()
+        self._p = None
+
+    def close(self):
+        """Stop Chrome as soon as no scan has a context open anymore."""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._num_contexts)
+            self.stop()
+
+    def is_usable(self):
+        if self._browser_tab is None or self._p.poll() is not None:
+            return False
+        if self.max_scans is not None and self.num_scans >= self.max_scans:
+            return False
+        if self.max_rss is not None and get_tree_rss(self._p.pid) > self.max_rss:
+            return False
+        try:
+            self._browser_tab.Browser.getVersion(_timeout=5)
+        except (pychrome.PyChromeException, websocket.WebSocketException):
+            return False
+        return True
+
+    @contextmanager
+    def new_context(self, tab_class=pychrome.Tab, flatten=False):
+        with self._condition:
+            while not self.is_usable():
+                if self._num_contexts:
+                    # Restarting would break the scans of other threads.
+                    self._condition.wait()
+                    continue
+                self.stop()
+                self.start()
+            self.num_scans += 1
+            self._num_contexts += 1
+            browser_tab = self._browser_tab
+        try:
+            context = BrowserContext(browser_tab, self._debugging_port, tab_class, flatten)
+            try:
+                yield context
+            finally:
+                try:
+                    context.dispose()
+                except (pychrome.PyChromeException, websocket.WebSocketException):
+                    # Chrome is probably gone. is_usable() will notice it
+                    # before the next scan.
+                    pass
+        finally:
+            with self._condition:
+                self._num_contexts -= 1
+                self._condition.notify_all()
+
+
+class BrowserContext:
+    """Provides new_tab() and close_tab() like pychrome.Browser, but the
+    tabs are opened in a separate browser context.
+
+    With flatten, the tabs are sessions on the websocket of browser_tab
+    instead of having their own websockets."""
+    def __init__(self, browser_tab, debugging_port, tab_class=pychrome.Tab, flatten=False):
+        self._browser_tab = browser_tab
+        self._debugging_port = debugging_port
+        self._tab_class = tab_class
+        self._flatten = flatten
+        self._tabs = {}
+        self.id = browser_tab.Target.createBrowserContext()['browserContextId']
+
+    def new_tab(self, url=None, timeout=None):
+        target = self._browser_tab.Target.createTarget(
+            url=url or 'about:blank', browserContextId=self.id, _timeout=timeout)
+        target_id = target['targetId']
+        if self._flatten:
+            tab = pychrome.SessionTab(self._browser_tab, id=target_id, type='page')
+        else:
+            websocket_url = 'ws://127.0.0.1:{}/devtools/page/{}'.format(
+                self._debugging_port, target_id)
+            tab = self._tab_class(id=target_id, type='page', webSocketDebuggerUrl=websocket_url)
+        self._tabs[target_id] = tab
+        return tab
+
+    def list_tab(self, timeout=None):
+        return list(self._tabs.values())
+
+    def close_tab(self, tab_id, timeout=None):
+        if isinstance(tab_id, pychrome.Tab):
+            tab_id = tab_id.id
+        tab = self._tabs.pop(tab_id, None)
+        if tab is not None and tab.status == pychrome.Tab.status_started:
+            tab.stop()
+        self._browser_tab.Target.closeTarget(targetId=tab_id, _timeout=timeout)
+
+    def dispose(self):
+        for tab in list(self._tabs.values()):
+            with suppress(pychrome.CallMethodException):
+                self.close_tab(tab)
+        # This also closes tabs that the page itself has opened.
+        self._browser_tab.Target.disposeBrowserContext(browserContextId=self.id)
+
+
+_persistent_browsers = []
+_persistent_browsers_lock = threading.Lock()
+
+
+def get_persistent_browser(debugging_port, chrome_executable=None, profile_directory=None,
+                           chrome_options=None, prefs=None, max_scans=50, max_rss=None):
+    """Return the persistent browser of this process for a configuration.
+
+    Every configuration, e.g., the one of chromedevtools and the one of
+    cookiebanner, keeps its own browser running, which is shared by all
+    sites the process scans at the same time. A new browser listens on
+    debugging_port, unless a browser of another configuration does
+    already.
+    """
+    config = (chrome_executable, profile_directory, chrome_options, prefs)
+    with _persistent_browsers_lock:
+        for browser in _persistent_browsers:
+            if browser.config == config:
+                break
+        else:
+            if any(browser._debugging_port == debugging_port for browser in _persistent_browsers):
+                debugging_port = _get_free_port()
+            browser = PersistentChromeBrowser(debugging_port, chrome_executable,
+                                              profile_directory, chrome_options, prefs)
+            browser.config = config
+            _persistent_browsers.append(browser)
+        browser.max_scans = max_scans
+        browser.max_rss = max_rss
+        return browser
+
+
+def _get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@atexit.register
+def stop_persistent_browsers():
+    with _persistent_browsers_lock:
+        for browser in _persistent_browsers:
+            browser.close()
+        _persistent_browsers.clear()
+
+
+def get_tab_class(options):
+    """Return pychrome.SyncTab if the option async_cdp is set, else pychrome.Tab.
+
+    A SyncTab talks to Chrome with asyncio in a thread shared by all tabs,
+    which makes many sequential method calls cheaper.
+    """
+    if options.get('async_cdp'):
+        return pychrome.SyncTab
+    return pychrome.Tab
+
+
+def open_browser(options, debugging_port, chrome_options=None, prefs=None):
+    """Return a context manager which yields something like pychrome.Browser.
+
+    Depending on the option browser_pool, this is either a fresh Chrome
+    process or a new browser context in the persistent browser. With the
+    option flatten_cdp, all tabs are sessions on one websocket of Chrome.
+    """
+    executable = options['chrome_executable']
+    profile_directory = options.get('profile_directory')
+    tab_class = get_tab_class(options)
+    flatten = bool(options.get('flatten_cdp'))
+    if not options.get('browser_pool'):
+        return ChromeBrowser(debugging_port, executable, profile_directory,
+                             chrome_options, prefs, tab_class, flatten)
+    max_rss = options.get('browser_pool_max_rss')
+    if max_rss is not None:
+        max_rss = max_rss * 1024 * 1024
+    browser = get_persistent_browser(debugging_port, executable, profile_directory,
+                                     chrome_options, prefs,
+                                     max_scans=options.get('browser_pool_max_scans', 50),
+                                     max_rss=max_rss)
+    return browser.new_context(tab_class, flatten)
+
+
+def start_cdp_recording(tab, result):
+    """Record the CDP session of tab, which has not been started yet.
+
+    The recording starts with the results before the scan, so that
+    replay_scan() can run the extractors on the same results.
+    """
+    fd, filename = tempfile.mkstemp(prefix='cdp_recording_', suffix='.jsonl.gz')
+    os.close(fd)
+    recorder = pychrome.Recorder(filename)
+    recorder.annotate('result', result.get_results())
+    tab.recorder = recorder
+    return recorder
+
+
+def finish_cdp_recording(recorder, result, filename):
+    """Stop the recording and add it to the debug files of result."""
+    recorder.close()
+    with open(recorder.path, 'rb') as f:
+        result.add_debug_file(filename, f)
+    os.unlink(recorder.path)
+
+
+def discard_cdp_recording(recorder):
+    recorder.close()
+    with suppress(FileNotFoundError):
+        os.unlink(recorder.path)
+
+
+def replay_scan(recording_file, page_scanner, logger, options):
+    """Run the extractors of page_scanner on a recording of start_cdp_recording().
+
+    Neither Chrome nor the network is needed, the responses of Chrome are
+    taken from the recording. Returns the result of the extractors.
+    """
+    tab = pychrome.ReplayTab(str(recording_file))
+    result = Result(tab.annotations['result'], NoOpFileHandler())
+    page_scanner.replay(tab, result, logger, dict(options, record_cdp=False))
+    return result
+
+
 class ChromeScan:
     def __init__(self, extractor_classes):
         self._extractor_classes = extractor_classes
 
     def scan(self, result, logger, options, meta, debugging_port=9222):
-        executable = options['chrome_executable']
-        profile_directory = options['profile_directory']
-        scanner = PageScanner(self._extractor_classes)
+        scanner = PageScanner(self._extractor_classes, meta.spans)
         chrome_error = None
         content = None
-        with ChromeBrowser(debugging_port, executable, profile_directory) as browser:
+        with meta.span('chrome'), ExitStack() as stack:
+            with meta.span('start'):
+                browser = stack.enter_context(open_browser(options, debugging_port))
             try:
                 content = scanner.scan(browser, result, logger, options)
             except pychrome.TimeoutException:
@@ -281,13 +565,119 @@ class ChromeScan:
 
 
 class PageScanner:
-    def __init__(self, extractor_classes):
+    recording_filename = 'chromedevtools_cdp.jsonl.gz'
+
+    def __init__(self, extractor_classes, spans=None):
         self._extractor_classes = extractor_classes
+        if spans is None:
+            spans = Spans()
+        self._spans = spans
         self._page_loaded = threading.Event()
+        self._recorder = None
         self._reset()
 
     def scan(self, browser, result, logger, options):
+        try:
+            return self._scan_page(browser, result, logger, options)
+        finally:
+            # Whatever went wrong, the recording must not be left behind.
+            self._discard_recording()
+
+    def _scan_page(self, browser, result, logger, options):
+        with self._spans.span('setup_tab'):
+            self._setup_tab(browser, result, logger, options)
+
+        self._page.scan_start = datetime.utcnow()
+        if self._recorder is not None:
+            self._recorder.annotate('scan_start', self._page.scan_start.timestamp())
+        try:
+            with self._spans.span('navigate'):
+                self._tab.Page.navigate(url=result['site_url'],
+                                        _timeout=options.get('timeout', 15))
+        except pychrome.TimeoutException:
+            self._tab.stop()
+            browser.close_tab(self._tab)
+            self._reset()
+            raise
+
+        # We wait for the page to be loaded. Then we wait until we have the
+        # page in a stable state, i.e. not changing the URL anymore.
+        load_max_wait = 30
+        with self._spans.span('load'):
+            self._page_loaded.wait(load_max_wait)
+        has_responses = bool(self._page.response_log)
+        if has_responses:
+            with self._spans.span('stabilize'):
+                self._wait_for_stable_page(load_max_wait, options)
+            response = self._page.final_response
+            # If there is no frameId, there is no content that was rendered.
+            # This is usually the case, when the site has a redirect.
+            if 'frameId' in response['extra']:
+                with self._spans.span('get_content'):
+                    res = self._tab.Page.getResourceContent(
+                        frameId=response['extra']['frameId'], url=response['url'])
+                content = b64decode(res['content']) if res['base64Encoded'] else res['content'].encode()
+            else:
+                content = b''
+        else:
+            self._tab.stop()
+            browser.close_tab(self._tab)
+            if self._page.failed_request_log:
+                failed_request = self._page.failed_request_log[0]
+                if failed_request.get('errorText') == 'net::ERR_NAME_NOT_RESOLVED':
+                    self._reset()
+                    raise DNSNotResolvedError('DNS could not be resolved.')
+            self._reset()
+            raise NotReachableError('Not reachable for unknown reasons.')
+
+        self._tab.Page.disable()
+        if not options['disable_javascript']:
+            self._tab.Debugger.disable()
+        self._unregister_network_callbacks()
+        self._unregister_security_callbacks()
+        if has_responses:
+            with self._spans.span('extract'):
+                self._extract_information()
+        with self._spans.span('close_tab'):
+            self._tab.Network.disable()
+            self._tab.Security.disable()
+            self._tab.stop()
+            browser.close_tab(self._tab)
+        if self._recorder is not None:
+            finish_cdp_recording(self._recorder, result, self.recording_filename)
+            self._recorder = None
+        self._reset()
+
+        return content
+
+    def replay(self, tab, result, logger, options):
+        """Run the extractors on the recorded events and responses of tab."""
+        self.replay_page_load(tab, result, logger, options)
+        with self._spans.span('extract'):
+            self._extract_information()
+        tab.stop()
+        self._reset()
+
+    def replay_page_load(self, tab, result, logger, options):
+        """Replay the recorded events of tab and return the loaded page.
+
+        The tab is not stopped, so that extractors can still get the
+        recorded responses of Chrome.
+        """
+        browser = pychrome.ReplayBrowser(tab)
+        with self._spans.span('setup_tab'):
+            self._setup_tab(browser, result, logger, options)
+        self._page.scan_start = datetime.fromtimestamp(tab.annotations['scan_start'])
+        with self._spans.span('replay_events'):
+            tab.replay_events()
+        self._unregister_network_callbacks()
+        self._unregister_security_callbacks()
+        return self._page
+
+    def _setup_tab(self, browser, result, logger, options):
         self._tab = browser.new_tab()
+        if options.get('record_cdp'):
+            self._recorder = start_cdp_recording(self._tab, result)
         self._tab.start()
 
         self._page = Page(self._tab)
@@ -336,88 +726,42 @@ class PageScanner:
             # runs.
             self._tab.Debugger.pause()
 
-        self._page.scan_start = datetime.utcnow()
-        try:
-            self._tab.Page.navigate(url=result['site_url'],
-                                    _timeout=options.get('timeout', 15))
-        except pychrome.TimeoutException:
-            self._tab.stop()
-            browser.close_tab(self._tab)
-            self._reset()
-            raise
-
-        # We wait for the page to be loaded. Then we wait until we have the
-        # page in a stable state, i.e. not changing the URL anymore.
-        load_max_wait = 30
-        self._page_loaded.wait(load_max_wait)
-        has_responses = bool(self._page.response_log)
-        if has_responses:
-            total_wait = 60
-            time_start = time.time()
-            while True:
-                # If the document was changed, we have to wait for the page to
-                # load again. This will not wait if there was no change,
-                # because page_loaded event is already set.
+    def _wait_for_stable_page(self, load_max_wait, options):
+        total_wait = 60
+        time_start = time.time()
+        while True:
+            # If the document was changed, we have to wait for the page to
+            # load again. This will not wait if there was no change,
+            # because page_loaded event is already set.
+            with self._spans.span('load'):
                 self._page_loaded.wait(load_max_wait)
+            with self._spans.span('page_interaction'):
                 self._page_interaction()
-                # We wait 15 seconds after the page has loaded, so that any
-                # resources can load. This includes JavaScript which might
-                # issue further requests.
-                if not self._document_will_change.wait(CHANGE_WAIT_TIME):
-                    # OK, our page should be stable now. So we will disable any
-                    # further requests by just intercepting them and not
-                    # taking care of them.
-                    # However, to avoid a race condition, we first disable
-                    # scripts shortly to check again.
-                    with scripts_disabled(self._tab, options):
-                        if self._document_will_change.is_set():
-                            # It changed again, so yet another loop :-(
-                            continue
-                        self._tab.Network.setRequestInterception(patterns=[{
-                            'resourceType': 'Document'
-                        }])
-                    break
-                # We will only run this "infinite" loop for up to total_wait
-                # seconds. If the document changes over and over again, there
-                # is nothing we can evaluate reasonably.
-                if time_start + total_wait <= time.time():
-                    self._reset()
-                    raise NotReachableError('No stable page to scan.')
-
-            response = self._page.final_response
-            # If there is no frameId, there is no content that was rendered.
-            # This is usually the case, when the site has a redirect.
-            if 'frameId' in response['extra']:
-                res = self._tab.Page.getResourceContent(frameId=response['extra']['frameId'],
-                                                        url=response['url'])
-                content = b64decode(res['content']) if res['base64Encoded'] else res['content'].encode()
-            else:
-                content = b''
-        else:
-            self._tab.stop()
-            browser.close_tab(self._tab)
-            if self._page.failed_request_log:
-                failed_request = self._page.failed_request_log[0]
-                if failed_request.get('errorText') == 'net::ERR_NAME_NOT_RESOLVED':
-                    self._reset()
-                    raise DNSNotResolvedError('DNS could not be resolved.')
-            self._reset()
-            raise NotReachableError('Not reachable for unknown reasons.')
-
-        self._tab.Page.disable()
-        if javascript_enabled:
-            self._tab.Debugger.disable()
-        self._unregister_network_callbacks()
-        self._unregister_security_callbacks()
-        if has_responses:
-            self._extract_information()
-        self._tab.Network.disable()
-        self._tab.Security.disable()
-        self._tab.stop()
-        browser.close_tab(self._tab)
-        self._reset()
-
-        return content
+            # We wait 15 seconds after the page has loaded, so that any
+            # resources can load. This includes JavaScript which might
+            # issue further requests.
+            with self._spans.span('change_wait'):
+                document_will_change = self._document_will_change.wait(CHANGE_WAIT_TIME)
+            if not document_will_change:
+                # OK, our page should be stable now. So we will disable any
+                # further requests by just intercepting them and not
+                # taking care of them.
+                # However, to avoid a race condition, we first disable
+                # scripts shortly to check again.
+                with scripts_disabled(self._tab, options):
+                    if self._document_will_change.is_set():
+                        # It changed again, so yet another loop :-(
+                        continue
+                    self._tab.Network.setRequestInterception(patterns=[{
+                        'resourceType': 'Document'
+                    }])
+                break
+            # We will only run this "infinite" loop for up to total_wait
+            # seconds. If the document changes over and over again, there
+            # is nothing we can evaluate reasonably.
+            if time_start + total_wait <= time.time():
+                self._reset()
+                raise NotReachableError('No stable page to scan.')
 
     def _cb_request_will_be_sent(self, request, requestId, **kwargs):
         # To avoid reparsing the URL in many places, we parse them all here
@@ -575,7 +919,8 @@ class PageScanner:
 
     def _extract_information(self):
         for extractor in self._extractors:
-            extractor.extract_information()
+            with self._spans.span(extractor.__class__.__name__):
+                extractor.extract_information()
 
     def _receive_log(self, log_type, message, call_stack):
         for extractor in self._extractors:
@@ -587,7 +932,14 @@ class PageScanner:
             if extra_javascript:
                 self._extra_scripts.append(extra_javascript)
 
+    def _discard_recording(self):
+        if self._recorder is not None:
+            # The scan failed, so there is nothing to replay.
+            discard_cdp_recording(self._recorder)
+            self._recorder = None
+
     def _reset(self):
+        self._discard_recording()
         self._page_loaded.clear()
         self._document_will_change = threading.Event()
         self._debugger_attached = threading.Event()
@@ -646,17 +998,3 @@ class Page:
         request_id = self.document_request_log[-1]['requestId']
         return self.get_final_response_by_id(request_id)
 
-
-def find_chrome_executable():
-    chrome_executable = shutil.which('google-chrome')
-    if chrome_executable is None:
-        macos_chrome = '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'
-        if Path(macos_chrome).exists():
-            chrome_executable = macos_chrome
-    if chrome_executable is None:
-        chrome_executable = shutil.which('chromium')
-    if chrome_executable is None:
-        chrome_executable = shutil.which('chromium-browser')
-    if chrome_executable is None:
-        raise ChromeBrowserStartupError('Could not find google-chrome or chromium.')
-    return chrome_executable
@@ -13,8 +13,6 @@ _hsts_lookup = None
 
 class HSTSPreloadExtractor(Extractor):
     def extract_information(self):
-        global _hsts_lookup
-
         hsts_preload = {
             'is_ready': False,
             'is_preloaded': False
@@ -22,10 +20,7 @@ class HSTSPreloadExtractor(Extractor):
         self.result['https']['hsts_preload'] = hsts_preload
         self.result.mark_dirty('https')
 
-        if _hsts_lookup is None:
-            lookup_file = self.options['storage_path'] / 'hsts.json'
-            with lookup_file.open() as f:
-                _hsts_lookup = json.load(f)
+        _load_hsts_lookup(self.options)
 
         domain = parse_domain(self.result['final_url']).registered_domain
         is_preloaded = domain in _hsts_lookup
@@ -99,6 +94,10 @@ class HSTSPreloadExtractor(Extractor):
         if fail_reasons:
             hsts_preload['fail_reasons'] = fail_reasons
 
+    @staticmethod
+    def preload(options):
+        _load_hsts_lookup(options)
+
     @classmethod
     def update_dependencies(cls, options):
         lookup_file = options['storage_path'] / 'hsts.json'
@@ -114,3 +113,12 @@ class HSTSPreloadExtractor(Extractor):
                   for entry in hsts_data['entries']}
         with lookup_file.open('w') as f:
             json.dump(lookup, f)
+
+
+def _load_hsts_lookup(options):
+    global _hsts_lookup
+
+    if _hsts_lookup is None:
+        lookup_file = options['storage_path'] / 'hsts.json'
+        with lookup_file.open() as f:
+            _hsts_lookup = json.load(f)
@@ -66,18 +66,11 @@ class TrackerDetectExtractor(Extractor):
         }
 
     def _load_rules(self):
-        global _adblock_rules_cache
+        self.rules = _get_adblock_rules(self.options)
 
-        if _adblock_rules_cache is not None:
-            self.rules = _adblock_rules_cache
-            return
-
-        easylist_path = self.options['storage_path'] / EASYLIST_PATH
-        easylist_files = [easylist_path / filename for filename in EASYLIST_FILES]
-        self.rules = AdblockRules(rule_files=easylist_files,
-                                  cache_file=easylist_path / 'rules.cache',
-                                  skip_parsing_errors=True)
-        _adblock_rules_cache = self.rules
+    @staticmethod
+    def preload(options):
+        _get_adblock_rules(options)
 
     @staticmethod
     def update_dependencies(options):
@@ -87,3 +80,15 @@ class TrackerDetectExtractor(Extractor):
             download_url = EASYLIST_DOWNLOAD_PREFIX + filename
             target_file = (easylist_path / filename).open('wb')
             download_file(download_url, target_file)
+
+
+def _get_adblock_rules(options):
+    global _adblock_rules_cache
+
+    if _adblock_rules_cache is None:
+        easylist_path = options['storage_path'] / EASYLIST_PATH
+        easylist_files = [easylist_path / filename for filename in EASYLIST_FILES]
+        _adblock_rules_cache = AdblockRules(rule_files=easylist_files,
+                                            cache_file=easylist_path / 'rules.cache',
+                                            skip_parsing_errors=True)
+    return _adblock_rules_cache
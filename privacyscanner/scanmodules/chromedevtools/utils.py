@@ -1,5 +1,6 @@
 import json
 import re
+import shutil
 from pathlib import Path
 
 from tldextract import TLDExtract
@@ -11,6 +12,10 @@ class JavaScriptError(Exception):
     pass
 
 
+class ChromeBrowserStartupError(Exception):
+    pass
+
+
 class scripts_disabled:
     def __init__(self, tab, options):
         self._tab = tab
@@ -59,3 +64,18 @@ def _javascript_stringify(js_expr):
 
 
 parse_domain = TLDExtract()
+
+
+def find_chrome_executable():
+    chrome_executable = shutil.which('google-chrome')
+    if chrome_executable is None:
+        macos_chrome = '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'
+        if Path(macos_chrome).exists():
+            chrome_executable = macos_chrome
+    if chrome_executable is None:
+        chrome_executable = shutil.which('chromium')
+    if chrome_executable is None:
+        chrome_executable = shutil.which('chromium-browser')
+    if chrome_executable is None:
+        raise ChromeBrowserStartupError('Could not find google-chrome or chromium.')
+    return chrome_executable
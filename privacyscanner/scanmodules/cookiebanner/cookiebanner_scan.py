@@ -11,17 +11,15 @@ import tempfile
 import time
 import websocket
 
+from contextlib import ExitStack
 from pathlib import Path
 from requests.exceptions import ConnectionError
 
 from privacyscanner.exceptions import RetryScan
 from privacyscanner.scanmodules import ScanModule
-from privacyscanner.scanmodules.cookiebanner.detectors import NaiveDetector, FilterListDetector, \
-    SimplePerceptiveDetector, BertDetector
-from privacyscanner.scanmodules.cookiebanner.extractors import TrackerExtractor, CookieSyncExtractor
+from privacyscanner.scanmodules.chromedevtools.chromescan import ChromeBrowserStartupError, get_tab_class, \
+    open_browser, stop_persistent_browsers
 from privacyscanner.scanmodules.chromedevtools.utils import parse_domain
-from privacyscanner.scanmodules.cookiebanner.pagescanner import ChromeBrowserStartupError, DNSNotResolvedError, \
-    NotReachableError, PageScanner
 from privacyscanner.scanner import slugify
 from privacyscanner.utils import kill_everything, set_default_options, file_is_outdated
 
@@ -102,6 +100,9 @@ CHROME_OPTIONS = [
     '--headless'
 ]
 
+OVERLAY_SCROLLBAR_OPTION = ('--enable-features=OverlayScrollbar,OverlayScrollbarFlashAfterAnyScrollUpdate,'
+                            'OverlayScrollbarFlashWhenMouseEnter')
+
 PREFS = {
     'profile': {
         'content_settings': {
@@ -187,8 +188,11 @@ ON_NEW_DOCUMENT_JAVASCRIPT_LINENO = 7
 
 
 class ChromeBrowser:
-    def __init__(self, debugging_port=9222, chrome_executable=None):
+    def __init__(self, debugging_port=9222, chrome_executable=None, tab_class=pychrome.Tab,
+                 flatten=False):
         self._debugging_port = debugging_port
+        self._tab_class = tab_class
+        self._flatten = flatten
         if chrome_executable is None:
             chrome_executable = find_chrome_executable()
         self._chrome_executable = chrome_executable
@@ -204,20 +208,23 @@ class ChromeBrowser:
         with (default_dir / 'Preferences').open('w') as f:
             json.dump(PREFS, f)
         self._start_chrome(user_data_dir)
-        return self
+        return self.browser
 
     def _start_chrome(self, user_data_dir):
         extra_opts = [
             '--remote-debugging-port={}'.format(self._debugging_port),
-            '--enable-features=OverlayScrollbar,OverlayScrollbarFlashAfterAnyScrollUpdate,OverlayScrollbarFlashWhenMouseEnter',
+            OVERLAY_SCROLLBAR_OPTION,
             '--user-data-dir={}'.format(user_data_dir)
         ]
         command = [self._chrome_executable] + CHROME_OPTIONS + extra_opts
         self._p = subprocess.Popen(command, stdout=subprocess.DEVNULL,
                                    stderr=subprocess.DEVNULL)
 
-        self.browser = pychrome.Browser(url='http://127.0.0.1:{}'.format(
-            self._debugging_port))
+        url = 'http://127.0.0.1:{}'.format(self._debugging_port)
+        if self._flatten:
+            self.browser = pychrome.FlatBrowser(url)
+        else:
+            self.browser = pychrome.Browser(url, tab_class=self._tab_class)
 
         # Wait until Chrome is ready
         max_tries = 100
@@ -232,12 +239,27 @@ class ChromeBrowser:
             raise ChromeBrowserStartupError('Could not connect to Chrome')
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._flatten:
+            self.browser.close()
+        psutil.Process(self._p.pid).kill()
         kill_everything(self._p.pid)
         self._temp_dir.cleanup()
 
 
-DETECTOR_CLASSES = [NaiveDetector, FilterListDetector, BertDetector, SimplePerceptiveDetector]
-EXTRACTOR_CLASSES = [TrackerExtractor, CookieSyncExtractor]
+# The detectors and extractors import large libraries, e.g., OpenCV and
+# matplotlib, so they are imported when they are needed and not when the
+# scan module is loaded.
+def _get_detector_classes():
+    from privacyscanner.scanmodules.cookiebanner.detectors import NaiveDetector, FilterListDetector, \
+        SimplePerceptiveDetector, BertDetector
+
+    return [NaiveDetector, FilterListDetector, BertDetector, SimplePerceptiveDetector]
+
+
+def _get_extractor_classes():
+    from privacyscanner.scanmodules.cookiebanner.extractors import TrackerExtractor, CookieSyncExtractor
+
+    return [TrackerExtractor, CookieSyncExtractor]
 
 
 class CookieScan:
@@ -246,6 +268,11 @@ class CookieScan:
         self._detector_classes = []
 
     def scan(self, result, logger, options, meta, debugging_port=9222):
+        from privacyscanner.scanmodules.cookiebanner.detectors import NaiveDetector, FilterListDetector, \
+            SimplePerceptiveDetector, BertDetector
+        from privacyscanner.scanmodules.cookiebanner.pagescanner import DNSNotResolvedError, \
+            NotReachableError, PageScanner
+
         executable = options['chrome_executable']
         if options['detectors']['easylist-cookie'] or options['detectors']['i-dont-care-about-cookies']:
             self._detector_classes.append(FilterListDetector)
@@ -263,12 +290,21 @@ class CookieScan:
             log_file_name += hashlib.sha512(result['site_url'].encode()).hexdigest()[:10]
             log_file_path = os.path.join(log_path, log_file_name)
             logger.addHandler(logging.FileHandler(log_file_path))
-        scanner = PageScanner(self._extractor_classes, self._detector_classes)
+        scanner = PageScanner(self._extractor_classes, self._detector_classes, meta.spans)
         chrome_error = None
         content = None
-        with ChromeBrowser(debugging_port, executable) as browser:
+        if options['browser_pool']:
+            sys.setrecursionlimit(5000)
+            browser_manager = open_browser(options, debugging_port,
+                                           CHROME_OPTIONS + [OVERLAY_SCROLLBAR_OPTION], PREFS)
+        else:
+            browser_manager = ChromeBrowser(debugging_port, executable, get_tab_class(options),
+                                            bool(options['flatten_cdp']))
+        with meta.span('chrome'), ExitStack() as stack:
+            with meta.span('start'):
+                browser = stack.enter_context(browser_manager)
             try:
-                content = scanner.scan(browser.browser, result, logger, options)
+                content = scanner.scan(browser, result, logger, options)
             except pychrome.TimeoutException:
                 if meta.is_first_try:
                     raise RetryScan('First timeout with Chrome.')
@@ -287,7 +323,7 @@ class CookieScan:
                     raise RetryScan('DNS could not be resolved.')
                 chrome_error = 'dns-not-resolved'
             # Attempt to catch websocket exception
-            except websocket.WebSocketException:
+            except (websocket.WebSocketException, pychrome.TabConnectionException):
                 if meta.is_first_try:
                     raise RetryScan('')
                 if 'initial_result' in result:
@@ -296,8 +332,6 @@ class CookieScan:
                 else:
                     logger.exception('Browser crashed without interacting with the website.')
                     chrome_error = 'websocket-exception-no-interaction'
-            finally:
-                psutil.Process(browser._p.pid).kill()
         result['chrome_error'] = chrome_error
         result['reachable'] = not bool(chrome_error)
         return content
@@ -315,24 +349,43 @@ class CookiebannerScanModule(ScanModule):
                 'disable_javascript': False,
                 'https_same_content_threshold': 0.9
             })
+        set_default_options(options, {
+            'browser_pool': False,
+            'browser_pool_max_scans': 50,
+            'browser_pool_max_rss': None,
+            'record_cdp': False,
+            'async_cdp': False,
+            'flatten_cdp': False,
+        })
         super().__init__(options)
 
     def scan_site(self, result, meta):
-        debugging_port = 9222 + meta.worker_id
-        scanner = CookieScan(EXTRACTOR_CLASSES, DETECTOR_CLASSES)
+        debugging_port = self.options.get('start_port', 9222) + meta.worker_id
+        scanner = CookieScan(_get_extractor_classes(), _get_detector_classes())
         content = scanner.scan(result, self.logger, self.options, meta, debugging_port)
         return content
 
+    def close(self):
+        stop_persistent_browsers()
+
+    def preload(self):
+        for extractor_class in _get_extractor_classes():
+            if hasattr(extractor_class, 'preload'):
+                extractor_class.preload(self.options)
+        for detector_class in _get_detector_classes():
+            if hasattr(detector_class, 'preload'):
+                detector_class.preload(self.options)
+
     def update_dependencies(self):
         max_age = 14 * 24 * 3600
         cache_file = Path(parse_domain.cache_file)
         cache_file.parent.mkdir(parents=True, exist_ok=True)
         if file_is_outdated(cache_file, max_age):
             parse_domain.update(fetch_now=True)
-        for extractor_class in EXTRACTOR_CLASSES:
+        for extractor_class in _get_extractor_classes():
             if hasattr(extractor_class, 'update_dependencies'):
                 extractor_class.update_dependencies(self.options)
-        for detector_class in DETECTOR_CLASSES:
+        for detector_class in _get_detector_classes():
             if hasattr(detector_class, 'update_dependencies'):
                 detector_class.update_dependencies(self.options)
 
@@ -21,6 +21,9 @@ from privacyscanner.scanmodules.cookiebanner.page import Page
 I_DONT_CARE_ABOUT_COOKIES = 'https://www.i-dont-care-about-cookies.eu/abp/'
 EASYLIST_COOKIE_LIST = "https://secure.fanboy.co.nz/fanboy-cookiemonster.txt"
 COOKIE_LISTS_PATH = Path('cookie_lists')
+COOKIE_LIST_FILES = ['easylist-cookie.txt', 'i-dont-care-about-cookies.txt']
+
+_abp_filters_cache = {}
 
 
 class AdblockPlusFilter:
@@ -70,14 +73,7 @@ class FilterListDetector(Extractor):
         self.logger = logger
         self.options = options
         self.page = page
-        abp_filter_filenames = [
-            self.options['storage_path'] / COOKIE_LISTS_PATH / 'easylist-cookie.txt',
-            self.options['storage_path'] / COOKIE_LISTS_PATH / 'i-dont-care-about-cookies.txt'
-        ]
-        self.abp_filters = {
-            os.path.splitext(os.path.basename(abp_filter_filename))[0]: AdblockPlusFilter(abp_filter_filename)
-            for abp_filter_filename in abp_filter_filenames
-        }
+        self.abp_filters = _get_abp_filters(self.options)
 
     def extract_information(self) -> None:
         for abp_filter_name, abp_filter in self.abp_filters.items():
@@ -99,6 +95,11 @@ class FilterListDetector(Extractor):
             except:
                 pass
 
+    @staticmethod
+    def preload(options: dict) -> None:
+        """Parses the filter lists once, so that they are shared by all scans."""
+        _get_abp_filters(options)
+
     @staticmethod
     def update_dependencies(options: dict) -> None:
         """Downloads the most recent cookie lists and saves the in the storage path defined in the options."""
@@ -149,3 +150,13 @@ class FilterListDetector(Extractor):
 
         query_result = self.page.tab.Runtime.evaluate(expression=js_function).get('result')
         return get_array_of_node_ids_for_remote_object(self.page.tab, query_result.get('objectId'))
+
+
+def _get_abp_filters(options: dict) -> dict:
+    abp_filters = {}
+    for filename in COOKIE_LIST_FILES:
+        abp_filter_filename = options['storage_path'] / COOKIE_LISTS_PATH / filename
+        if abp_filter_filename not in _abp_filters_cache:
+            _abp_filters_cache[abp_filter_filename] = AdblockPlusFilter(abp_filter_filename)
+        abp_filters[os.path.splitext(filename)[0]] = _abp_filters_cache[abp_filter_filename]
+    return abp_filters
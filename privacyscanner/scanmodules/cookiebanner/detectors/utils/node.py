@@ -19,15 +19,7 @@ def is_script_or_style_node(tab: pychrome.Tab, node_id: int) -> bool:
     return node_name == 'script' or node_name == 'style'
 
 
-def filter_visible_nodes(tab: pychrome.Tab, node_ids: list) -> list:
-    """Takes a list of node ids and only returns the ones visibible."""
-    return [node_id for node_id in node_ids if is_node_visible(tab, node_id).get('is_visible')]
-
-
-def is_node_visible(tab: pychrome.Tab, node_id: int) -> dict[str, bool | None]:
-    """Source: https://stackoverflow.com/a/41698614 adapted to also look at child nodes (especially important for fixed
-    elements as they might not be "visible" themselves when they have no width or height)"""
-    js_function = """
+IS_VISIBLE_FUNCTION = """
         function isVisible(elem) {
             function parseValue(value) {
                 var parsedValue = parseInt(value);
@@ -94,14 +86,58 @@ def is_node_visible(tab: pychrome.Tab, node_id: int) -> dict[str, bool | None]:
             return false;
         }"""
 
+
+def filter_visible_nodes(tab: pychrome.Tab, node_ids: list) -> list:
+    """Takes a list of node ids and only returns the ones visibible."""
+    if not node_ids:
+        return []
+
+    # Like is_node_visible(), but each step is done for all nodes at once.
+    tab.Runtime.evaluate(expression=IS_VISIBLE_FUNCTION)
+    resolved = tab.call_methods([('DOM.resolveNode', {'nodeId': node_id}) for node_id in node_ids])
+    resolved_node_ids = []
+    calls = []
+    for node_id, result in zip(node_ids, resolved):
+        if isinstance(result, pychrome.exceptions.CallMethodException):
+            continue
+        resolved_node_ids.append(node_id)
+        calls.append(('Runtime.callFunctionOn', {'functionDeclaration': IS_VISIBLE_FUNCTION,
+                                                 'objectId': result.get('object').get('objectId'),
+                                                 'silent': True}))
+    results = tab.call_methods(calls)
+    visible_node_ids = set()
+    child_node_ids = []
+    calls = []
+    for node_id, result in zip(resolved_node_ids, results):
+        if isinstance(result, pychrome.exceptions.CallMethodException):
+            continue
+        # if a boolean is returned, the object is not visible
+        result = result.get('result')
+        if result.get('type') == 'boolean':
+            if result.get('value'):
+                visible_node_ids.add(node_id)
+        # otherwise, the object or one of its children is visible, but
+        # is_node_visible() only says so if the visible node can be requested
+        else:
+            child_node_ids.append(node_id)
+            calls.append(('DOM.requestNode', {'objectId': result.get('objectId')}))
+    for node_id, result in zip(child_node_ids, tab.call_methods(calls)):
+        if not isinstance(result, pychrome.exceptions.CallMethodException):
+            visible_node_ids.add(node_id)
+    return [node_id for node_id in resolved_node_ids if node_id in visible_node_ids]
+
+
+def is_node_visible(tab: pychrome.Tab, node_id: int) -> dict[str, bool | None]:
+    """Source: https://stackoverflow.com/a/41698614 adapted to also look at child nodes (especially important for fixed
+    elements as they might not be "visible" themselves when they have no width or height)"""
     # the function `isVisible` is calling itself recursively,
     # therefore it needs to be defined beforehand
-    tab.Runtime.evaluate(expression=js_function)
+    tab.Runtime.evaluate(expression=IS_VISIBLE_FUNCTION)
 
     try:
         # call the function `isVisible` on the node
         remote_object_id = get_remote_object_id_by_node_id(tab, node_id)
-        result = tab.Runtime.callFunctionOn(functionDeclaration=js_function, objectId=remote_object_id,
+        result = tab.Runtime.callFunctionOn(functionDeclaration=IS_VISIBLE_FUNCTION, objectId=remote_object_id,
                                             silent=True).get('result')
 
         # if a boolean is returned, the object is not visible
@@ -11,13 +11,11 @@ def get_array_of_node_ids_for_remote_object(tab: pychrome.Tab, remote_object_id:
     array_attributes = get_properties_of_remote_object(tab, remote_object_id)
     remote_object_ids = [array_element.get('value').get('objectId') for array_element in array_attributes
                          if array_element.get('value') and array_element.get('enumerable')]
-    node_ids = list()
-    for remote_object_id in remote_object_ids:
-        try:
-            node_ids.append(get_node_id_for_remote_object(tab, remote_object_id))
-        except pychrome.exceptions.CallMethodException as e:
-            pass
-    return node_ids
+    # The elements are independent, so they are requested at once.
+    results = tab.call_methods([('DOM.requestNode', {'objectId': remote_object_id})
+                                for remote_object_id in remote_object_ids])
+    return [result.get('nodeId') for result in results
+            if not isinstance(result, pychrome.exceptions.CallMethodException)]
 
 
 def get_object_for_remote_object(tab: pychrome.Tab, remote_object_id: str) -> dict:
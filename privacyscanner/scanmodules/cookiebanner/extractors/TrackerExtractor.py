@@ -11,6 +11,8 @@ from privacyscanner.utils import download_file
 DISCONNECT_PATH = Path('disconnect')
 DISCONNECT_DOWNLOAD_URL = "https://raw.githubusercontent.com/disconnectme/disconnect-tracking-protection/master/services.json"
 
+_disconnect_list_cache = None
+
 
 class TrackerExtractor(Extractor):
     def __init__(self, page: Page, result: dict, logger: logging.Logger, options: dict):
@@ -35,9 +37,12 @@ class TrackerExtractor(Extractor):
 
     def _load_disconnect_list(self):
         """Internal function that loads the disconnect list into a dict."""
-        file = open(self.options['storage_path'] / DISCONNECT_PATH / 'disconnect.json', encoding='utf-8').read()
-        disconnect_list = json.loads(file)
-        self.disconnect_list = disconnect_list
+        self.disconnect_list = _get_disconnect_list(self.options)
+
+    @staticmethod
+    def preload(options: dict):
+        """Loads the disconnect list once, so that it is shared by all scans."""
+        _get_disconnect_list(options)
 
     def _check_against_disconnect_list(self, request: str) -> dict or None:
         """Checks a request against the disconnect list. If a request matches a domain from the list, the function
@@ -68,3 +73,12 @@ class TrackerExtractor(Extractor):
         del disconnect_list['categories']['Content']
         with open(disconnect_path / 'disconnect.json', 'w', encoding='utf-8') as f:
             json.dump(disconnect_list, f, ensure_ascii=False, indent=2)
+
+
+def _get_disconnect_list(options: dict) -> dict:
+    global _disconnect_list_cache
+
+    if _disconnect_list_cache is None:
+        with open(options['storage_path'] / DISCONNECT_PATH / 'disconnect.json', encoding='utf-8') as f:
+            _disconnect_list_cache = json.load(f)
+    return _disconnect_list_cache
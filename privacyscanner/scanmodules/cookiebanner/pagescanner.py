@@ -10,7 +10,8 @@ from tld.utils import get_fld
 from urllib.parse import urlparse
 
 from privacyscanner.scanmodules.chromedevtools.chromescan import ON_NEW_DOCUMENT_JAVASCRIPT, \
-    EXTRACT_ARGUMENTS_JAVASCRIPT
+    EXTRACT_ARGUMENTS_JAVASCRIPT, ChromeBrowserStartupError, start_cdp_recording, \
+    finish_cdp_recording, discard_cdp_recording
 from privacyscanner.scanmodules.cookiebanner.page import Page
 from privacyscanner.scanmodules.cookiebanner.user_agent_switching import get_user_agent_rotator
 from privacyscanner.scanmodules.cookiebanner.extractors.PrivacyPolicyExtractor import PrivacyPolicyExtractor
@@ -23,6 +24,7 @@ from privacyscanner.scanmodules.cookiebanner.detectors.utils.clickable import cl
     get_clickables_with_same_ssim, get_by_property
 from privacyscanner.scanmodules.cookiebanner.detectors import NaiveDetector, FilterListDetector, \
     SimplePerceptiveDetector, BertDetector
+from privacyscanner.spans import Spans
 
 # See comments in ON_NEW_DOCUMENT_JAVASCRIPT
 
@@ -38,10 +40,6 @@ DETECTORS = {
 }
 
 
-class ChromeBrowserStartupError(Exception):
-    pass
-
-
 class NotReachableError(Exception):
     pass
 
@@ -51,23 +49,43 @@ class DNSNotResolvedError(Exception):
 
 
 class PageScanner:
-    def __init__(self, extractor_classes, detector_classes):
+    recording_filename = 'cookiebanner_cdp.jsonl.gz'
+
+    def __init__(self, extractor_classes, detector_classes, spans=None):
         self._extractor_classes = extractor_classes
         self._detector_classes = detector_classes
+        if spans is None:
+            spans = Spans()
+        self._spans = spans
         self._page_loaded = threading.Event()
+        self._recorder = None
         self._reset()
         self._tab = None
         self._page = None
 
     def scan(self, browser, result, logger, options):
+        try:
+            return self._scan_page(browser, result, logger, options)
+        finally:
+            # Whatever went wrong, the recording must not be left behind.
+            self._discard_recording()
+
+    def _scan_page(self, browser, result, logger, options):
 
-        self._setup_tab(browser=browser, options=options)
+        # Only the initial page load is recorded, which is what the
+        # extractors and detectors see before any clickable is clicked.
+        with self._spans.span('setup_tab'):
+            self._setup_tab(browser=browser, options=options, result=result)
 
         self._page.scan_start = datetime.utcnow()
+        if self._recorder is not None:
+            self._recorder.annotate('scan_start', self._page.scan_start.timestamp())
         try:
-            self._tab.Page.navigate(url=result['site_url'],
-                                    _timeout=options.get('timeout', options['timeout']))
-            self._tab.wait(options['page_load_delay'])
+            with self._spans.span('navigate'):
+                self._tab.Page.navigate(url=result['site_url'],
+                                        _timeout=options.get('timeout', options['timeout']))
+            with self._spans.span('page_load_delay'):
+                self._tab.wait(options['page_load_delay'])
             self._load_modules(result, logger, options)
 
         except pychrome.TimeoutException:
@@ -76,28 +94,17 @@ class PageScanner:
             self._reset()
             raise
 
-        page_screenshot = take_screenshot(self._tab, "website")
-        original_screenshot = page_screenshot
-        page_screenshot = readb64(page_screenshot['contents'])
-        result['cookies'] = self._get_all_cookies()
-        result['cookie_notice_count'] = dict()
-        logger.info('Currently scanning website: {}'.format(result['site_url']))
-        result['TRACKING_BEFORE_ANY_ACTION'] = False
-        result['BUTTONS_HAVE_DIFFERENT_COLOR'] = False
-        result['BANNER_PRESENT_WITHOUT_TRACKING'] = False
-        result['SAME_SSIM'] = False
-
-        result['language'] = detect_language(self._tab)
-        result['disconnect_num'] = 0
-        result['cookie_syncs_num'] = 0
-        result['total_tracker_num'] = 0
-        result["screenshots"] = dict()
+        original_screenshot = self._prepare_extraction(result, logger)
+        page_screenshot = readb64(original_screenshot['contents'])
 
         # Extract Responses
         has_responses = bool(self._page.response_log)
-        self._tab.DOM.getDocument(depth=-1)
         if has_responses:
-            self._extract_information()
+            with self._spans.span('extract'):
+                self._extract_information()
+            if self._recorder is not None:
+                finish_cdp_recording(self._recorder, result, self.recording_filename)
+                self._recorder = None
             if result['disconnect_num'] or result['cookie_syncs_num']:
                 result['total_tracker_num'] = result['disconnect_num'] + result['cookie_syncs_num']
                 logger.info('Trackers are loaded without any user action.')
@@ -143,7 +150,8 @@ class PageScanner:
         if options['extract_privacy_policy']:
             # EXTRACT PRIVACY POLICY
             policy_extractor = PrivacyPolicyExtractor(self._page, self._tab, result, logger, options)
-            policy_extractor.extract_information()
+            with self._spans.span('privacy_policy'):
+                policy_extractor.extract_information()
             result["privacy_policy_request_log"] = self._page.request_log
             result["privacy_policy_document_request_log"] = self._page.document_request_log
             result["privacy_policy_failed_request_log"] = self._page.failed_request_log
@@ -179,11 +187,12 @@ class PageScanner:
             for button in buttons:
 
                 # Reload the tab and re-run detection
-                self._reload_tab(browser, result, options)
-                #  navigate and wait
-                self._tab.Page.navigate(url=result['site_url'],
-                                        _timeout=options.get('timeout', options['timeout']))
-                self._tab.wait(options['page_load_delay'])
+                with self._spans.span('clickable_reload'):
+                    self._reload_tab(browser, result, options)
+                    #  navigate and wait
+                    self._tab.Page.navigate(url=result['site_url'],
+                                            _timeout=options.get('timeout', options['timeout']))
+                    self._tab.wait(options['page_load_delay'])
                 self._reset_modules()
 
                 clickable_result = dict()
@@ -196,8 +205,9 @@ class PageScanner:
 
                 self._load_detector_modules(clickable_result, logger, reloaded_options, preferred_detector)
                 # This call is necessary, or else the DOM elements are "visible", but cannot be accessed
-                self._tab.DOM.getDocument(depth=-1)
-                self._extract_detector_information()
+                with self._spans.span('clickable_detect'):
+                    self._tab.DOM.getDocument(depth=-1)
+                    self._extract_detector_information()
                 # In some sites, the banner disappears after interacting with it -> Return and log the occurrence
                 if preferred_detector not in clickable_result:
                     result['chrome_error'] = 'banner_gone'
@@ -207,10 +217,13 @@ class PageScanner:
                 self._reset_modules()
 
                 logger.info("The button '{0}' has been clicked".format(button['text']))
-                self.click_and_wait(clickable=reloaded_clickable, time_in_seconds=options['page_load_delay'])
+                with self._spans.span('clickable_click'):
+                    self.click_and_wait(clickable=reloaded_clickable,
+                                        time_in_seconds=options['page_load_delay'])
                 clickable_result['cookies'] = self._get_all_cookies()
                 self._load_extractor_modules(clickable_result, logger, options)
-                self._extract_extractor_information()
+                with self._spans.span('clickable_extract'):
+                    self._extract_extractor_information()
                 clickable_result['total_tracker_num'] = clickable_result['disconnect_num'] + clickable_result[
                     'cookie_syncs_num']
                 button['total_tracker_num'] = clickable_result['total_tracker_num']
@@ -218,7 +231,8 @@ class PageScanner:
 
                 # Take screenshots and compute SSIM
                 file_name = sanitize_file_name(text=button["text"])
-                clickable_clicked = take_screenshot(self._tab, name=file_name)
+                with self._spans.span('clickable_screenshot'):
+                    clickable_clicked = take_screenshot(self._tab, name=file_name)
                 result.add_file(filename=file_name + '.png', contents=clickable_clicked['contents'])
                 if "button_pressed" not in result["initial_result"]["screenshots"]:
                     result["initial_result"]["screenshots"]["button_pressed"] = list()
@@ -226,7 +240,8 @@ class PageScanner:
                     .append({"filename": file_name + '.png',
                              "contents": base64.b64encode(clickable_clicked['contents']).decode('utf-8')})
                 clickable_clicked = readb64(clickable_clicked['contents'])
-                button['SSIM'] = calculate_ssim_score(image1=page_screenshot, image2=clickable_clicked)
+                with self._spans.span('clickable_ssim'):
+                    button['SSIM'] = calculate_ssim_score(image1=page_screenshot, image2=clickable_clicked)
 
                 clickable_result["request_log"] = self._page.request_log
                 clickable_result["document_request_log"] = self._page.document_request_log
@@ -284,6 +299,50 @@ class PageScanner:
         logger.info("Page scan finished.")
         return
 
+    def replay(self, tab, result, logger, options):
+        """Run the extractors and detectors on the recorded initial page load of tab."""
+        browser = pychrome.ReplayBrowser(tab)
+        with self._spans.span('setup_tab'):
+            self._setup_tab(browser=browser, options=options, result=result)
+        self._page.scan_start = datetime.fromtimestamp(tab.annotations['scan_start'])
+        self._load_modules(result, logger, options)
+        with self._spans.span('replay_events'):
+            tab.replay_events()
+        self._prepare_extraction(result, logger)
+        with self._spans.span('extract'):
+            self._extract_information()
+        self._unregister_network_callbacks()
+        self._unregister_dom_callbacks()
+        self._unregister_security_callbacks()
+        tab.stop()
+        self._reset()
+
+    def _prepare_extraction(self, result, logger):
+        """Initialize the results of the page before the extractors run.
+
+        Returns the screenshot of the page.
+        """
+        with self._spans.span('screenshot'):
+            page_screenshot = take_screenshot(self._tab, "website")
+        result['cookies'] = self._get_all_cookies()
+        result['cookie_notice_count'] = dict()
+        logger.info('Currently scanning website: {}'.format(result['site_url']))
+        result['TRACKING_BEFORE_ANY_ACTION'] = False
+        result['BUTTONS_HAVE_DIFFERENT_COLOR'] = False
+        result['BANNER_PRESENT_WITHOUT_TRACKING'] = False
+        result['SAME_SSIM'] = False
+
+        with self._spans.span('detect_language'):
+            result['language'] = detect_language(self._tab)
+        result['disconnect_num'] = 0
+        result['cookie_syncs_num'] = 0
+        result['total_tracker_num'] = 0
+        result["screenshots"] = dict()
+
+        with self._spans.span('get_document'):
+            self._tab.DOM.getDocument(depth=-1)
+        return page_screenshot
+
     def _cb_request_will_be_sent(self, request, requestId, **kwargs):
         # To avoid reparsing the URL in many places, we parse them all here
         request['parsed_url'] = urlparse(request['url'])
@@ -502,18 +561,18 @@ class PageScanner:
             self._tab.wait(random.uniform(0.050, 0.150))
 
     def _extract_information(self):
-        for extractor in self._extractors:
-            extractor.extract_information()
-        for detector in self._detectors:
-            detector.extract_information()
+        self._extract_extractor_information()
+        self._extract_detector_information()
 
     def _extract_extractor_information(self):
         for extractor in self._extractors:
-            extractor.extract_information()
+            with self._spans.span(extractor.__class__.__name__):
+                extractor.extract_information()
 
     def _extract_detector_information(self):
         for detector in self._detectors:
-            detector.extract_information()
+            with self._spans.span(detector.__class__.__name__):
+                detector.extract_information()
 
     def _receive_log(self, log_type, message, call_stack):
         for extractor in self._extractors:
@@ -525,7 +584,14 @@ class PageScanner:
             if extra_javascript:
                 self._extra_scripts.append(extra_javascript)
 
+    def _discard_recording(self):
+        if self._recorder is not None:
+            # The scan failed, so there is nothing to replay.
+            discard_cdp_recording(self._recorder)
+            self._recorder = None
+
     def _reset(self):
+        self._discard_recording()
         self._page_loaded.clear()
         self._document_will_change = threading.Event()
         self._debugger_attached = threading.Event()
@@ -538,8 +604,10 @@ class PageScanner:
         self._CLICKED = False
         self._SETTINGS_CANDIDATES = list()
 
-    def _setup_tab(self, browser, options):
+    def _setup_tab(self, browser, options, result=None):
         self._tab = browser.new_tab()
+        if result is not None and options.get('record_cdp'):
+            self._recorder = start_cdp_recording(self._tab, result)
         self._tab.start()
 
         self._page = Page(self._tab)
@@ -84,7 +84,8 @@ class TestsslshScanModuleBase(ScanModule):
         try:
             stage_method = getattr(self, '_scan_stage_' + stage_key)
             host = self._get_host(result)
-            scan_result = stage_method(host, self.target_parameters)
+            with meta.span('stage_' + stage_key):
+                scan_result = stage_method(host, self.target_parameters)
         except IncompleteStage as e:
             self.logger.info('testssl.sh result is incomplete.')
             scan_result = e.partial_result
@@ -5,11 +5,13 @@ import logging
 import os
 import pprint
 import string
+import subprocess
 import sys
 import tempfile
 import time
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from contextlib import ExitStack, contextmanager
 from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
@@ -17,15 +19,16 @@ from urllib.parse import urlparse
 from toposort import toposort, toposort_flatten
 
 from privacyscanner.filehandlers import DirectoryFileHandler
+from privacyscanner.journal import COMPRESSIONS, ResultJournal, has_zstandard
 from privacyscanner.raven import has_raven, raven
 from privacyscanner.result import Result
 from privacyscanner.scanmeta import ScanMeta
 from privacyscanner.scanmodules import load_modules
+from privacyscanner.spans import Spans
 from privacyscanner import defaultconfig
 from privacyscanner.loghandlers import ScanFileHandler, ScanStreamHandler
 from privacyscanner.exceptions import RescheduleLater, RetryScan
 from privacyscanner.utils import NumericLock
-from privacyscanner.db import clear_results, insert_domains, refill_queue
 
 CONFIG_LOCATIONS = [
     Path('~/.config/privacyscanner/config.py').expanduser(),
@@ -79,6 +82,8 @@ def run_workers(args):
 
     config = load_config(args.config)
     _require_dependencies(config)
+    scan_modules = load_modules(config['SCAN_MODULES'], config['SCAN_MODULE_OPTIONS'])
+    _check_worker_pools(config['WORKER_POOLS'], scan_modules.keys())
 
     raven_client = None
     if has_raven and config['RAVEN_DSN']:
@@ -86,7 +91,11 @@ def run_workers(args):
     master = WorkerMaster(config['QUEUE_DB_DSN'], config['SCAN_MODULES'],
                           config['SCAN_MODULE_OPTIONS'], config['MAX_TRIES'],
                           config['NUM_WORKERS'], config['MAX_EXECUTIONS'],
-                          config['MAX_EXECUTION_TIMES'], config['RAVEN_DSN'])
+                          config['MAX_EXECUTION_TIMES'], config['RAVEN_DSN'],
+                          config['LEASE_DURATION'], config['AUTOSCALE'],
+                          config['WORKER_POOLS'], config['WORKER_RECYCLING'],
+                          config['METRICS_ADDRESS'], config['WORKER_START_METHOD'],
+                          config['WORKER_PRELOAD'])
     try:
         master.start()
     except Exception:
@@ -96,6 +105,7 @@ def run_workers(args):
 def scan_site(args):
     config = load_config(args.config)
     _require_dependencies(config)
+    _check_results_compression(config)
 
     site_parsed = urlparse(args.site)
     if site_parsed.scheme not in ('http', 'https'):
@@ -103,15 +113,13 @@ def scan_site(args):
 
     results_dir = args.results
     if results_dir is None:
-        results_dir = slugify(site_parsed.netloc) + '_'
-        results_dir += hashlib.sha512(args.site.encode()).hexdigest()[:10]
+        results_dir = get_results_dir_name(args.site)
     results_dir = Path(results_dir).resolve()
     try:
         results_dir.mkdir(exist_ok=True)
     except IOError as e:
         raise CommandError('Could not create results directory: {}'.format(e)) from e
 
-    result_file = results_dir / 'results.json'
     result_json = {'site_url': args.site}
     if args.import_results:
         try:
@@ -123,17 +131,60 @@ def scan_site(args):
             raise CommandError('Could not parse result JSON: {}'.format(e)) from e
         else:
             result_json.update(import_json)
+    journal = ResultJournal(results_dir)
     try:
-        with result_file.open('w') as f:
-            json.dump(result_json, f, indent=2)
-            f.write('\n')
+        journal.start(result_json)
     except IOError as e:
         raise CommandError('Could not write result JSON: {}'.format(e)) from e
 
     scan_modules = load_modules(config['SCAN_MODULES'],
                                 config['SCAN_MODULE_OPTIONS'])
-    scan_module_names = args.scan_modules
+    scan_module_names = order_scan_modules(scan_modules, args.scan_modules,
+                                           args.skip_dependencies)
 
+    result = Result(result_json, DirectoryFileHandler(results_dir))
+    logs_dir = results_dir / 'logs'
+    logs_dir.mkdir(exist_ok=True)
+    lock_dir = config['STORAGE_PATH'] / 'locks'
+    lock_dir.mkdir(exist_ok=True)
+    spans = Spans()
+    scan_queue = create_scan_queue(scan_module_names)
+    has_error = run_scan_queue(scan_queue, scan_modules, result, journal, logs_dir,
+                               lock_dir, config['MAX_TRIES'], spans, ScanStreamHandler(),
+                               max_concurrency=config['MAX_CONCURRENT_MODULES'])
+    journal.materialize(result.get_results(), config['RESULTS_COMPRESSION'])
+    pprint.pprint(result.get_results())
+    print('\nTime per phase (including retries):')
+    print(spans.format())
+    if has_error:
+        sys.exit(1)
+
+
+def scan_list(args):
+    from privacyscanner.scanlist import read_site_list, scan_list
+
+    config = load_config(args.config)
+    _require_dependencies(config)
+    _check_results_compression(config)
+
+    site_urls = read_site_list(args.file, args.number_of_entries)
+    results_dir = args.results
+    if results_dir is None:
+        results_dir = Path(args.file).stem + '_results'
+    num_processes = args.processes or config['NUM_WORKERS']
+    concurrent_sites = args.concurrent_sites or config['CONCURRENT_SITES']
+    scan_list(config, site_urls, results_dir, num_processes, args.scan_modules,
+              args.skip_dependencies, concurrent_sites)
+
+
+def get_results_dir_name(site_url):
+    results_dir = slugify(urlparse(site_url).netloc) + '_'
+    results_dir += hashlib.sha512(site_url.encode()).hexdigest()[:10]
+    return results_dir
+
+
+def order_scan_modules(scan_modules, scan_module_names=None, skip_dependencies=False):
+    """Return the names of the scan modules to run in the order of their dependencies."""
     if scan_module_names is None:
         scan_module_names = scan_modules.keys()
 
@@ -142,68 +193,169 @@ def scan_site(args):
     for scan_module_name in scan_module_names:
         mod = scan_modules[scan_module_name]
         dependencies[mod.name] = set(mod.dependencies)
-    scan_module_names = toposort_flatten(dependencies)
+    ordered_names = toposort_flatten(dependencies)
 
-    if args.skip_dependencies:
-        scan_module_names = [
+    if skip_dependencies:
+        ordered_names = [
             scan_module_name
-            for scan_module_name in scan_module_names
-            if scan_module_name in args.scan_modules
+            for scan_module_name in ordered_names
+            if scan_module_name in scan_module_names
         ]
+    return ordered_names
 
-    has_error = False
-    result = Result(result_json, DirectoryFileHandler(results_dir))
-    stream_handler = ScanStreamHandler()
-    logs_dir = results_dir / 'logs'
-    logs_dir.mkdir(exist_ok=True)
-    lock_dir = config['STORAGE_PATH'] / 'locks'
-    lock_dir.mkdir(exist_ok=True)
+
+def create_scan_queue(scan_module_names):
+    # The queue is a stack, i.e., the next scan module is at the end.
     scan_queue = [QueueEntry(mod_name, 0, None) for mod_name in scan_module_names]
     scan_queue.reverse()
+    return scan_queue
+
+
+def run_scan_queue(scan_queue, scan_modules, result, journal, logs_dir, lock_dir,
+                   max_tries, spans, stream_handler=None, wait=True, max_concurrency=1,
+                   change_dir=True):
+    """Run the scan modules of scan_queue on a site.
+
+    The updates of every scan module to result are appended to journal.
+
+    Scan modules are retried up to max_tries times. A scan module which
+    raised RescheduleLater is run again after the given time. If wait is
+    False, the function rather returns when the next scan module has to
+    wait and leaves it and all others in scan_queue. Up to max_concurrency
+    scan modules which do not depend on each other run at the same time.
+    The scan modules run in a temporary working directory unless
+    change_dir is False, which callers that scan several sites in
+    threads have to set, because the working directory belongs to the
+    process. Returns whether a scan module failed.
+    """
+    has_error = False
     while scan_queue:
-        scan_module_name, num_try, not_before = scan_queue.pop()
-        if not_before is not None:
+        entry = scan_queue.pop()
+        if entry.not_before is not None:
+            if not wait and datetime.utcnow() < entry.not_before:
+                scan_queue.append(entry)
+                break
             # noinspection PyTypeChecker
-            while datetime.utcnow() < not_before:
+            while datetime.utcnow() < entry.not_before:
                 time.sleep(0.5)
-        mod = scan_modules[scan_module_name]
-        num_try += 1
-        log_filename = (logs_dir / (mod.name + '.log'))
-        file_handler = ScanFileHandler(str(log_filename))
-        logger = logging.Logger(mod.name)
+        batch = [entry] + _pop_independent(scan_queue, scan_modules, [entry],
+                                           max_concurrency - 1)
+        with ExitStack() as stack:
+            if change_dir:
+                stack.enter_context(_temporary_working_directory())
+            if len(batch) == 1:
+                keys_before = set(result.keys())
+                outcomes = [_run_scan_module(entry, scan_modules[entry.scan_module_name],
+                                             result, logs_dir, lock_dir, max_tries, spans,
+                                             stream_handler)]
+                changes = [(entry.scan_module_name, result.get_updates(),
+                            keys_before - set(result.keys()))]
+            else:
+                outcomes, changes = _run_concurrently(batch, scan_modules, result, logs_dir,
+                                                      lock_dir, max_tries, spans,
+                                                      stream_handler)
+        result.clear_updates()
+        for scan_module_name, updates, removed in changes:
+            journal.append(scan_module_name, updates, removed)
+        # Scan modules which run again are next, in their previous order.
+        for retry_entry, module_error in reversed(outcomes):
+            if retry_entry is not None:
+                scan_queue.append(retry_entry)
+            has_error |= module_error
+    return has_error
+
+
+@contextmanager
+def _temporary_working_directory():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        old_cwd = os.getcwd()
+        os.chdir(temp_dir)
+        try:
+            yield temp_dir
+        finally:
+            os.chdir(old_cwd)
+
+
+def _pop_independent(scan_queue, scan_modules, batch, max_entries):
+    """Pop the next entries of scan_queue which can run together with batch."""
+    entries = []
+    names = {entry.scan_module_name for entry in batch}
+    while scan_queue and len(entries) < max_entries:
+        entry = scan_queue[-1]
+        if entry.not_before is not None and datetime.utcnow() < entry.not_before:
+            break
+        if names & set(scan_modules[entry.scan_module_name].dependencies):
+            break
+        entries.append(scan_queue.pop())
+        names.add(entry.scan_module_name)
+    return entries
+
+
+def _run_concurrently(batch, scan_modules, result, logs_dir, lock_dir, max_tries, spans,
+                      stream_handler):
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Every scan module gets its own copy of the result. Their updates are
+    # merged in the order of the queue, not in the order in which the scan
+    # modules finish, so the result does not depend on timing.
+    module_results = [result.copy() for _ in batch]
+    with ThreadPoolExecutor(len(batch)) as executor:
+        futures = [executor.submit(_run_scan_module, entry, scan_modules[entry.scan_module_name],
+                                   module_result, logs_dir, lock_dir, max_tries, spans,
+                                   stream_handler)
+                   for entry, module_result in zip(batch, module_results)]
+        outcomes = [future.result() for future in futures]
+    keys_before = set(result.keys())
+    changes = []
+    for entry, module_result in zip(batch, module_results):
+        updates = module_result.get_updates()
+        removed = keys_before - set(module_result.keys())
+        result.update(updates)
+        for key in removed:
+            if key in result:
+                del result[key]
+        changes.append((entry.scan_module_name, updates, removed))
+    return outcomes, changes
+
+
+def _run_scan_module(entry, mod, result, logs_dir, lock_dir, max_tries, spans, stream_handler):
+    """Run a scan module once.
+
+    Returns the queue entry to run it again, or None, and whether it failed.
+    """
+    scan_module_name, num_try, not_before = entry
+    num_try += 1
+    retry_entry = None
+    has_error = False
+    log_filename = (logs_dir / (mod.name + '.log'))
+    file_handler = ScanFileHandler(str(log_filename))
+    logger = logging.Logger(mod.name)
+    if stream_handler is not None:
         logger.addHandler(stream_handler)
-        logger.addHandler(file_handler)
-        with tempfile.TemporaryDirectory() as temp_dir:
-            old_cwd = os.getcwd()
-            os.chdir(temp_dir)
-            logger.info('Starting %s', mod.name)
-            try:
-                with NumericLock(lock_dir) as worker_id:
-                    scan_meta = ScanMeta(worker_id=worker_id, num_tries=num_try)
-                    mod.logger = logger
-                    mod.scan_site(result, scan_meta)
-            except RetryScan:
-                if num_try <= config['MAX_TRIES']:
-                    scan_queue.append(QueueEntry(scan_module_name, num_try, not_before))
-                    logger.info('Scan module `%s` will be retried', mod.name)
-                else:
-                    has_error = True
-            except RescheduleLater as e:
-                scan_queue.append(QueueEntry(scan_module_name, num_try, e.not_before))
-            except Exception:
-                if num_try <= config['MAX_TRIES']:
-                    scan_queue.append(QueueEntry(scan_module_name, num_try, not_before))
-                has_error = True
-                logger.exception('Scan module `%s` failed.', mod.name)
-            finally:
-                os.chdir(old_cwd)
-                with result_file.open('w') as f:
-                    json.dump(result.get_results(), f, indent=2, sort_keys=True)
-                    f.write('\n')
-            logger.info('Finished %s', mod.name)
-    pprint.pprint(result.get_results())
-    if has_error:
-        sys.exit(1)
+    logger.addHandler(file_handler)
+    logger.info('Starting %s', mod.name)
+    try:
+        with NumericLock(lock_dir) as worker_id:
+            scan_meta = ScanMeta(worker_id=worker_id, num_tries=num_try, spans=spans)
+            mod.logger = logger
+            with scan_meta.span(mod.name):
+                mod.scan_site(result, scan_meta)
+    except RetryScan:
+        if num_try <= max_tries:
+            retry_entry = QueueEntry(scan_module_name, num_try, not_before)
+            logger.info('Scan module `%s` will be retried', mod.name)
+        else:
+            has_error = True
+    except RescheduleLater as e:
+        retry_entry = QueueEntry(scan_module_name, num_try, e.not_before)
+    except Exception:
+        if num_try <= max_tries:
+            retry_entry = QueueEntry(scan_module_name, num_try, not_before)
+        has_error = True
+        logger.exception('Scan module `%s` failed.', mod.name)
+    logger.info('Finished %s', mod.name)
+    file_handler.close()
+    return retry_entry, has_error
 
 
 def update_dependencies(args):
@@ -243,6 +395,96 @@ def print_master_config(args):
     print(output)
 
 
+# The database commands import pandas, which takes longer than everything
+# else the light commands need, so they are only imported when they run.
+def insert_list(args):
+    from privacyscanner.db import insert_domains
+    insert_domains.insert_list(args)
+
+
+def list_files(args):
+    from privacyscanner.db import insert_domains
+    insert_domains.list_files(args)
+
+
+def refill_queue(args):
+    from privacyscanner.db import refill_queue
+    refill_queue.main(args)
+
+
+def clear_results(args):
+    from privacyscanner.db import clear_results
+    clear_results.main(args)
+
+
+def profile_startup(argv):
+    """Run the command with `python -X importtime` and report where its imports spend time."""
+    code = 'import sys; sys.argv[0] = "privacyscanner"; from privacyscanner.scanner import main; main()'
+    command = [sys.executable, '-X', 'importtime', '-c', code] + argv
+    start = time.monotonic()
+    p = subprocess.Popen(command, stderr=subprocess.PIPE, universal_newlines=True)
+    self_times = defaultdict(int)
+    num_modules = 0
+    total_time = 0
+    for line in p.stderr:
+        if not line.startswith('import time:'):
+            sys.stderr.write(line)
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        if not self_time.strip().isdigit():
+            # The header of the import times
+            continue
+        self_times[name.strip().split('.')[0]] += int(self_time)
+        total_time += int(self_time)
+        num_modules += 1
+    returncode = p.wait()
+    wall_time = time.monotonic() - start
+
+    print('\nStartup profile of `privacyscanner {}`:'.format(' '.join(argv)), file=sys.stderr)
+    print('  {:<32} {:9.3f} s'.format('wall time until exit', wall_time), file=sys.stderr)
+    print('  {:<32} {:9.3f} s ({} modules)'.format('imports', total_time / 1e6, num_modules),
+          file=sys.stderr)
+    print('Import time per top-level package:', file=sys.stderr)
+    slowest = sorted(self_times.items(), key=lambda item: item[1], reverse=True)
+    for package, package_time in slowest[:15]:
+        print('  {:<32} {:9.3f} s'.format(package, package_time / 1e6), file=sys.stderr)
+    return returncode
+
+
+def recover_results(args):
+    config = load_config(args.config)
+    _check_results_compression(config)
+    journal = ResultJournal(Path(args.results))
+    if not journal.exists():
+        raise CommandError('There is no unfinished scan in {}.'.format(args.results))
+    try:
+        result_dict = journal.replay()
+    except ValueError as e:
+        raise CommandError('Could not parse the journal: {}'.format(e)) from e
+    results_file = journal.materialize(result_dict, config['RESULTS_COMPRESSION'])
+    print('Wrote the results of the finished scan modules to {}.'.format(results_file))
+
+
+def _check_results_compression(config):
+    if config['RESULTS_COMPRESSION'] not in COMPRESSIONS:
+        raise CommandError('Unknown RESULTS_COMPRESSION: {}'.format(config['RESULTS_COMPRESSION']))
+    if config['RESULTS_COMPRESSION'] == 'zstd' and not has_zstandard:
+        raise CommandError('RESULTS_COMPRESSION = \'zstd\' requires the zstandard package.')
+
+
+def _check_worker_pools(worker_pools, scan_module_names):
+    for name, options in (worker_pools or {}).items():
+        pool_modules = options.get('scan_modules')
+        if pool_modules is None:
+            continue
+        if not pool_modules:
+            raise CommandError('Worker pool {} has no scan modules.'.format(name))
+        unknown = sorted(set(pool_modules) - set(scan_module_names))
+        if unknown:
+            raise CommandError('Worker pool {} has unknown scan modules: {}'.format(
+                name, ', '.join(unknown)))
+
+
 def _require_dependencies(config):
     if not config['STORAGE_PATH'].exists():
         print('Please run `privacyscanner update_dependencies` before the first scan.')
@@ -251,6 +493,8 @@ def _require_dependencies(config):
 
 def main():
     parser = argparse.ArgumentParser(description='Scan sites for privacy.')
+    parser.add_argument('--profile-startup', dest='profile_startup', action='store_true',
+                        help='Run the command and report the time its imports take')
     subparsers = parser.add_subparsers(dest='command')
 
     parser_run_workers = subparsers.add_parser('run_workers')
@@ -272,6 +516,33 @@ def main():
     parser_scan.add_argument('--print', dest='print_result', action='store_true')
     parser_scan.set_defaults(func=scan_site)
 
+    parser_scan_list = subparsers.add_parser('scan_list', aliases=['scan-list'])
+    parser_scan_list.add_argument('file', help='List of sites to scan, one per line or as '
+                                               'CSV with the columns rank,domain')
+    parser_scan_list.add_argument('-c', '--config', help='Configuration_file')
+    parser_scan_list.add_argument('-r', '--results',
+                                  help='Directory to store results, default: <file>_results. '
+                                       'Use the same directory to continue an interrupted scan.')
+    parser_scan_list.add_argument('-n', '--number-of-entries', dest='number_of_entries', type=int,
+                                  help='Scan only the first sites of the list')
+    parser_scan_list.add_argument('-p', '--processes', type=int,
+                                  help='Number of processes, default: NUM_WORKERS')
+    parser_scan_list.add_argument('-k', '--concurrent-sites', dest='concurrent_sites', type=int,
+                                  help='Number of sites every process scans at once, '
+                                       'default: CONCURRENT_SITES')
+    parser_scan_list.add_argument('-m', '--scan-modules', dest='scan_modules',
+                                  type=lambda scans: [x.strip() for x in scans.split(',')],
+                                  help='Comma separated list of scan modules')
+    parser_scan_list.add_argument('--skip-dependencies', action='store_true',
+                                  help='Do not run dependencies that are not explicitly '
+                                       'specified using --scan-modules')
+    parser_scan_list.set_defaults(func=scan_list)
+
+    parser_recover_results = subparsers.add_parser('recover_results')
+    parser_recover_results.add_argument('results', help='Results directory of an interrupted scan')
+    parser_recover_results.add_argument('-c', '--config', help='Configuration_file')
+    parser_recover_results.set_defaults(func=recover_results)
+
     parser_print_master_config = subparsers.add_parser('print_master_config')
     parser_print_master_config.add_argument('-c', '--config', help='Configuration_file')
     parser_print_master_config.set_defaults(func=print_master_config)
@@ -285,26 +556,31 @@ def main():
     parser_insert.add_argument('-f','--file', help='Scanning list to load into the database.', type=str, required=True)
     parser_insert.add_argument('-n','--number-of-entries', help='Enter the number of sites to load from the scanning '
                                                                 'list.', type=int)
-    parser_insert.set_defaults(func=insert_domains.insert_list)
+    parser_insert.set_defaults(func=insert_list)
 
     parser_list = subparsers.add_parser('scanning_lists')
-    parser_list.set_defaults(func=insert_domains.list_files)
+    parser_list.set_defaults(func=list_files)
 
     parser_refill_queue = subparsers.add_parser('refill_queue')
     parser_refill_queue.add_argument('-c', '--config', help='Configuration_file')
     parser_refill_queue.add_argument('-m', '--module', help='The scanning module that should be used during refill of the queue', required=True)
-    parser_refill_queue.set_defaults(func=refill_queue.main)
+    parser_refill_queue.set_defaults(func=refill_queue)
 
     parser_clear_results = subparsers.add_parser('clear_results')
     parser_clear_results.add_argument('-c', '--config', help='Configuration_file')
-    parser_clear_results.set_defaults(func=clear_results.main)
+    parser_clear_results.set_defaults(func=clear_results)
 
     args = parser.parse_args()
     if args.command is None:
         parser.error('No arguments')
-    if args.command == 'scan' and args.skip_dependencies and not args.scan_modules:
+    if (args.command in ('scan', 'scan_list', 'scan-list') and args.skip_dependencies
+            and not args.scan_modules):
         parser.error('--skip-dependencies can only be set when using --scan-modules')
+    if args.profile_startup:
+        argv = [arg for arg in sys.argv[1:] if arg != '--profile-startup']
+        sys.exit(profile_startup(argv))
     if args.command == 'list_files':
+        from privacyscanner.db import insert_domains
         # Print error message if 'privacyscanner/scanning_lists' is not present or empty.
         insert_domains._check_prerequisites()
     try:
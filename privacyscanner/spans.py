@@ -0,0 +1,72 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Spans:
+    """Records how long the phases of a scan job take.
+
+    A phase is recorded with ``with spans.span('navigate'): ...``. Phases
+    which are started within another phase of the same thread are named
+    by their path, e.g. ``chrome/extract/CookiesExtractor``. The times of
+    phases which run several times are added up.
+    """
+    def __init__(self):
+        self._totals = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        stack = self._get_stack()
+        stack.append(name)
+        path = '/'.join(stack)
+        with self._lock:
+            # Register the phase when it starts, so that it is listed
+            # before the phases which are started within it.
+            self._totals.setdefault(path, [0.0, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self.add(path, time.perf_counter() - start)
+
+    def add(self, path, duration):
+        with self._lock:
+            total = self._totals.setdefault(path, [0.0, 0])
+            total[0] += duration
+            total[1] += 1
+
+    def to_dict(self):
+        """Return the phases as {path: [seconds, count]}."""
+        with self._lock:
+            return {path: [round(seconds, 3), count]
+                    for path, (seconds, count) in self._totals.items()}
+
+    def format(self):
+        """Return the phases as a tree in the order in which they started."""
+        totals = self.to_dict()
+        order = {path: i for i, path in enumerate(totals)}
+
+        def sort_key(path):
+            parts = path.split('/')
+            return [order.get('/'.join(parts[:i + 1]), -1) for i in range(len(parts))]
+
+        lines = []
+        for path in sorted(totals, key=sort_key):
+            seconds, count = totals[path]
+            depth = path.count('/')
+            name = '  ' * depth + path.rsplit('/', 1)[-1]
+            line = '{:<48} {:9.3f} s'.format(name, seconds)
+            if count > 1:
+                line += ' ({}x)'.format(count)
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def _get_stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
@@ -13,6 +13,10 @@ import psutil
 
 FAKE_UA = 'Mozilla/5.0 (X11; Linux x86_64; rv:61.0) Gecko/20100101 Firefox/61.0'
 
+# PIDs of child processes that are reused for several scans, e.g., pooled
+# browsers. kill_everything(pid, only_children=True) leaves them alone.
+persistent_children = set()
+
 
 class DownloadVerificationFailed(Exception):
     pass
@@ -26,21 +30,36 @@ class NumericLock:
     def __enter__(self):
         i = 0
         while True:
+            # flock() and not lockf(), because the locks of lockf() belong
+            # to the process and scan modules may run in several threads.
+            lock_file = self.lock_dir / ('%d.lock' % i)
+            f = lock_file.open('wb')
             try:
-                f = (self.lock_dir / ('%d.lock' % i)).open('wb')
-                fcntl.lockf(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                self._lock_file = f
-                return i
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
             except OSError as e:
+                f.close()
                 if e.errno in (errno.EACCES, errno.EAGAIN):
                     i += 1
                     continue
                 raise
+            # The previous owner may have removed the file after we opened
+            # it, so the lock is only ours if it is still the same file.
+            try:
+                is_same_file = os.path.samestat(os.fstat(f.fileno()), os.stat(str(lock_file)))
+            except FileNotFoundError:
+                is_same_file = False
+            if not is_same_file:
+                f.close()
+                continue
+            self._lock_file = f
+            return i
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        fcntl.lockf(self._lock_file.fileno(), fcntl.LOCK_UN)
-        self._lock_file.close()
+        # Remove the file before unlocking it, so that nobody can lock it
+        # between both.
         os.unlink(self._lock_file.name)
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+        self._lock_file.close()
 
 
 def download_file(url, fileobj, verify_hash=None):
@@ -99,9 +118,22 @@ def calculate_jaccard_index(a: bytes, b: bytes) -> float:
     return len(intersection) / len(union)
 
 
+def get_tree_rss(pid):
+    """Return the memory usage of a process and all its descendants."""
+    rss = 0
+    with suppress(psutil.NoSuchProcess):
+        process = psutil.Process(pid)
+        for p in [process] + process.children(recursive=True):
+            with suppress(psutil.NoSuchProcess):
+                rss += p.memory_info().rss
+    return rss
+
+
 def kill_everything(pid, timeout=3, only_children=False):
     # First, we take care of the children.
     procs = psutil.Process(pid).children()
+    if only_children:
+        procs = [p for p in procs if p.pid not in persistent_children]
     # Suspend first before sending SIGTERM to avoid thundering herd problems
     for p in procs:
         with suppress(psutil.NoSuchProcess):
@@ -1,75 +1,100 @@
+import fcntl
 import logging
 import multiprocessing
 import os
 import signal
 import socket
+import struct
 import tempfile
+import termios
+import threading
 import time
-from datetime import datetime
+from contextlib import suppress
+from datetime import datetime, timezone
 from multiprocessing.connection import wait
 
-import psycopg2
+from psycopg2.extras import Json
 
+from privacyscanner.autoscaler import Autoscaler
 from privacyscanner.exceptions import RetryScan, RescheduleLater
 from privacyscanner.filehandlers import NoOpFileHandler
-from privacyscanner.jobqueue import JobQueue
+from privacyscanner.jobqueue import DEFAULT_LEASE_DURATION, JobQueue, LeaseKeeper
+from privacyscanner.metrics import (DURATION_BUCKETS, LATENCY_BUCKETS, QUEUE_WAIT_BUCKETS,
+                                    STARTUP_BUCKETS, MetricsServer, Registry)
+from privacyscanner.preload import get_scan_modules, set_preload
 from privacyscanner.raven import has_raven, raven
+from privacyscanner.recycling import RecyclingPolicy
 from privacyscanner.result import Result
 from privacyscanner.scanmeta import ScanMeta
-from privacyscanner.scanmodules import load_modules
+from privacyscanner.spans import Spans
+from privacyscanner.workerpools import allocate_workers, create_pools
+from privacyscanner.writebuffer import WriteBehindBuffer
 from privacyscanner.loghandlers import WorkerWritePipeHandler, ScanStreamHandler
 from privacyscanner.utils import kill_everything
 
 
-_JOB_STARTED_QUERY = """
-UPDATE scanner_scaninfo
-SET scan_host = %s,
-    time_started = %s,
-    num_tries = num_tries + 1
-WHERE scan_id = %s AND scan_module = %s
-"""
+# Idle workers wait for a notification about new jobs, but poll the queue
+# nevertheless after this time, e.g., for jobs which have a not_before. The
+# time doubles while no job arrives.
+_MIN_IDLE_WAIT = 1
+_MAX_IDLE_WAIT = 16
 
-_JOB_FINISHED_QUERY = """
-UPDATE scanner_scaninfo
-SET time_finished = %s
-WHERE scan_id = %s AND scan_module = %s
-"""
+# Workers do not wait for the master to process their events, but they stop
+# and wait for acks if the master falls behind by this many events.
+_MAX_UNACKED_EVENTS = 1000
 
-_JOB_FAILED_QUERY = """
-UPDATE scanner_scaninfo
-SET scan_host = NULL,
-    time_started = NULL
-WHERE scan_id = %s AND scan_module = %s
-"""
+# The master reads at most this many events from one worker before it looks
+# at the other workers again.
+_MAX_EVENTS_PER_WAKEUP = 100
 
-_LOG_QUERY = """
-INSERT INTO scanner_logentry (scan_id, scan_module, scan_host, time_created, level, message)
-VALUES (%s, %s, %s, %s, %s, %s)
-"""
+# Workers of a pool which have been idle for this many seconds are lent to
+# other pools.
+_POOL_IDLE_TIME = 30
+_POOL_REBALANCE_INTERVAL = 5
 
 
 class WorkerInfo:
-    def __init__(self, worker_id, process, read_pipe, stop_event, ack_event):
+    def __init__(self, worker_id, process, read_pipe, stop_event, ack_pipe, pool):
         self.id = worker_id
         self.process = process
+        self.pool = pool
         self.read_pipe = read_pipe
         self.stop_event = stop_event
-        self.ack_event = ack_event
+        self.ack_pipe = ack_pipe
+        self.pipe_closed = False
         self.scan_id = None
         self.scan_module = None
         self._heartbeat = None
         self._last_execution_time = None
+        self._idle_since = time.time()
+        self._time_created = time.monotonic()
+        self.startup_time = None
+        self._last_seq = 0
+        self._acked_seq = 0
         self.ping()
 
     @property
     def pid(self):
         return self.process.pid
 
-    def ping(self):
+    def ping(self, seq=None):
         self._heartbeat = time.time()
+        if seq is not None:
+            self._last_seq = seq
 
     def ack(self):
-        self.ack_event.set()
+        # Acknowledge all events processed so far at once.
+        if self._last_seq == self._acked_seq or self.pipe_closed:
+            return
+        try:
+            self.ack_pipe.send(self._last_seq)
+        except OSError:
+            # The worker is gone, nobody is waiting for our ack.
+            return
+        self._acked_seq = self._last_seq
+
+    def notify_ready(self):
+        self.startup_time = time.monotonic() - self._time_created
 
     def notify_job_started(self, scan_id, scan_module):
         self.scan_id = scan_id
@@ -79,25 +104,50 @@ class WorkerInfo:
     def notify_job_finished(self):
         self.scan_id = None
         self.scan_module = None
+        self._last_execution_time = None
+        self._idle_since = time.time()
 
     notify_job_failed = notify_job_finished
 
+    def get_idle_time(self):
+        if self.scan_id is not None:
+            return 0
+        return max(time.time() - self._idle_since, 0)
+
     def get_execution_time(self):
         if self._last_execution_time is None:
             return 0
         return max(time.time() - self._last_execution_time, 0)
 
+    def get_pipe_backlog(self):
+        """Return how many bytes of events are waiting in our read pipe."""
+        if self.pipe_closed:
+            return 0
+        try:
+            buf = fcntl.ioctl(self.read_pipe.fileno(), termios.FIONREAD, b'\0\0\0\0')
+        except OSError:
+            return 0
+        return struct.unpack('i', buf)[0]
+
     def stop(self):
         self.stop_event.set()
 
+    @property
+    def stopping(self):
+        return self.stop_event.is_set()
+
     def __str__(self):
-        return '<{}/{} pid={}>'.format(self.scan_id, self.scan_module, self.pid)
+        return '<{}/{} pid={} pool={}>'.format(self.scan_id, self.scan_module, self.pid,
+                                               self.pool.name)
 
 
 class WorkerMaster:
     def __init__(self, db_dsn, scan_module_list, scan_module_options=None,
                  max_tries=3, num_workers=2, max_executions=100,
-                 max_execution_times=None, raven_dsn=None):
+                 max_execution_times=None, raven_dsn=None,
+                 lease_duration=DEFAULT_LEASE_DURATION, autoscale=None, worker_pools=None,
+                 recycling=None, metrics_address=None, start_method='spawn',
+                 preload_modules=None):
         self.name = socket.gethostname()
         self._db_dsn = db_dsn
         self.scan_module_list = scan_module_list
@@ -107,44 +157,127 @@ class WorkerMaster:
         self.max_tries = max_tries
         self.num_workers = num_workers
         self.max_executions = max_executions
+        self.recycling = recycling
+        self.start_method = start_method
+        if preload_modules is None:
+            preload_modules = []
+        self.preload_modules = preload_modules
         if max_execution_times is None:
             max_execution_times = {None: None}
         self.max_execution_times = max_execution_times
         self.max_execution_time = max_execution_times.get(None)
         self._raven_dsn = raven_dsn
+        self._autoscaler = None
+        if autoscale is not None:
+            self._autoscaler = Autoscaler(**autoscale)
+            self.num_workers = min(max(num_workers, self._autoscaler.min_workers),
+                                   self._autoscaler.max_workers)
         self._workers = {}
-        self._worker_ids = set(range(num_workers))
+        max_workers = self._autoscaler.max_workers if self._autoscaler else self.num_workers
+        self._worker_ids = set(range(max_workers))
+        self._pools = create_pools(worker_pools)
+        allocation = allocate_workers(self.num_workers, self._pools)
+        for pool in self._pools:
+            pool.num_target = allocation[pool.name]
         self._terminated_worker_pids = set()
+        self._timers = []
+        self._wakeup_fd = None
         self._running = False
         self._force_stop = False
-        self._conn = None
-        self._connect()
+        self._setup_metrics()
+        self._metrics_address = metrics_address
+        self._metrics_server = None
+        self._write_buffer = WriteBehindBuffer(
+            db_dsn, on_flush=self._metric_write_latency.observe)
+        self._lease_keeper = LeaseKeeper(db_dsn, self.name, lease_duration)
+
+    def _setup_metrics(self):
+        self._metrics = Registry()
+        m = self._metrics
+        self._metric_jobs_started = m.counter(
+            'privacyscanner_jobs_started_total',
+            'Jobs claimed from the queue and started by a worker.', ['module'])
+        self._metric_jobs_finished = m.counter(
+            'privacyscanner_jobs_finished_total', 'Jobs which finished.', ['module'])
+        self._metric_jobs_failed = m.counter(
+            'privacyscanner_jobs_failed_total',
+            'Jobs which failed, including hanging jobs.', ['module'])
+        self._metric_jobs_rescheduled = m.counter(
+            'privacyscanner_jobs_rescheduled_total',
+            'Jobs which asked to be run again later.', ['module'])
+        self._metric_job_duration = m.histogram(
+            'privacyscanner_job_duration_seconds', 'Time from the start to the end of a job.',
+            DURATION_BUCKETS, ['module'])
+        self._metric_queue_wait = m.histogram(
+            'privacyscanner_queue_wait_seconds',
+            'Time from the creation of a scan to the start of one of its jobs.',
+            QUEUE_WAIT_BUCKETS, ['module'])
+        self._metric_hang_kills = m.counter(
+            'privacyscanner_hang_kills_total',
+            'Workers killed because their job ran too long.', ['module'])
+        self._metric_worker_starts = m.counter(
+            'privacyscanner_worker_starts_total', 'Started worker processes.', ['pool'])
+        self._metric_worker_startup = m.histogram(
+            'privacyscanner_worker_startup_seconds',
+            'Time from starting a worker until it is ready to fetch jobs.', STARTUP_BUCKETS,
+            ['start_method'])
+        self._metric_worker_exits = m.counter(
+            'privacyscanner_worker_exits_total', 'Exited worker processes.', ['pool'])
+        self._metric_workers = m.gauge(
+            'privacyscanner_workers', 'Running worker processes.', ['pool', 'state'])
+        self._metric_pipe_backlog = m.gauge(
+            'privacyscanner_pipe_backlog_bytes',
+            'Bytes of worker events the master has not read yet.', ['pool'])
+        self._metric_write_latency = m.histogram(
+            'privacyscanner_db_write_duration_seconds',
+            'Duration of writing the buffered job updates and logs.', LATENCY_BUCKETS)
+        self._metric_write_buffer = m.gauge(
+            'privacyscanner_write_buffer', 'State of the write-behind buffer.', ['metric'])
 
     def start(self):
-        multiprocessing.set_start_method('spawn')
-        signal.signal(signal.SIGINT, self._handle_signal_stop)
-        signal.signal(signal.SIGTERM, self._handle_signal_stop)
-        signal.signal(signal.SIGUSR1, self._handle_signal_usr1)
+        multiprocessing.set_start_method(self.start_method)
+        if self.start_method == 'forkserver':
+            # The server imports these modules and loads the scan modules
+            # once. Workers are forked from it with everything loaded.
+            set_preload(self.scan_module_list, self.scan_module_options)
+            multiprocessing.set_forkserver_preload(
+                ['privacyscanner.worker', 'privacyscanner.preload'] + list(self.preload_modules))
+        self._setup_signals()
         self._running = True
+        if self._metrics_address is not None:
+            self._metrics_server = MetricsServer(self._metrics, *self._metrics_address)
+            self._metrics_server.start()
+            print('Serving metrics on http://{}:{}/metrics'.format(
+                *self._metrics_server.address[:2]))
+            self._add_timer(1, self._update_metrics)
+        self._add_timer(1, self._check_hanging)
+        self._add_timer(self._write_buffer.flush_interval, self._write_buffer.flush_if_due)
+        # Extend the leases often enough that a single failed attempt does
+        # not let them expire.
+        self._add_timer(self._lease_keeper.lease_duration / 3, self._extend_leases)
+        self._add_timer(self._lease_keeper.lease_duration, self._lease_keeper.reap)
+        if self._autoscaler is not None:
+            self._add_timer(self._autoscaler.interval, self._autoscale)
+        if len(self._pools) > 1:
+            self._add_timer(_POOL_REBALANCE_INTERVAL, self._rebalance_pools)
         while self._running:
             self._start_workers()
-            self._process_queue()
-            self._check_hanging()
-            self._remove_workers()
-            time.sleep(0.25)
+            self._process_events()
         print('\nGently asking workers to stop after their current job ...')
         for worker_info in self._workers.values():
             worker_info.stop()
+        self._add_timer(1, self._print_running_workers)
         while not self._force_stop and self._workers:
-            workers_str = self._get_running_workers_str()
-            print('{} workers still alive: {}'.format(len(self._workers), workers_str))
-            self._check_hanging()
-            self._remove_workers()
-            time.sleep(0.25)
+            self._process_events()
         if self._workers:
             print('Forcefully killing workers ...')
             for worker_info in self._workers.values():
                 kill_everything(worker_info.pid)
+        if not self._write_buffer.flush():
+            print('Could not write {} log entries and job updates.'.format(
+                len(self._write_buffer)))
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
         print('All workers stopped. Shutting down ...')
 
     def stop(self):
@@ -153,53 +286,134 @@ class WorkerMaster:
         else:
             self._force_stop = True
 
-    def _connect(self):
-        if self._conn is None or self._conn.closed:
-            self._conn = psycopg2.connect(self._db_dsn)
+    def _setup_signals(self):
+        # Signals have to interrupt our wait for events. Therefore, the
+        # signal module writes to this pipe whenever a signal arrives.
+        self._wakeup_fd, wakeup_write_fd = os.pipe()
+        os.set_blocking(self._wakeup_fd, False)
+        os.set_blocking(wakeup_write_fd, False)
+        signal.set_wakeup_fd(wakeup_write_fd)
+        signal.signal(signal.SIGINT, self._handle_signal_stop)
+        signal.signal(signal.SIGTERM, self._handle_signal_stop)
+        signal.signal(signal.SIGUSR1, self._handle_signal_usr1)
+
+    def _add_timer(self, interval, callback):
+        self._timers.append([time.monotonic() + interval, interval, callback])
+
+    def _run_timers(self):
+        """Run all due timers and return the time until the next one is due."""
+        now = time.monotonic()
+        for timer in self._timers:
+            due, interval, callback = timer
+            if due <= now:
+                callback()
+                timer[0] = now + interval
+        if not self._timers:
+            return None
+        return max(min(timer[0] for timer in self._timers) - time.monotonic(), 0)
 
     def _start_workers(self):
-        ppid = os.getpid()
-        for i in range(self.num_workers - len(self._workers)):
-            worker_id = self._worker_ids.pop()
-            stop_event = multiprocessing.Event()
-            ack_event = multiprocessing.Event()
-            read_pipe, write_pipe = multiprocessing.Pipe(duplex=False)
-            args = (worker_id, ppid, self._db_dsn, self.scan_module_list,
-                    self.scan_module_options, self.max_tries, self.max_executions,
-                    write_pipe, stop_event, ack_event, self._raven_dsn)
-            process = WorkerProcess(target=_spawn_worker, args=args)
-            process.start()
-            worker_info = WorkerInfo(worker_id, process, read_pipe, stop_event, ack_event)
-            self._workers[worker_info.pid] = worker_info
-
-    def _process_queue(self):
-        while True:
-            pipes = [worker_info.read_pipe for worker_info in self._workers.values()
-                     if worker_info.process.is_alive()]
-            ready_pipes = wait(pipes, timeout=0.1)
-            if not ready_pipes:
+        for pool in self._pools:
+            num_pool_workers = sum(1 for worker_info in self._workers.values()
+                                   if worker_info.pool is pool)
+            for i in range(pool.num_target - num_pool_workers):
+                # Workers which are about to stop still count, so that the
+                # pools never run more than num_workers workers in total.
+                if len(self._workers) >= self.num_workers:
+                    return
+                self._start_worker(pool)
+
+    def _start_worker(self, pool):
+        worker_id = self._worker_ids.pop()
+        stop_event = multiprocessing.Event()
+        read_pipe, write_pipe = multiprocessing.Pipe(duplex=False)
+        ack_read_pipe, ack_pipe = multiprocessing.Pipe(duplex=False)
+        args = (worker_id, self._db_dsn, self.scan_module_list,
+                self.scan_module_options, self.max_tries, self.max_executions,
+                write_pipe, stop_event, ack_read_pipe, self._raven_dsn,
+                self._lease_keeper.lease_duration, pool.scan_modules, self.recycling)
+        process = WorkerProcess(target=_spawn_worker, args=args)
+        process.start()
+        # Only the worker writes events and reads acks. Closing our ends
+        # makes sure that we see an EOF once the worker is gone.
+        write_pipe.close()
+        ack_read_pipe.close()
+        worker_info = WorkerInfo(worker_id, process, read_pipe, stop_event, ack_pipe, pool)
+        self._workers[worker_info.pid] = worker_info
+        self._metric_worker_starts.inc(pool.name)
+
+    def _process_events(self):
+        timeout = self._run_timers()
+        wait_objects = {self._wakeup_fd: None}
+        for worker_info in self._workers.values():
+            if not worker_info.pipe_closed:
+                wait_objects[worker_info.read_pipe] = worker_info
+            wait_objects[worker_info.process.sentinel] = worker_info
+        for ready in wait(list(wait_objects), timeout):
+            worker_info = wait_objects[ready]
+            if worker_info is None:
+                self._drain_wakeup_fd()
+            elif ready is worker_info.read_pipe:
+                self._receive_events(worker_info)
+            else:
+                self._terminated_worker_pids.add(worker_info.pid)
+        for worker_info in self._workers.values():
+            worker_info.ack()
+        self._write_buffer.flush_if_due()
+        self._remove_workers()
+
+    def _receive_events(self, worker_info, max_events=_MAX_EVENTS_PER_WAKEUP):
+        # We do not read more than max_events at once, so that a chatty
+        # worker cannot starve the others.
+        read_pipe = worker_info.read_pipe
+        num_events = 0
+        while not worker_info.pipe_closed:
+            if max_events is not None and num_events >= max_events:
                 break
-            for read_pipe in ready_pipes:
-                try:
-                    event = read_pipe.recv()
-                except EOFError:
-                    continue
-                self._process_queue_event(event)
+            try:
+                if not read_pipe.poll():
+                    break
+                event = read_pipe.recv()
+            except (EOFError, OSError):
+                worker_info.pipe_closed = True
+                break
+            self._process_queue_event(event)
+            num_events += 1
+
+    def _drain_wakeup_fd(self):
+        with suppress(BlockingIOError):
+            while os.read(self._wakeup_fd, 512):
+                pass
 
     def _process_queue_event(self, event):
-        pid, action, args = event
+        pid, seq, action, args = event
         worker_info = self._workers[pid]
-        worker_info.ping()
-        if action == 'job_started':
-            scan_id, scan_module_name, time_started, num_tries = args
+        worker_info.ping(seq)
+        if action == 'worker_ready':
+            worker_info.notify_ready()
+            self._metric_worker_startup.observe(worker_info.startup_time, self.start_method)
+        elif action == 'job_started':
+            scan_id, scan_module_name, time_started, num_tries, queue_wait = args
             self._event_job_started(scan_id, scan_module_name, time_started)
+            self._metric_jobs_started.inc(scan_module_name)
+            if queue_wait is not None:
+                self._metric_queue_wait.observe(queue_wait, scan_module_name)
             worker_info.notify_job_started(scan_id, scan_module_name)
-        elif action == 'job_finished':
+        elif action in ('job_finished', 'job_rescheduled'):
+            time_finished, spans = args
             self._event_job_finished(
-                worker_info.scan_id, worker_info.scan_module, time_finished=args[0])
+                worker_info.scan_id, worker_info.scan_module, time_finished, spans)
+            if action == 'job_rescheduled':
+                self._metric_jobs_rescheduled.inc(worker_info.scan_module)
+            else:
+                self._metric_jobs_finished.inc(worker_info.scan_module)
+            self._observe_job_duration(worker_info)
             worker_info.notify_job_finished()
         elif action == 'job_failed':
-            self._event_job_failed(worker_info.scan_id, worker_info.scan_module)
+            time_finished, spans = args
+            self._event_job_failed(worker_info.scan_id, worker_info.scan_module, spans)
+            self._metric_jobs_failed.inc(worker_info.scan_module)
+            self._observe_job_duration(worker_info)
             worker_info.notify_job_failed()
         elif action == 'log':
             log_time, level, message = args
@@ -209,46 +423,114 @@ class WorkerMaster:
             pass
         elif action == 'add_debug_file':
             pass
-        worker_info.ack()
 
     def _event_job_started(self, scan_id, scan_module_name, time_started):
         params = (self.name, time_started, scan_id, scan_module_name)
-        self._execute_sql_autocommit(_JOB_STARTED_QUERY, params)
-
-    def _event_job_finished(self, scan_id, scan_module_name, time_finished):
-        params = (time_finished, scan_id, scan_module_name)
-        self._execute_sql_autocommit(_JOB_FINISHED_QUERY, params)
-
-    def _event_job_failed(self, scan_id, scan_module_name):
-        params = (scan_id, scan_module_name)
-        self._execute_sql_autocommit(_JOB_FAILED_QUERY, params)
+        self._write_buffer.add('job_started', params)
+
+    def _event_job_finished(self, scan_id, scan_module_name, time_finished, spans=None):
+        params = (time_finished, scan_id, scan_module_name, _adapt_spans(spans))
+        self._write_buffer.add('job_finished', params)
+
+    def _event_job_failed(self, scan_id, scan_module_name, spans=None):
+        params = (scan_id, scan_module_name, _adapt_spans(spans))
+        self._write_buffer.add('job_failed', params)
+
+    def _observe_job_duration(self, worker_info):
+        if worker_info.scan_module is not None:
+            self._metric_job_duration.observe(worker_info.get_execution_time(),
+                                              worker_info.scan_module)
+
+    def _update_metrics(self):
+        workers = {}
+        pipe_backlog = {}
+        for pool in self._pools:
+            for state in ('busy', 'idle', 'stopping'):
+                workers[(pool.name, state)] = 0
+            pipe_backlog[(pool.name,)] = 0
+        for worker_info in self._workers.values():
+            if worker_info.stopping:
+                state = 'stopping'
+            elif worker_info.scan_id is not None:
+                state = 'busy'
+            else:
+                state = 'idle'
+            workers[(worker_info.pool.name, state)] += 1
+            pipe_backlog[(worker_info.pool.name,)] += worker_info.get_pipe_backlog()
+        self._metric_workers.replace(workers)
+        self._metric_pipe_backlog.replace(pipe_backlog)
+        self._metric_write_buffer.replace(
+            ((key,), value) for key, value in self._write_buffer.get_metrics().items())
 
     def _event_job_log(self, scan_id, scan_module_name, log_time, level, message):
         log_time = datetime.fromtimestamp(log_time)
         params = (scan_id, scan_module_name, self.name, log_time, level, message)
-        self._execute_sql_autocommit(_LOG_QUERY, params)
-
-    def _execute_sql_autocommit(self, query, params):
-        while True:
-            try:
-                self._connect()
-                with self._conn.cursor() as c:
-                    c.execute(query, params)
-                self._conn.commit()
-                break
-            except psycopg2.OperationalError:
-                print('Database operational error. Retrying after 10 seconds.')
-                time.sleep(10)
+        self._write_buffer.add('log', params)
+
+    def _autoscale(self):
+        running_workers = [worker_info for worker_info in self._workers.values()
+                           if not worker_info.stopping]
+        num_busy = sum(1 for worker_info in running_workers if worker_info.scan_id is not None)
+        num_workers = self._autoscaler.get_num_workers(
+            self.num_workers, [worker_info.pid for worker_info in running_workers], num_busy)
+        if num_workers != self.num_workers:
+            sample = self._autoscaler.last_sample
+            print('Changing number of workers from {} to {} (load={:.2f} available={}MiB '
+                  'worker_rss={}MiB)'.format(self.num_workers, num_workers, sample['load'],
+                                             sample['available'] // 2**20,
+                                             sample['worker_rss'] // 2**20))
+        self.num_workers = num_workers
+        self._rebalance_pools()
+
+    def _rebalance_pools(self):
+        """Divide the workers between the pools and stop surplus workers.
+
+        Pools get workers in proportion to their weights. Pools which have
+        idle workers only keep one of them, so that pools with more work
+        than workers can use the rest.
+        """
+        limits = {}
+        if len(self._pools) > 1:
+            for pool in self._pools:
+                pool_workers = self._get_running_workers(pool)
+                num_idle = sum(1 for worker_info in pool_workers
+                               if worker_info.get_idle_time() > _POOL_IDLE_TIME)
+                if num_idle:
+                    limits[pool.name] = len(pool_workers) - num_idle + 1
+        allocation = allocate_workers(self.num_workers, self._pools, limits)
+        for pool in self._pools:
+            pool.num_target = allocation[pool.name]
+            # Stop idle workers first. Busy workers finish their current job.
+            pool_workers = self._get_running_workers(pool)
+            num_surplus = len(pool_workers) - pool.num_target
+            if num_surplus > 0:
+                pool_workers.sort(key=lambda worker_info: worker_info.scan_id is not None)
+                for worker_info in pool_workers[:num_surplus]:
+                    worker_info.stop()
+
+    def _get_running_workers(self, pool):
+        return [worker_info for worker_info in self._workers.values()
+                if worker_info.pool is pool and not worker_info.stopping]
+
+    def _extend_leases(self):
+        self._lease_keeper.extend(list(self._workers))
 
     def _check_hanging(self):
         for worker_info in self._workers.values():
+            # Idle workers cannot hang.
+            if worker_info.scan_id is None:
+                continue
             max_execution_time = self.max_execution_times.get(
                 worker_info.scan_module, self.max_execution_time)
             if max_execution_time is None:
                 continue
             if worker_info.get_execution_time() > max_execution_time:
+                scan_id, scan_module = worker_info.scan_id, worker_info.scan_module
+                self._metric_hang_kills.inc(scan_module)
+                self._metric_jobs_failed.inc(scan_module)
+                self._observe_job_duration(worker_info)
                 worker_info.notify_job_failed()
-                self._event_job_failed(worker_info.scan_id, worker_info.scan_module)
+                self._event_job_failed(scan_id, scan_module)
                 kill_everything(worker_info.pid)
                 self._terminated_worker_pids.add(worker_info.pid)
 
@@ -257,7 +539,16 @@ class WorkerMaster:
             if not worker_info.process.is_alive():
                 self._terminated_worker_pids.add(worker_info.pid)
         for pid in self._terminated_worker_pids:
-            self._worker_ids.add(self._workers[pid].id)
+            worker_info = self._workers[pid]
+            # Read what is left in the pipe of the worker, so that we do
+            # not lose its last events.
+            self._receive_events(worker_info, max_events=None)
+            worker_info.read_pipe.close()
+            worker_info.ack_pipe.close()
+            # A killed or crashed worker could not give back its jobs.
+            self._lease_keeper.release_worker(pid)
+            self._metric_worker_exits.inc(worker_info.pool.name)
+            self._worker_ids.add(worker_info.id)
             del self._workers[pid]
         self._terminated_worker_pids.clear()
 
@@ -268,37 +559,117 @@ class WorkerMaster:
     def _handle_signal_usr1(self, signum, frame):
         assert signum == signal.SIGUSR1
         print('Running workers: {}'.format(self._get_running_workers_str()))
+        print('Worker pools: {}'.format(' '.join(str(pool) for pool in self._pools)))
+        print('Write buffer: {}'.format(' '.join(
+            '{}={}'.format(key, value)
+            for key, value in self._write_buffer.get_metrics().items())))
+        print('Worker startup times ({}): {}'.format(self.start_method, ' '.join(
+            '{:.2f}s'.format(worker_info.startup_time) for worker_info in self._workers.values()
+            if worker_info.startup_time is not None)))
+
+    def _print_running_workers(self):
+        workers_str = self._get_running_workers_str()
+        print('{} workers still alive: {}'.format(len(self._workers), workers_str))
 
     def _get_running_workers_str(self):
         return ' '.join(str(worker_info) for worker_info in self._workers.values())
 
 
+def _adapt_spans(spans):
+    # Jobs killed by us did not send their spans, so we store NULL.
+    return Json(spans) if spans is not None else None
+
+
 def _spawn_worker(*args, **kwargs):
     w = Worker(*args, **kwargs)
     w.run()
 
 
+class MasterConnection:
+    """Sends events to the master without waiting for each of them.
+
+    Every event carries a sequence number. The master acknowledges the
+    highest sequence number it has processed, usually for several events
+    at once. We only wait for acks if the master falls too far behind or
+    when we want to make sure that it has seen all of our events.
+    """
+    def __init__(self, pid, ppid, write_pipe, ack_pipe, max_unacked=_MAX_UNACKED_EVENTS):
+        self._pid = pid
+        self._ppid = ppid
+        self._write_pipe = write_pipe
+        self._ack_pipe = ack_pipe
+        self._max_unacked = max_unacked
+        self._seq = 0
+        self._acked_seq = 0
+        # Log messages might be sent from other threads, e.g. callbacks
+        # of the Chrome devtools protocol.
+        self._lock = threading.Lock()
+
+    def send(self, action, args):
+        with self._lock:
+            self._seq += 1
+            self._write_pipe.send((self._pid, self._seq, action, args))
+            self._receive_acks(timeout=0)
+            while self._seq - self._acked_seq > self._max_unacked:
+                if not self._receive_acks(timeout=1) and not self._is_master_alive():
+                    break
+
+    def flush(self, timeout=10):
+        """Wait until the master has processed all events we have sent."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._acked_seq < self._seq and self._is_master_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._receive_acks(timeout=min(remaining, 1))
+
+    def _receive_acks(self, timeout):
+        received = False
+        try:
+            while self._ack_pipe.poll(timeout):
+                self._acked_seq = max(self._acked_seq, self._ack_pipe.recv())
+                received = True
+                timeout = 0
+        except (EOFError, OSError):
+            pass
+        return received
+
+    def _is_master_alive(self):
+        return self._ppid == os.getppid()
+
+
 class Worker:
-    def __init__(self, worker_id, ppid, db_dsn, scan_module_list, scan_module_options,
-                 max_tries, max_executions, write_pipe, stop_event, ack_event,
-                 raven_dsn):
+    def __init__(self, worker_id, db_dsn, scan_module_list, scan_module_options,
+                 max_tries, max_executions, write_pipe, stop_event, ack_pipe,
+                 raven_dsn, lease_duration=DEFAULT_LEASE_DURATION, scan_module_names=None,
+                 recycling=None):
         self._id = worker_id
         self._pid = os.getpid()
-        self._ppid = ppid
+        # This is the master, or the forkserver, which exits with the master.
+        self._ppid = os.getppid()
         self._max_executions = max_executions
-        self._write_pipe = write_pipe
+        self._recycling = RecyclingPolicy(**(recycling or {}))
+        self._master = MasterConnection(self._pid, self._ppid, write_pipe, ack_pipe)
         self._stop_event = stop_event
-        self._ack_event = ack_event
         self._old_sigterm = signal.SIG_DFL
         self._old_sigint = signal.SIG_DFL
         self._raven_client = None
         if has_raven and raven_dsn:
             self._raven_client = raven.Client(raven_dsn)
-        scan_modules = load_modules(scan_module_list, scan_module_options)
-        self._job_queue = JobQueue(db_dsn, scan_modules, max_tries)
+        self._scan_modules = get_scan_modules(scan_module_list, scan_module_options)
+        # Workers of a pool only fetch jobs of the scan modules of the pool.
+        queue_modules = self._scan_modules
+        if scan_module_names is not None:
+            queue_modules = {name: scan_module for name, scan_module in self._scan_modules.items()
+                             if name in scan_module_names}
+        self._job_queue = JobQueue(db_dsn, queue_modules, max_tries,
+                                   lease_worker=self._pid, lease_duration=lease_duration)
 
     def run(self):
-        while self._max_executions > 0:
+        self._notify_master('worker_ready', ())
+        idle_wait = _MIN_IDLE_WAIT
+        while self._max_executions is None or self._max_executions > 0:
             # Stop if our master died.
             if self._ppid != os.getppid():
                 break
@@ -306,17 +677,27 @@ class Worker:
             # Our master asked us to stop. We must obey.
             if self._stop_event.is_set():
                 break
+            spans = self._job_queue.spans = Spans()
             job = self._job_queue.get_job_nowait()
             if job is None:
-                time.sleep(1)
+                if self._job_queue.wait_for_job(idle_wait):
+                    idle_wait = _MIN_IDLE_WAIT
+                else:
+                    idle_wait = min(2 * idle_wait, _MAX_IDLE_WAIT)
                 continue
-            start_info = (job.scan_id, job.scan_module.name, datetime.today(), job.num_tries)
+            idle_wait = _MIN_IDLE_WAIT
+            queue_wait = None
+            if job.scan_created is not None:
+                queue_wait = (datetime.now(timezone.utc) - job.scan_created).total_seconds()
+            start_info = (job.scan_id, job.scan_module.name, datetime.today(), job.num_tries,
+                          queue_wait)
             self._notify_master('job_started', start_info)
             result = Result(job.current_result, NoOpFileHandler())
             logger = logging.Logger(job.scan_module.name)
-            logger.addHandler(WorkerWritePipeHandler(self._pid, self._write_pipe))
+            logger.addHandler(WorkerWritePipeHandler(self._master))
             logger.addHandler(ScanStreamHandler())
-            scan_meta = ScanMeta(worker_id=self._id, num_tries=job.num_tries)
+            scan_meta = ScanMeta(worker_id=self._id, num_tries=job.num_tries, spans=spans)
+            usage_before = self._recycling.measure()
             with tempfile.TemporaryDirectory() as temp_dir:
                 old_cwd = os.getcwd()
                 os.chdir(temp_dir)
@@ -325,33 +706,56 @@ class Worker:
                     job.scan_module.scan_site(result, scan_meta)
                 except RetryScan:
                     self._job_queue.report_failure()
-                    self._notify_master('job_failed', (datetime.today(),))
+                    end_action = 'job_failed'
                 except RescheduleLater as e:
                     self._job_queue.reschedule(e.not_before)
-                    self._job_queue.report_result(result.get_updates())
-                    self._notify_master('job_finished', (datetime.today(),))
+                    if self._job_queue.report_result(result.get_updates()):
+                        end_action = 'job_rescheduled'
+                    else:
+                        end_action = 'job_failed'
                 except Exception:
                     logger.exception('Scan module `%s` failed.', job.scan_module.name)
                     self._job_queue.report_failure()
-                    self._notify_master('job_failed', (datetime.today(),))
+                    end_action = 'job_failed'
                     if self._raven_client:
                         self._raven_client.captureException(tags={
                             'scan_id': job.scan_id,
                             'scan_module_name': job.scan_module.name
                         }, extra={'result': result.get_results()})
                 else:
-                    self._job_queue.report_result(result.get_updates())
-                    self._notify_master('job_finished', (datetime.today(),))
+                    if self._job_queue.report_result(result.get_updates()):
+                        end_action = 'job_finished'
+                    else:
+                        end_action = 'job_failed'
                 finally:
                     os.chdir(old_cwd)
                     kill_everything(self._pid, only_children=True)
-            self._max_executions -= 1
+            # Log entries belong to the job only until the master knows that
+            # it has ended, so we log the resource usage first.
+            usage = self._recycling.measure()
+            logger.debug('Worker usage after job: rss=%dMiB (%+dMiB) fds=%d (%+d) '
+                         'threads=%d (%+d)', usage.rss // 2**20,
+                         (usage.rss - usage_before.rss) // 2**20, usage.num_fds,
+                         usage.num_fds - usage_before.num_fds, usage.num_threads,
+                         usage.num_threads - usage_before.num_threads)
+            self._notify_master(end_action, (datetime.today(), spans.to_dict()))
+            if self._max_executions is not None:
+                self._max_executions -= 1
+            recycle_reason = self._recycling.get_recycle_reason(usage)
+            if recycle_reason:
+                print('Replacing worker {} (pid={}): {}'.format(self._id, self._pid,
+                                                                recycle_reason))
+                break
+        # Jobs we claimed in advance but did not start belong to the
+        # queue again, so that other workers can pick them up.
+        self._job_queue.release()
+        for scan_module in self._scan_modules.values():
+            scan_module.close()
+        self._master.flush()
         kill_everything(self._pid)
 
     def _notify_master(self, action, args):
-        self._write_pipe.send((self._pid, action, args))
-        self._ack_event.wait()
-        self._ack_event.clear()
+        self._master.send(action, args)
 
 
 class WorkerProcess(multiprocessing.Process):
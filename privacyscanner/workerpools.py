@@ -0,0 +1,61 @@
+class WorkerPool:
+    """A group of workers which only process jobs of some scan modules.
+
+    Pools allow to limit how many workers run, e.g., memory-hungry browser
+    based modules, without limiting the workers of other modules. If
+    scan_modules is None, the workers of the pool process all modules.
+    """
+    def __init__(self, name, scan_modules=None, max_workers=None, min_workers=1, weight=1):
+        self.name = name
+        if scan_modules is not None:
+            scan_modules = list(scan_modules)
+        self.scan_modules = scan_modules
+        self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.weight = weight
+        self.num_target = 0
+
+    def __str__(self):
+        return '{}={}'.format(self.name, self.num_target)
+
+
+def create_pools(worker_pools):
+    """Create the pools of the WORKER_POOLS setting.
+
+    Without pools, there is one pool for all scan modules.
+    """
+    if not worker_pools:
+        return [WorkerPool('default')]
+    return [WorkerPool(name, **options) for name, options in worker_pools.items()]
+
+
+def allocate_workers(num_workers, pools, limits=None):
+    """Distribute num_workers between the pools in proportion to their weights.
+
+    No pool gets more than its max_workers (or its entry in limits, if it
+    is lower) and, if possible, at least its min_workers. Workers that a
+    pool cannot use are distributed between the remaining pools. Returns
+    a dict which maps the pool names to their number of workers.
+    """
+    if limits is None:
+        limits = {}
+    caps = {}
+    for pool in pools:
+        cap = num_workers if pool.max_workers is None else pool.max_workers
+        cap = min(cap, limits.get(pool.name, cap))
+        caps[pool.name] = max(cap, 0)
+    allocation = {}
+    remaining = num_workers
+    for pool in pools:
+        allocation[pool.name] = min(pool.min_workers, caps[pool.name], remaining)
+        remaining -= allocation[pool.name]
+    # Hand out the remaining workers one by one to the pool which is
+    # furthest below its weighted share.
+    while remaining > 0:
+        candidates = [pool for pool in pools if allocation[pool.name] < caps[pool.name]]
+        if not candidates:
+            break
+        pool = min(candidates, key=lambda p: ((allocation[p.name] + 1) / p.weight, p.name))
+        allocation[pool.name] += 1
+        remaining -= 1
+    return allocation
@@ -0,0 +1,233 @@
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+
+_JOB_STARTED_QUERY = """
+UPDATE scanner_scaninfo AS si
+SET scan_host = v.scan_host,
+    time_started = v.time_started
+FROM (VALUES %s) AS v(scan_host, time_started, scan_id, scan_module)
+WHERE si.scan_id = v.scan_id AND si.scan_module = v.scan_module
+"""
+
+_JOB_STARTED_TEMPLATE = '(%s, %s::timestamptz, %s::integer, %s)'
+
+_JOB_FINISHED_QUERY = """
+UPDATE scanner_scaninfo AS si
+SET time_finished = v.time_finished,
+    spans = v.spans
+FROM (VALUES %s) AS v(time_finished, scan_id, scan_module, spans)
+WHERE si.scan_id = v.scan_id AND si.scan_module = v.scan_module
+"""
+
+_JOB_FINISHED_TEMPLATE = '(%s::timestamptz, %s::integer, %s, %s::jsonb)'
+
+_JOB_FAILED_QUERY = """
+UPDATE scanner_scaninfo AS si
+SET scan_host = NULL,
+    time_started = NULL,
+    spans = v.spans
+FROM (VALUES %s) AS v(scan_id, scan_module, spans)
+WHERE si.scan_id = v.scan_id AND si.scan_module = v.scan_module
+"""
+
+_JOB_FAILED_TEMPLATE = '(%s::integer, %s, %s::jsonb)'
+
+_LOG_QUERY = """
+INSERT INTO scanner_logentry (scan_id, scan_module, scan_host, time_created, level, message)
+VALUES %s
+"""
+
+_CONNECT_TIMEOUT = 5
+
+# The database is unavailable, the entries are written again later.
+_OPERATIONAL_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+# The entries are rejected, e.g., because of a NUL byte in a log message.
+_ENTRY_ERRORS = (psycopg2.Error, ValueError)
+
+_STATEMENTS = {
+    'job_started': (_JOB_STARTED_QUERY, _JOB_STARTED_TEMPLATE),
+    'job_finished': (_JOB_FINISHED_QUERY, _JOB_FINISHED_TEMPLATE),
+    'job_failed': (_JOB_FAILED_QUERY, _JOB_FAILED_TEMPLATE),
+}
+
+# The position of (scan_id, scan_module) in the params of every kind.
+_JOB_KEYS = {
+    'job_started': slice(2, 4),
+    'job_finished': slice(1, 3),
+    'job_failed': slice(0, 2),
+}
+
+
+class WriteBehindBuffer:
+    """Collects the bookkeeping statements of the master and writes them in batches.
+
+    Updates of scanner_scaninfo are written in the order they were added,
+    but consecutive updates of the same kind are merged into one multi-row
+    statement. Log entries do not depend on the order of the updates and
+    are inserted all at once. A batch is written when flush_size entries
+    are waiting or flush_interval seconds have passed.
+
+    The buffer holds at most max_size entries. If the database is not
+    available for a long time, the oldest log entries (and only if there
+    are none, the oldest updates) are dropped. Failed writes are retried
+    after retry_interval seconds without blocking the caller. If the
+    database rejects a batch, its entries are written one by one and
+    those which are rejected again are dropped.
+
+    If given, on_flush is called with the duration of every successful
+    write in seconds.
+    """
+    def __init__(self, dsn, max_size=100000, flush_size=500, flush_interval=1,
+                 retry_interval=10, on_flush=None):
+        self._dsn = dsn
+        self._on_flush = on_flush
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self._updates = deque()
+        self._logs = deque()
+        self._conn = None
+        self._last_flush = time.monotonic()
+        self._retry_at = None
+        self.num_dropped = 0
+        self.num_flushes = 0
+        self.num_failed_flushes = 0
+        self.last_flush_latency = None
+        self.max_flush_latency = None
+        self._connect()
+
+    def __len__(self):
+        return len(self._updates) + len(self._logs)
+
+    def add(self, kind, params):
+        if kind == 'log':
+            self._logs.append(params)
+        else:
+            assert kind in _STATEMENTS
+            self._updates.append((kind, params))
+        while len(self) > self.max_size:
+            if self._logs:
+                self._logs.popleft()
+            else:
+                self._updates.popleft()
+            self.num_dropped += 1
+
+    def is_due(self):
+        if not len(self):
+            return False
+        now = time.monotonic()
+        if self._retry_at is not None:
+            return now >= self._retry_at
+        return len(self) >= self.flush_size or now - self._last_flush >= self.flush_interval
+
+    def flush_if_due(self):
+        if self.is_due():
+            self.flush()
+
+    def flush(self):
+        """Write all entries. Returns False if the database is not available."""
+        self._last_flush = time.monotonic()
+        if not len(self):
+            return True
+        updates = list(self._updates)
+        logs = list(self._logs)
+        start = time.monotonic()
+        try:
+            self._connect()
+            try:
+                self._write(updates, logs)
+            except _OPERATIONAL_ERRORS:
+                raise
+            except _ENTRY_ERRORS:
+                # A bad entry, e.g., a log message with a NUL byte, must
+                # neither stall the buffer nor take the others with it.
+                self._conn.rollback()
+                self._write_one_by_one(updates, logs)
+            self._conn.commit()
+        except _OPERATIONAL_ERRORS:
+            self.num_failed_flushes += 1
+            self._retry_at = time.monotonic() + self.retry_interval
+            if self._conn is not None and not self._conn.closed:
+                self._conn.close()
+            print('Database operational error. Retrying after {} seconds. {} entries '
+                  'waiting.'.format(self.retry_interval, len(self)))
+            return False
+        self._retry_at = None
+        self._updates.clear()
+        self._logs.clear()
+        latency = time.monotonic() - start
+        self.num_flushes += 1
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency or 0, latency)
+        if self._on_flush is not None:
+            self._on_flush(latency)
+        return True
+
+    def _write(self, updates, logs):
+        with self._conn.cursor() as c:
+            for kind, rows in _group_updates(updates):
+                query, template = _STATEMENTS[kind]
+                execute_values(c, query, rows, template=template, page_size=len(rows))
+            if logs:
+                execute_values(c, _LOG_QUERY, logs, page_size=1000)
+
+    def _write_one_by_one(self, updates, logs):
+        """Write every entry on its own and drop those which fail."""
+        entries = [(kind, _STATEMENTS[kind], params) for kind, params in updates]
+        entries += [('log', (_LOG_QUERY, None), params) for params in logs]
+        with self._conn.cursor() as c:
+            for kind, (query, template), params in entries:
+                c.execute('SAVEPOINT entry')
+                try:
+                    execute_values(c, query, [params], template=template)
+                except _OPERATIONAL_ERRORS:
+                    raise
+                except _ENTRY_ERRORS as e:
+                    c.execute('ROLLBACK TO SAVEPOINT entry')
+                    self.num_dropped += 1
+                    print('Dropped {} entry which cannot be written: {}'.format(kind, e))
+                else:
+                    c.execute('RELEASE SAVEPOINT entry')
+
+    def get_metrics(self):
+        return {
+            'depth': len(self),
+            'dropped': self.num_dropped,
+            'flushes': self.num_flushes,
+            'failed_flushes': self.num_failed_flushes,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency
+        }
+
+    def _connect(self):
+        if self._conn is None or self._conn.closed:
+            # Do not hang in connect() if the database is unreachable.
+            self._conn = psycopg2.connect(self._dsn, connect_timeout=_CONNECT_TIMEOUT)
+
+
+def _group_updates(updates):
+    """Group consecutive updates of the same kind into batches.
+
+    A batch is also split when the same job shows up twice, because one
+    UPDATE ... FROM only applies one of the rows for a target row.
+    """
+    batch_kind = None
+    batch_rows = []
+    batch_keys = set()
+    for kind, params in updates:
+        key = tuple(params[_JOB_KEYS[kind]])
+        if kind != batch_kind or key in batch_keys:
+            if batch_rows:
+                yield batch_kind, batch_rows
+            batch_kind = kind
+            batch_rows = []
+            batch_keys = set()
+        batch_rows.append(params)
+        batch_keys.add(key)
+    if batch_rows:
+        yield batch_kind, batch_rows
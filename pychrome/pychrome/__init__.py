@@ -3,8 +3,15 @@
 
 from __future__ import unicode_literals
 
+import sys
+
 from .browser import *
 from .tab import *
+from .recording import *
+from .session import *
 from .exceptions import *
 
+if sys.version_info >= (3, 5):
+    from .asynctab import *
+
 __version__ = '0.2.3'
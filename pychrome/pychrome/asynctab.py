@@ -0,0 +1,440 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import concurrent.futures
+import functools
+import hashlib
+import logging
+import os
+import struct
+import threading
+import warnings
+from urllib.parse import urlparse
+
+from . import jsonlib
+from .exceptions import *
+from .tab import GenericAttr, Tab
+
+
+__all__ = ["AsyncTab", "SyncTab"]
+
+
+logger = logging.getLogger(__name__)
+
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xa
+
+
+def _mask(data, mask_key):
+    # XOR on one large integer is much faster than byte by byte.
+    length = len(data)
+    mask = (mask_key * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(length, 'big')
+
+
+class _WebSocket(object):
+    """The client side of RFC 6455 on asyncio streams, as much as Chrome needs."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, url):
+        parsed_url = urlparse(url)
+        port = parsed_url.port or 80
+        reader, writer = await asyncio.open_connection(parsed_url.hostname, port)
+        path = parsed_url.path or "/"
+        if parsed_url.query:
+            path += "?" + parsed_url.query
+        key = base64.b64encode(os.urandom(16))
+        writer.write(("GET %s HTTP/1.1\r\n"
+                      "Host: %s:%d\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      "Sec-WebSocket-Key: %s\r\n"
+                      "Sec-WebSocket-Version: 13\r\n"
+                      "\r\n" % (path, parsed_url.hostname, port, key.decode())).encode())
+        try:
+            response = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            writer.close()
+            raise TabConnectionException("Invalid handshake response from %s" % url) from e
+
+        status_line, *header_lines = response.decode("latin-1").split("\r\n")
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest()).decode()
+        if status_line.split(" ")[1:2] != ["101"] or headers.get("sec-websocket-accept") != accept:
+            writer.close()
+            raise TabConnectionException("Could not connect to %s: %s" % (url, status_line))
+        return cls(reader, writer)
+
+    def send(self, data, opcode=OPCODE_TEXT):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        length = len(data)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+        mask_key = os.urandom(4)
+        self._writer.write(header + mask_key + _mask(data, mask_key))
+
+    async def recv(self):
+        """Return the next message or raise TabConnectionException if the connection is closed."""
+        fragments = []
+        try:
+            while True:
+                first, second = await self._reader.readexactly(2)
+                opcode = first & 0x0f
+                length = second & 0x7f
+                if length == 126:
+                    length, = struct.unpack("!H", await self._reader.readexactly(2))
+                elif length == 127:
+                    length, = struct.unpack("!Q", await self._reader.readexactly(8))
+                mask_key = await self._reader.readexactly(4) if second & 0x80 else None
+                payload = await self._reader.readexactly(length)
+                if mask_key is not None:
+                    payload = _mask(payload, mask_key)
+
+                if opcode == OPCODE_CLOSE:
+                    self.send(payload[:2], OPCODE_CLOSE)
+                    raise TabConnectionException("Connection closed by the browser")
+                elif opcode == OPCODE_PING:
+                    self.send(payload, OPCODE_PONG)
+                elif opcode != OPCODE_PONG:
+                    fragments.append(payload)
+                    if first & 0x80:
+                        return b"".join(fragments).decode("utf-8")
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            raise TabConnectionException("Connection lost") from e
+
+    def close(self):
+        if not self._writer.transport.is_closing():
+            try:
+                self.send(struct.pack("!H", 1000), OPCODE_CLOSE)
+            finally:
+                self._writer.close()
+
+
+class AsyncTab(object):
+    """A tab whose methods are coroutines, without any threads.
+
+    Every call waits for a future which the receiving task resolves when
+    the response with its id arrives. Events are handled one after
+    another by a separate task, so that handlers can call methods.
+    Handlers are coroutine functions or plain functions. Plain functions
+    run in the event loop, or in handler_executor if it is given.
+
+        tab = AsyncTab(**browser.new_tab()._kwargs)
+        await tab.start()
+        await tab.Page.navigate(url="https://example.com")
+    """
+    status_initial = Tab.status_initial
+    status_started = Tab.status_started
+    status_stopped = Tab.status_stopped
+    drop_unhandled_events = Tab.drop_unhandled_events
+
+    def __init__(self, handler_executor=None, **kwargs):
+        self.id = kwargs.get("id")
+        self.type = kwargs.get("type")
+        self.debug = os.getenv("DEBUG", False)
+
+        self._websocket_url = kwargs.get("webSocketDebuggerUrl")
+        self._kwargs = kwargs
+        self._handler_executor = handler_executor
+
+        self._cur_id = 1000
+
+        self._ws = None
+        self._recv_task = None
+        self._handle_event_task = None
+        # Created by start(), because they belong to the running loop.
+        self._stopped = None
+        self.event_queue = None
+
+        self._started = False
+        self.status = self.status_initial
+
+        self.event_handlers = {}
+        self.method_results = {}
+
+        # See recording.Recorder
+        self.recorder = None
+
+    async def _send(self, message, timeout=None):
+        self._cur_id += 1
+        message['id'] = self._cur_id
+        message_json = jsonlib.dumps(message)
+
+        if self.debug:  # pragma: no cover
+            print("SEND > %s" % message_json)
+
+        future = asyncio.get_event_loop().create_future()
+        self.method_results[message['id']] = (message['method'], future)
+        try:
+            self._ws.send(message_json)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutException("Calling %s timeout" % message['method'])
+        finally:
+            self.method_results.pop(message['id'], None)
+
+    async def _recv_loop(self):
+        while True:
+            try:
+                message_json = await self._ws.recv()
+            except TabConnectionException:
+                if not self._stopped.is_set():
+                    logger.error("websocket exception", exc_info=True)
+                    self._abort(TabConnectionException, "Connection lost")
+                    self._ws.close()
+                return
+
+            if self.debug:  # pragma: no cover
+                print('< RECV %s' % message_json)
+
+            if self.drop_unhandled_events:
+                method = jsonlib.peek_event_method(message_json)
+                if method is not None and not self._wants_event(method):
+                    continue
+            message = jsonlib.loads(message_json)
+
+            if "method" in message:
+                self.event_queue.put_nowait(message)
+
+            elif "id" in message:
+                if message["id"] in self.method_results:
+                    future = self.method_results[message["id"]][1]
+                    if not future.done():
+                        future.set_result(message)
+            else:  # pragma: no cover
+                warnings.warn("unknown message: %s" % message)
+
+    def _wants_event(self, method):
+        return method in self.event_handlers or self.recorder is not None
+
+    async def _handle_event_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            event = await self.event_queue.get()
+            if self.recorder is not None:
+                self.recorder.record_event(event['method'], event['params'])
+
+            handler = self.event_handlers.get(event['method'])
+            if handler is None:
+                continue
+            try:
+                if asyncio.iscoroutinefunction(handler):
+                    await handler(**event['params'])
+                elif self._handler_executor is not None:
+                    await loop.run_in_executor(
+                        self._handler_executor, functools.partial(handler, **event['params']))
+                else:
+                    handler(**event['params'])
+            except Exception:
+                logger.error("callback %s exception" % event['method'], exc_info=True)
+
+    def __getattr__(self, item):
+        attr = GenericAttr(item, self)
+        setattr(self, item, attr)
+        return attr
+
+    async def call_method(self, _method, *args, **kwargs):
+        if not self._started:
+            raise RuntimeException("Cannot call method before it is started")
+
+        if args:
+            raise CallMethodException("the params should be key=value format")
+
+        if self._stopped.is_set():
+            raise RuntimeException("Tab has been stopped")
+
+        timeout = kwargs.pop("_timeout", None)
+        result = await self._send({"method": _method, "params": kwargs}, timeout=timeout)
+        if self.recorder is not None:
+            self.recorder.record_method(_method, kwargs, result)
+        if 'result' not in result and 'error' in result:
+            warnings.warn("%s error: %s" % (_method, result['error']['message']))
+            raise CallMethodException("calling method: %s error: %s" % (_method, result['error']['message']))
+
+        return result['result']
+
+    async def call_methods(self, calls, timeout=None):
+        """Call several methods at once and return their results in order.
+
+        See Tab.call_methods().
+        """
+        async def call(method, params):
+            try:
+                return await self.call_method(method, _timeout=timeout, **params)
+            except (CallMethodException, TimeoutException) as e:
+                return e
+
+        return list(await asyncio.gather(*[call(method, params) for method, params in calls]))
+
+    def set_listener(self, event, callback):
+        if not callback:
+            return self.event_handlers.pop(event, None)
+
+        if not callable(callback):
+            raise RuntimeException("callback should be callable")
+
+        self.event_handlers[event] = callback
+        return True
+
+    def get_listener(self, event):
+        return self.event_handlers.get(event, None)
+
+    def del_all_listeners(self):
+        self.event_handlers.clear()
+        return True
+
+    async def start(self):
+        if self._started:
+            return False
+
+        if not self._websocket_url:
+            raise RuntimeException("Already has another client connect to this tab")
+
+        self._started = True
+        self.status = self.status_started
+        self._stopped = asyncio.Event()
+        self.event_queue = asyncio.Queue()
+        self._ws = await _WebSocket.connect(self._websocket_url)
+        self._recv_task = asyncio.ensure_future(self._recv_loop())
+        self._handle_event_task = asyncio.ensure_future(self._handle_event_loop())
+        return True
+
+    async def stop(self):
+        if self._stopped.is_set():
+            return False
+
+        if not self._started:
+            raise RuntimeException("Tab is not running")
+
+        self.status = self.status_stopped
+        self._abort()
+        self._ws.close()
+        return True
+
+    def _abort(self, exception_class=UserAbortException, reason="User abort, call stop()"):
+        self._stopped.set()
+        # The tasks are not awaited, because stop() may be called by an
+        # event handler, which the event task waits for.
+        self._recv_task.cancel()
+        self._handle_event_task.cancel()
+        for method, future in self.method_results.values():
+            if not future.done():
+                future.set_exception(exception_class("%s when calling %s" % (reason, method)))
+
+    async def wait(self, timeout=None):
+        if not self._started:
+            raise RuntimeException("Tab is not running")
+
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def __str__(self):
+        return "<AsyncTab [%s]>" % self.id
+
+    __repr__ = __str__
+
+
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    """Return the event loop of the SyncTabs, which runs in its own thread."""
+    global _loop, _loop_thread
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="pychrome-loop")
+            _loop_thread.daemon = True
+            _loop_thread.start()
+        return _loop
+
+
+class SyncTab(Tab):
+    """A Tab which uses an AsyncTab.
+
+    It has the same interface as Tab, but all SyncTabs share one thread
+    with an event loop instead of two threads for each tab. Event
+    handlers run in a thread of the tab, so that they can call methods.
+    """
+
+    def __init__(self, **kwargs):
+        self._async_tab = AsyncTab(
+            handler_executor=concurrent.futures.ThreadPoolExecutor(1), **kwargs)
+        super(SyncTab, self).__init__(**kwargs)
+        self._loop = _get_loop()
+        # Both tabs share the handlers, so that set_listener() of Tab works.
+        self._async_tab.event_handlers = self.event_handlers
+
+    @property
+    def recorder(self):
+        return self._async_tab.recorder
+
+    @recorder.setter
+    def recorder(self, recorder):
+        self._async_tab.recorder = recorder
+
+    def _run(self, coroutine):
+        if threading.current_thread() is _loop_thread:
+            coroutine.close()
+            raise RuntimeException("SyncTab cannot be used in its event loop, use AsyncTab")
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def call_method(self, _method, *args, **kwargs):
+        return self._run(self._async_tab.call_method(_method, *args, **kwargs))
+
+    def call_methods(self, calls, timeout=None):
+        return self._run(self._async_tab.call_methods(calls, timeout))
+
+    def del_all_listeners(self):
+        self.event_handlers.clear()
+        return True
+
+    def start(self):
+        started = self._run(self._async_tab.start())
+        if started:
+            self._started = True
+            self.status = self.status_started
+        return started
+
+    def stop(self):
+        stopped = self._run(self._async_tab.stop())
+        if stopped:
+            self.status = self.status_stopped
+            self._async_tab._handler_executor.shutdown(wait=False)
+        return stopped
+
+    def wait(self, timeout=None):
+        return self._run(self._async_tab.wait(timeout))
+
+    def __str__(self):
+        return "<SyncTab [%s]>" % self.id
+
+    __repr__ = __str__
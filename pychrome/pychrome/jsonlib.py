@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""The JSON library for the messages of the DevTools protocol.
+
+Decoding the events of a page is a considerable part of the work of
+pychrome, so orjson or ujson is used if it is installed. Set the
+environment variable PYCHROME_JSON to json, ujson or orjson to choose one.
+"""
+
+from __future__ import unicode_literals
+
+import json
+import os
+
+
+__all__ = ["use", "loads", "dumps", "peek_event_method"]
+
+
+name = None
+loads = json.loads
+dumps = json.dumps
+
+_EVENT_PREFIX = '{"method":"'
+
+
+def use(library):
+    """Use library (json, ujson or orjson) for all tabs."""
+    global name, loads, dumps
+
+    if library == "orjson":
+        import orjson
+
+        loads = orjson.loads
+        dumps = lambda obj: orjson.dumps(obj).decode("utf-8")
+    elif library == "ujson":
+        import ujson
+
+        loads = ujson.loads
+        dumps = ujson.dumps
+    elif library == "json":
+        loads = json.loads
+        dumps = json.dumps
+    else:
+        raise ValueError("Unknown JSON library: %s" % library)
+    name = library
+
+
+def peek_event_method(message_json):
+    """Return the method of an event without decoding it.
+
+    Chrome sends the method of an event first. None is returned for
+    responses and for messages in another format.
+    """
+    if not message_json.startswith(_EVENT_PREFIX):
+        return None
+    end = message_json.find('"', len(_EVENT_PREFIX))
+    if end == -1:
+        return None
+    return message_json[len(_EVENT_PREFIX):end]
+
+
+def _use_default():
+    library = os.getenv("PYCHROME_JSON")
+    if library:
+        use(library)
+        return
+
+    for library in ("orjson", "ujson"):
+        try:
+            use(library)
+            return
+        except ImportError:
+            continue
+    use("json")
+
+
+_use_default()
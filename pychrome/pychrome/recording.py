@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import collections
+import gzip
+import io
+import json
+import logging
+import threading
+
+from .exceptions import *
+from .tab import Tab
+
+
+__all__ = ["Recorder", "ReplayTab", "ReplayBrowser"]
+
+
+logger = logging.getLogger(__name__)
+
+
+def _params_key(method, params):
+    return method, json.dumps(params, sort_keys=True)
+
+
+class Recorder(object):
+    """Records the events and method responses of a tab to a gzipped JSON lines file.
+
+    Set it as ``tab.recorder`` before the tab is started. Every event is
+    recorded, so that listeners which were not set during the recording
+    can be replayed, too.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = io.TextIOWrapper(gzip.open(path, 'wb'), encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record_method(self, method, params, response):
+        response = dict(response)
+        response.pop('id', None)
+        self._write(['method', method, params, response])
+
+    def record_event(self, method, params):
+        self._write(['event', method, params])
+
+    def annotate(self, key, value):
+        """Store additional data to replay the recording, e.g., the state before it."""
+        self._write(['annotation', key, value])
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+
+class ReplayTab(Tab):
+    """A tab which answers method calls with the responses of a recording.
+
+    Responses are looked up by method and parameters in the order in
+    which they were recorded. If the parameters differ, e.g., because they
+    are random, the responses of the method are used in their order. The
+    last response of a lookup is repeated if the method is called more
+    often than during the recording. Recorded events are delivered to the
+    listeners by replay_events().
+    """
+
+    def __init__(self, path, **kwargs):
+        kwargs.setdefault("id", "replay")
+        kwargs.setdefault("type", "page")
+        super(ReplayTab, self).__init__(**kwargs)
+        self.annotations = {}
+        self._events = []
+        self._responses = collections.defaultdict(collections.deque)
+        self._method_responses = collections.defaultdict(collections.deque)
+        with io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record[0] == 'event':
+                    self._events.append((record[1], record[2]))
+                elif record[0] == 'method':
+                    method, params, response = record[1:]
+                    self._responses[_params_key(method, params)].append(response)
+                    self._method_responses[method].append(response)
+                elif record[0] == 'annotation':
+                    self.annotations[record[1]] = record[2]
+
+    def replay_events(self):
+        """Deliver the recorded events to the current listeners in their order."""
+        for method, params in self._events:
+            handler = self.event_handlers.get(method)
+            if handler is None:
+                continue
+            try:
+                handler(**params)
+            except Exception:
+                logger.error("callback %s exception" % method, exc_info=True)
+
+    def call_method(self, _method, *args, **kwargs):
+        if not self._started:
+            raise RuntimeException("Cannot call method before it is started")
+
+        if args:
+            raise CallMethodException("the params should be key=value format")
+
+        kwargs.pop("_timeout", None)
+        response = self._pop_response(self._responses.get(_params_key(_method, kwargs)))
+        if response is None:
+            response = self._pop_response(self._method_responses.get(_method))
+        if response is None:
+            raise CallMethodException("calling method: %s error: not recorded" % _method)
+        if 'result' not in response and 'error' in response:
+            raise CallMethodException("calling method: %s error: %s" % (_method, response['error']['message']))
+
+        return response['result']
+
+    def call_methods(self, calls, timeout=None):
+        results = []
+        for method, params in calls:
+            try:
+                results.append(self.call_method(method, **params))
+            except CallMethodException as e:
+                results.append(e)
+        return results
+
+    @staticmethod
+    def _pop_response(responses):
+        if not responses:
+            return None
+        if len(responses) > 1:
+            return responses.popleft()
+        return responses[0]
+
+    def start(self):
+        if self._started:
+            return False
+
+        self._started = True
+        self.status = self.status_started
+        self._stopped.clear()
+        return True
+
+    def stop(self):
+        if self._stopped.is_set():
+            return False
+
+        if not self._started:
+            raise RuntimeException("Tab is not running")
+
+        self.status = self.status_stopped
+        self._stopped.set()
+        return True
+
+    def wait(self, timeout=None):
+        # Nothing happens in a recording while we wait.
+        if not self._started:
+            raise RuntimeException("Tab is not running")
+
+        return self._stopped.is_set()
+
+
+class ReplayBrowser(object):
+    """A browser whose only tab is a ReplayTab."""
+
+    def __init__(self, tab):
+        self.tab = tab
+
+    def new_tab(self, url=None, timeout=None):
+        return self.tab
+
+    def list_tab(self, timeout=None):
+        return [self.tab]
+
+    def close_tab(self, tab_id, timeout=None):
+        if self.tab.status == Tab.status_started:
+            self.tab.stop()
+
+    def version(self, timeout=None):
+        return {}
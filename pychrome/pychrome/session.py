@@ -0,0 +1,277 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import itertools
+import logging
+import threading
+
+import requests
+
+from .exceptions import *
+from .tab import Tab
+
+
+__all__ = ["BrowserTab", "SessionTab", "FlatBrowser"]
+
+
+logger = logging.getLogger(__name__)
+
+# Detaching must not block stop() if the browser does not answer anymore.
+DETACH_TIMEOUT = 5
+
+
+class BrowserTab(Tab):
+    """The connection to the browser target, which carries the sessions of other targets.
+
+    Targets are attached with Target.attachToTarget(flatten=True), so the
+    messages of all their sessions are multiplexed over the websocket of
+    this tab. Sessions which the browser attaches by itself, e.g., the
+    out-of-process iframes and workers of a page with Target.setAutoAttach,
+    are available from get_session() as soon as Target.attachedToTarget
+    has been received.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("id", "browser")
+        kwargs.setdefault("type", "browser")
+        super(BrowserTab, self).__init__(**kwargs)
+        self.sessions = {}
+        self._attaching = {}
+        # All sessions share the ids of this websocket.
+        self._ids = itertools.count(self._cur_id + 1)
+
+    def _next_id(self):
+        return next(self._ids)
+
+    def _prepare_message(self, message):
+        message['id'] = self._next_id()
+
+    def _recv_loop(self):
+        try:
+            super(BrowserTab, self)._recv_loop()
+        finally:
+            for session in list(self.sessions.values()):
+                session._detached()
+            self.sessions.clear()
+
+    def _wants_event(self, method):
+        # The session of an event is not known before it is decoded.
+        if method.startswith("Target.") or super(BrowserTab, self)._wants_event(method):
+            return True
+        return any(session._wants_event(method) for session in list(self.sessions.values()))
+
+    def _handle_message(self, message):
+        method = message.get("method")
+        session_id = message.get("sessionId")
+        # The session has to exist before the response of attachToTarget
+        # and before the first event of the session are handled.
+        if method == "Target.attachedToTarget":
+            self._attached(message["params"], session_id)
+        elif method == "Target.detachedFromTarget":
+            session = self.sessions.pop(message["params"]["sessionId"], None)
+            if session is not None:
+                session._detached()
+
+        if session_id is None:
+            super(BrowserTab, self)._handle_message(message)
+            return
+
+        session = self.sessions.get(session_id)
+        if session is None:
+            logger.debug("message of unknown session %s: %s", session_id, message)
+            return
+        session._handle_message(message)
+
+    def _attached(self, params, parent_session_id):
+        target_info = params["targetInfo"]
+        session = self._attaching.pop(target_info["targetId"], None)
+        if session is None:
+            session = SessionTab(self, id=target_info["targetId"], type=target_info["type"])
+        session.session_id = params["sessionId"]
+        session.parent_session_id = parent_session_id
+        session.target_info = target_info
+        self.sessions[session.session_id] = session
+
+    def attach(self, session, timeout=None):
+        """Attach a SessionTab to its target and return the id of the session."""
+        self._attaching[session.id] = session
+        try:
+            result = self.Target.attachToTarget(targetId=session.id, flatten=True, _timeout=timeout)
+        finally:
+            self._attaching.pop(session.id, None)
+        session.session_id = result["sessionId"]
+        self.sessions.setdefault(session.session_id, session)
+        return session.session_id
+
+    def detach(self, session):
+        self.sessions.pop(session.session_id, None)
+        if self.status != self.status_started or self._stopped.is_set():
+            return
+        try:
+            self.Target.detachFromTarget(sessionId=session.session_id, _timeout=DETACH_TIMEOUT)
+        except PyChromeException:
+            # The target is gone already.
+            pass
+
+    def get_session(self, session_id):
+        return self.sessions.get(session_id)
+
+    def __str__(self):
+        return "<BrowserTab [%s]>" % self.id
+
+    __repr__ = __str__
+
+
+class SessionTab(Tab):
+    """A Tab which is driven by a session on the websocket of a BrowserTab.
+
+    It opens no connection of its own. start() attaches to the target,
+    unless the browser has attached it already, and stop() detaches.
+    """
+
+    def __init__(self, browser_tab, session_id=None, **kwargs):
+        super(SessionTab, self).__init__(**kwargs)
+        self.browser_tab = browser_tab
+        self.session_id = session_id
+        self.parent_session_id = None
+        self.target_info = None
+
+    def _prepare_message(self, message):
+        message['id'] = self.browser_tab._next_id()
+        message['sessionId'] = self.session_id
+
+    def _detached(self):
+        self.status = self.status_stopped
+        self._stopped.set()
+
+    def get_child_sessions(self):
+        """Return the sessions which the browser attached from this one, e.g., iframes."""
+        return [session for session in list(self.browser_tab.sessions.values())
+                if session.parent_session_id == self.session_id]
+
+    def start(self):
+        if self._started:
+            return False
+
+        if self.session_id is None:
+            self.browser_tab.attach(self)
+
+        self._started = True
+        self.status = self.status_started
+        self._stopped.clear()
+        self._ws = self.browser_tab._ws
+        self._handle_event_th.start()
+        return True
+
+    def stop(self):
+        if self._stopped.is_set():
+            return False
+
+        if not self._started:
+            raise RuntimeException("Tab is not running")
+
+        self.status = self.status_stopped
+        self._stopped.set()
+        self.browser_tab.detach(self)
+        return True
+
+    def wait(self, timeout=None):
+        if not self._started:
+            raise RuntimeException("Tab is not running")
+
+        if timeout:
+            return self._stopped.wait(timeout)
+
+        self._handle_event_th.join()
+        return True
+
+    def __str__(self):
+        return "<SessionTab [%s]>" % self.id
+
+    __repr__ = __str__
+
+
+class FlatBrowser(object):
+    """Like Browser, but it manages the tabs with the Target domain on one websocket.
+
+    Its tabs are SessionTabs of the same BrowserTab, which is connected on
+    first use. Only the websocket address of the browser is fetched with
+    HTTP, unless it is given as websocket_url. version() returns the
+    result of Browser.getVersion.
+    """
+
+    def __init__(self, url="http://127.0.0.1:9222", websocket_url=None):
+        self.dev_url = url
+        self._websocket_url = websocket_url
+        self._browser_tab = None
+        self._tabs = {}
+        self._lock = threading.Lock()
+
+    @property
+    def browser_tab(self):
+        with self._lock:
+            if self._browser_tab is None or self._browser_tab.status == Tab.status_stopped:
+                websocket_url = self._websocket_url
+                if websocket_url is None:
+                    rp = requests.get("%s/json/version" % self.dev_url, json=True)
+                    websocket_url = rp.json()['webSocketDebuggerUrl']
+                browser_tab = BrowserTab(webSocketDebuggerUrl=websocket_url)
+                browser_tab.start()
+                self._browser_tab = browser_tab
+                self._tabs = {}
+            return self._browser_tab
+
+    def new_tab(self, url=None, timeout=None):
+        browser_tab = self.browser_tab
+        target = browser_tab.Target.createTarget(url=url or 'about:blank', _timeout=timeout)
+        tab = SessionTab(browser_tab, id=target['targetId'], type='page')
+        self._tabs[tab.id] = tab
+        return tab
+
+    def list_tab(self, timeout=None):
+        browser_tab = self.browser_tab
+        tabs_map = {}
+        for target_info in browser_tab.Target.getTargets(_timeout=timeout)['targetInfos']:
+            if target_info['type'] != 'page':
+                continue
+
+            tab = self._tabs.get(target_info['targetId'])
+            if tab is None or tab.status == Tab.status_stopped:
+                tab = SessionTab(browser_tab, id=target_info['targetId'], type='page')
+            tabs_map[tab.id] = tab
+
+        self._tabs = tabs_map
+        return list(self._tabs.values())
+
+    def activate_tab(self, tab_id, timeout=None):
+        if isinstance(tab_id, Tab):
+            tab_id = tab_id.id
+
+        return self.browser_tab.Target.activateTarget(targetId=tab_id, _timeout=timeout)
+
+    def close_tab(self, tab_id, timeout=None):
+        if isinstance(tab_id, Tab):
+            tab_id = tab_id.id
+
+        tab = self._tabs.pop(tab_id, None)
+        if tab and tab.status == Tab.status_started:
+            tab.stop()
+
+        return self.browser_tab.Target.closeTarget(targetId=tab_id, _timeout=timeout)
+
+    def version(self, timeout=None):
+        return self.browser_tab.Browser.getVersion(_timeout=timeout)
+
+    def close(self):
+        """Close the websocket of the browser and thereby all its sessions."""
+        with self._lock:
+            if self._browser_tab is not None and self._browser_tab.status == Tab.status_started:
+                self._browser_tab.stop()
+            self._browser_tab = None
+
+    def __str__(self):
+        return '<FlatBrowser %s>' % self.dev_url
+
+    __repr__ = __str__
@@ -4,7 +4,7 @@
 from __future__ import unicode_literals
 
 import os
-import json
+import time
 import logging
 import warnings
 import threading
@@ -12,6 +12,7 @@ import functools
 
 import websocket
 
+from . import jsonlib
 from .exceptions import *
 
 try:
@@ -49,6 +50,10 @@ class Tab(object):
     status_started = 'started'
     status_stopped = 'stopped'
 
+    # Events without a listener are dropped before they are decoded,
+    # unless the tab is recorded. Set it to False to queue all events.
+    drop_unhandled_events = True
+
     def __init__(self, **kwargs):
         self.id = kwargs.get("id")
         self.type = kwargs.get("type")
@@ -74,12 +79,18 @@ class Tab(object):
         self.method_results = {}
         self.event_queue = queue.Queue()
 
-    def _send(self, message, timeout=None):
+        # See recording.Recorder
+        self.recorder = None
+
+    def _prepare_message(self, message):
         if 'id' not in message:
             self._cur_id += 1
             message['id'] = self._cur_id
 
-        message_json = json.dumps(message)
+    def _send(self, message, timeout=None):
+        self._prepare_message(message)
+
+        message_json = jsonlib.dumps(message)
 
         if self.debug:  # pragma: no cover
             print("SEND > %s" % message_json)
@@ -114,12 +125,52 @@ class Tab(object):
         finally:
             self.method_results.pop(message['id'], None)
 
+    def _send_many(self, messages, timeout=None):
+        """Send all messages before waiting for the first response.
+
+        Returns the responses in the order of messages. The response of a
+        message is None if it did not arrive within timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        responses = []
+        try:
+            for message in messages:
+                self._prepare_message(message)
+                self.method_results[message['id']] = queue.Queue()
+
+            for message in messages:
+                message_json = jsonlib.dumps(message)
+
+                if self.debug:  # pragma: no cover
+                    print("SEND > %s" % message_json)
+
+                self._ws.send(message_json)
+
+            for message in messages:
+                responses.append(self._wait_response(message, deadline))
+            return responses
+        finally:
+            for message in messages:
+                self.method_results.pop(message.get('id'), None)
+
+    def _wait_response(self, message, deadline):
+        while not self._stopped.is_set():
+            q_timeout = 1
+            if deadline is not None:
+                q_timeout = min(q_timeout, max(deadline - time.time(), 0))
+            try:
+                return self.method_results[message['id']].get(timeout=q_timeout)
+            except queue.Empty:
+                if deadline is not None and time.time() >= deadline:
+                    return None
+
+        raise UserAbortException("User abort, call stop() when calling %s" % message['method'])
+
     def _recv_loop(self):
         while not self._stopped.is_set():
             try:
                 self._ws.settimeout(1)
                 message_json = self._ws.recv()
-                message = json.loads(message_json)
             except websocket.WebSocketTimeoutException:
                 continue
             except (websocket.WebSocketException, OSError):
@@ -131,14 +182,25 @@ class Tab(object):
             if self.debug:  # pragma: no cover
                 print('< RECV %s' % message_json)
 
-            if "method" in message:
-                self.event_queue.put(message)
+            if self.drop_unhandled_events:
+                method = jsonlib.peek_event_method(message_json)
+                if method is not None and not self._wants_event(method):
+                    continue
+
+            self._handle_message(jsonlib.loads(message_json))
+
+    def _wants_event(self, method):
+        return method in self.event_handlers or self.recorder is not None
 
-            elif "id" in message:
-                if message["id"] in self.method_results:
-                    self.method_results[message['id']].put(message)
-            else:  # pragma: no cover
-                warnings.warn("unknown message: %s" % message)
+    def _handle_message(self, message):
+        if "method" in message:
+            self.event_queue.put(message)
+
+        elif "id" in message:
+            if message["id"] in self.method_results:
+                self.method_results[message['id']].put(message)
+        else:  # pragma: no cover
+            warnings.warn("unknown message: %s" % message)
 
     def _handle_event_loop(self):
         while not self._stopped.is_set():
@@ -147,6 +209,9 @@ class Tab(object):
             except queue.Empty:
                 continue
 
+            if self.recorder is not None:
+                self.recorder.record_event(event['method'], event['params'])
+
             if event['method'] in self.event_handlers:
                 try:
                     self.event_handlers[event['method']](**event['params'])
@@ -172,12 +237,48 @@ class Tab(object):
 
         timeout = kwargs.pop("_timeout", None)
         result = self._send({"method": _method, "params": kwargs}, timeout=timeout)
+        if self.recorder is not None:
+            self.recorder.record_method(_method, kwargs, result)
         if 'result' not in result and 'error' in result:
             warnings.warn("%s error: %s" % (_method, result['error']['message']))
             raise CallMethodException("calling method: %s error: %s" % (_method, result['error']['message']))
 
         return result['result']
 
+    def call_methods(self, calls, timeout=None):
+        """Call several methods at once and return their results in order.
+
+        calls is a list of (method, params) pairs. The calls are sent back
+        to back, so they must not depend on each other. A call that fails
+        or does not finish within timeout gets its CallMethodException or
+        TimeoutException in place of its result instead of raising it.
+
+            results = tab.call_methods([("DOM.resolveNode", {"nodeId": node_id})
+                                        for node_id in node_ids])
+        """
+        if not self._started:
+            raise RuntimeException("Cannot call method before it is started")
+
+        if self._stopped.is_set():
+            raise RuntimeException("Tab has been stopped")
+
+        messages = [{"method": method, "params": dict(params)} for method, params in calls]
+        responses = self._send_many(messages, timeout=timeout)
+        results = []
+        for message, response in zip(messages, responses):
+            method = message['method']
+            if response is None:
+                results.append(TimeoutException("Calling %s timeout" % method))
+                continue
+            if self.recorder is not None:
+                self.recorder.record_method(method, message['params'], response)
+            if 'result' not in response and 'error' in response:
+                results.append(CallMethodException("calling method: %s error: %s" % (
+                    method, response['error']['message'])))
+            else:
+                results.append(response['result'])
+        return results
+
     def set_listener(self, event, callback):
         if not callback:
             return self.event_handlers.pop(event, None)
@@ -205,7 +306,10 @@ class Tab(object):
         self._started = True
         self.status = self.status_started
         self._stopped.clear()
-        self._ws = websocket.create_connection(self._websocket_url, enable_multithread=True, suppress_origin=True)
+        # Text frames are decoded as UTF-8 anyway, so websocket-client does
+        # not need to validate them with its much slower own check.
+        self._ws = websocket.create_connection(self._websocket_url, enable_multithread=True, suppress_origin=True,
+                                               skip_utf8_validation=True)
         self._recv_th.start()
         self._handle_event_th.start()
         return True
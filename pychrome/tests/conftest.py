@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+# These tests use the asyncio server of fake_chrome.py.
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.extend(["test_async_tab.py", "test_call_methods.py", "test_events.py", "test_session.py"])
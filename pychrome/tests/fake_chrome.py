@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+
+
+def _recv_frame_payload(data):
+    # Client frames are always masked.
+    length = data[1] & 0x7f
+    offset = 2
+    if length == 126:
+        length, = struct.unpack("!H", data[2:4])
+        offset = 4
+    elif length == 127:
+        length, = struct.unpack("!Q", data[2:10])
+        offset = 10
+    return data[offset:offset + 4], offset + 4, length
+
+
+class FakeChrome(object):
+    """A websocket server which answers like a tab of Chrome.
+
+    Test.echo returns its params, Test.fail returns an error, Test.sleep
+    never returns, Test.crash closes the connection and Test.emit sends the events in its params first.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.writers = set()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, "127.0.0.1", 0), self.loop).result()
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = "ws://127.0.0.1:%d/devtools/page/fake" % port
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for writer in list(self.writers):
+            writer.close()
+        # Let the handlers see that their connections are gone.
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            await self._serve(reader, writer)
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def _serve(self, reader, writer):
+        request = await reader.readuntil(b"\r\n\r\n")
+        key = [line.split(b":", 1)[1].strip() for line in request.split(b"\r\n")
+               if line.lower().startswith(b"sec-websocket-key:")][0]
+        accept = base64.b64encode(hashlib.sha1(key + b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11").digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        while True:
+            try:
+                header = await reader.readexactly(2)
+            except asyncio.IncompleteReadError:
+                return
+            extra = {126: 2, 127: 8}.get(header[1] & 0x7f, 0)
+            header += await reader.readexactly(extra + 4)
+            mask_key, _, length = _recv_frame_payload(header)
+            payload = bytearray(await reader.readexactly(length))
+            for i in range(length):
+                payload[i] ^= mask_key[i % 4]
+            if header[0] & 0x0f == 0x8:
+                writer.close()
+                return
+            responses = self.respond(json.loads(payload.decode()))
+            if responses is None:
+                writer.close()
+                return
+            for response in responses:
+                self._send(writer, response)
+
+    def respond(self, message):
+        """Return the messages to send for message or None to close the connection."""
+        method, params = message["method"], message["params"]
+        if method == "Test.sleep":
+            return []
+        if method == "Test.crash":
+            return None
+        responses = []
+        if method == "Test.emit":
+            responses.extend(params["events"])
+        if method == "Test.fail":
+            responses.append({"id": message["id"], "error": {"message": "failed"}})
+        else:
+            responses.append({"id": message["id"], "result": params})
+        return responses
+
+    @staticmethod
+    def _send(writer, message):
+        # Compact, like Chrome.
+        data = json.dumps(message, separators=(",", ":")).encode()
+        if len(data) < 126:
+            header = struct.pack("!BB", 0x81, len(data))
+        elif len(data) < 1 << 16:
+            header = struct.pack("!BBH", 0x81, 126, len(data))
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, len(data))
+        writer.write(header + data)
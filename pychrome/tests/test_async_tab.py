@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+
+import pytest
+import pychrome
+
+from fake_chrome import FakeChrome
+
+
+@pytest.fixture
+def chrome():
+    chrome = FakeChrome()
+    yield chrome
+    chrome.close()
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.mark.filterwarnings("ignore:Test.fail error")
+def test_async_call_method(chrome):
+    async def main():
+        tab = pychrome.AsyncTab(id="fake", webSocketDebuggerUrl=chrome.url)
+        await tab.start()
+        assert await tab.Test.echo(value=1) == {"value": 1}
+        # Large messages need extended payload lengths.
+        assert await tab.Test.echo(value="x" * 100000) == {"value": "x" * 100000}
+        results = await asyncio.gather(*[tab.Test.echo(value=i) for i in range(100)])
+        assert [result["value"] for result in results] == list(range(100))
+        with pytest.raises(pychrome.CallMethodException):
+            await tab.Test.fail()
+        with pytest.raises(pychrome.TimeoutException):
+            await tab.Test.sleep(_timeout=0.1)
+        assert not tab.method_results
+        assert await tab.stop()
+        assert await tab.wait(1)
+
+    run(main())
+
+
+def test_async_events(chrome):
+    async def main():
+        tab = pychrome.AsyncTab(id="fake", webSocketDebuggerUrl=chrome.url)
+        received = []
+
+        async def async_handler(value):
+            # Handlers can call methods.
+            received.append((await tab.Test.echo(value=value))["value"])
+
+        def handler(value):
+            received.append(value)
+
+        tab.Test.asyncEvent = async_handler
+        tab.Test.event = handler
+        await tab.start()
+        await tab.Test.emit(events=[
+            {"method": "Test.asyncEvent", "params": {"value": 1}},
+            {"method": "Test.unhandled", "params": {}},
+            {"method": "Test.event", "params": {"value": 2}},
+        ])
+        for _ in range(100):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert received == [1, 2]
+        await tab.stop()
+
+    run(main())
+
+
+def test_async_stop_aborts_calls(chrome):
+    async def main():
+        tab = pychrome.AsyncTab(id="fake", webSocketDebuggerUrl=chrome.url)
+        await tab.start()
+        call = asyncio.ensure_future(tab.Test.sleep())
+        await asyncio.sleep(0.1)
+        assert not await tab.wait(0.1)
+        await tab.stop()
+        with pytest.raises(pychrome.UserAbortException):
+            await call
+        with pytest.raises(pychrome.RuntimeException):
+            await tab.Test.echo()
+
+    run(main())
+
+
+def test_async_connection_lost(chrome):
+    async def main():
+        tab = pychrome.AsyncTab(id="fake", webSocketDebuggerUrl=chrome.url)
+        await tab.start()
+        with pytest.raises(pychrome.TabConnectionException):
+            await tab.Test.crash()
+        assert await tab.wait(1)
+
+    run(main())
+
+
+@pytest.mark.filterwarnings("ignore:Test.fail error")
+def test_sync_tab(chrome):
+    tab = pychrome.SyncTab(id="fake", webSocketDebuggerUrl=chrome.url)
+    assert isinstance(tab, pychrome.Tab)
+    received = []
+
+    def handler(value):
+        # Handlers run in their own thread and can call methods.
+        received.append(tab.Test.echo(value=value)["value"])
+
+    tab.Test.event = handler
+    assert tab.start()
+    assert tab.Test.echo(value=1) == {"value": 1}
+    with pytest.raises(pychrome.CallMethodException):
+        tab.Test.fail()
+    with pytest.raises(pychrome.TimeoutException):
+        tab.Test.sleep(_timeout=0.1)
+    tab.Test.emit(events=[{"method": "Test.event", "params": {"value": 3}}])
+    assert not tab.wait(0.2)
+    assert received == [3]
+    assert tab.stop()
+    assert tab.status == pychrome.Tab.status_stopped
+    assert tab.wait()
+
+
+def test_sync_tab_performance(chrome):
+    tab = pychrome.SyncTab(id="fake", webSocketDebuggerUrl=chrome.url)
+    tab.start()
+    start = time.time()
+    for i in range(200):
+        tab.Test.echo(value=i)
+    # Each call takes well below a millisecond on a local connection.
+    assert time.time() - start < 5
+    tab.stop()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import pychrome
+
+from fake_chrome import FakeChrome
+
+
+CALLS = [
+    ("Test.echo", {"value": 1}),
+    ("Test.fail", {}),
+    ("Test.echo", {"value": 2}),
+]
+
+
+@pytest.fixture
+def chrome():
+    chrome = FakeChrome()
+    yield chrome
+    chrome.close()
+
+
+def check_results(results):
+    assert len(results) == 3
+    assert results[0] == {"value": 1}
+    assert isinstance(results[1], pychrome.CallMethodException)
+    assert results[2] == {"value": 2}
+
+
+@pytest.mark.filterwarnings("ignore:Test.fail error")
+@pytest.mark.parametrize("tab_class", [pychrome.Tab, pychrome.SyncTab])
+def test_call_methods(chrome, tab_class):
+    tab = tab_class(id="fake", webSocketDebuggerUrl=chrome.url)
+    with pytest.raises(pychrome.RuntimeException):
+        tab.call_methods(CALLS)
+    tab.start()
+    check_results(tab.call_methods(CALLS))
+    assert tab.call_methods([]) == []
+
+    results = tab.call_methods([("Test.echo", {"value": i}) for i in range(500)])
+    assert [result["value"] for result in results] == list(range(500))
+
+    results = tab.call_methods([("Test.echo", {}), ("Test.sleep", {})], timeout=0.2)
+    assert results[0] == {}
+    assert isinstance(results[1], pychrome.TimeoutException)
+    assert not tab.method_results
+    tab.stop()
+
+
+def test_call_methods_recorded(chrome, tmpdir):
+    path = str(tmpdir.join("recording.jsonl.gz"))
+    tab = pychrome.Tab(id="fake", webSocketDebuggerUrl=chrome.url)
+    tab.recorder = pychrome.Recorder(path)
+    tab.start()
+    check_results(tab.call_methods(CALLS))
+    tab.stop()
+    tab.recorder.close()
+
+    replay_tab = pychrome.ReplayTab(path)
+    replay_tab.start()
+    check_results(replay_tab.call_methods(CALLS))
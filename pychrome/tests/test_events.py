@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+import pychrome
+from pychrome import jsonlib
+
+from fake_chrome import FakeChrome
+
+
+@pytest.fixture
+def chrome():
+    chrome = FakeChrome()
+    yield chrome
+    chrome.close()
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    decoded = []
+    loads = jsonlib.loads
+
+    def counting_loads(message_json):
+        message = loads(message_json)
+        decoded.append(message.get("method"))
+        return message
+
+    monkeypatch.setattr(jsonlib, "loads", counting_loads)
+    return decoded
+
+
+def events(num_unhandled):
+    return [{"method": "DOM.childNodeInserted", "params": {"node": {"nodeId": i}}}
+            for i in range(num_unhandled)] + [{"method": "Test.event", "params": {"value": 1}}]
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        time.sleep(0.01)
+
+
+def test_peek_event_method():
+    assert jsonlib.peek_event_method('{"method":"Page.loadEventFired","params":{}}') == "Page.loadEventFired"
+    assert jsonlib.peek_event_method('{"id":1,"result":{}}') is None
+    assert jsonlib.peek_event_method('{"params":{},"method":"Page.loadEventFired"}') is None
+    assert jsonlib.peek_event_method('{"method":"Page') is None
+
+
+def test_drop_unhandled_events(chrome, decoded):
+    tab = pychrome.Tab(id="fake", webSocketDebuggerUrl=chrome.url)
+    received = []
+    tab.Test.event = lambda value: received.append(value)
+    tab.start()
+    tab.Test.emit(events=events(100))
+    wait_for(lambda: received)
+    tab.stop()
+    assert received == [1]
+    assert decoded == ["Test.event", None]
+
+
+def test_keep_unhandled_events(chrome, decoded):
+    tab = pychrome.Tab(id="fake", webSocketDebuggerUrl=chrome.url)
+    tab.drop_unhandled_events = False
+    received = []
+    tab.Test.event = lambda value: received.append(value)
+    tab.start()
+    tab.Test.emit(events=events(10))
+    wait_for(lambda: received)
+    tab.stop()
+    assert received == [1]
+    assert len(decoded) == 12
+
+
+def test_record_unhandled_events(chrome, tmpdir):
+    path = str(tmpdir.join("recording.jsonl.gz"))
+    tab = pychrome.Tab(id="fake", webSocketDebuggerUrl=chrome.url)
+    tab.recorder = pychrome.Recorder(path)
+    tab.start()
+    tab.Test.emit(events=events(10))
+    time.sleep(0.2)
+    tab.stop()
+    tab.recorder.close()
+
+    replay_tab = pychrome.ReplayTab(path)
+    inserted = []
+    replay_tab.DOM.childNodeInserted = lambda node: inserted.append(node["nodeId"])
+    replay_tab.replay_events()
+    assert inserted == list(range(10))
+
+
+def test_async_drop_unhandled_events(chrome, decoded):
+    tab = pychrome.SyncTab(id="fake", webSocketDebuggerUrl=chrome.url)
+    received = []
+    tab.Test.event = lambda value: received.append(value)
+    tab.start()
+    tab.Test.emit(events=events(100))
+    wait_for(lambda: received)
+    tab.stop()
+    assert received == [1]
+    assert decoded == ["Test.event", None]
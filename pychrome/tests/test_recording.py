@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import pychrome
+
+
+def write_recording(path):
+    recorder = pychrome.Recorder(str(path))
+    recorder.annotate("url", "http://www.fatezero.org")
+    recorder.record_event("Network.requestWillBeSent", {"requestId": "1"})
+    recorder.record_method("Page.navigate", {"url": "http://www.fatezero.org"},
+                           {"id": 1001, "result": {"frameId": "A"}})
+    recorder.record_event("Network.requestWillBeSent", {"requestId": "2"})
+    recorder.record_method("Runtime.evaluate", {"expression": "1"},
+                           {"id": 1002, "result": {"result": {"value": 1}}})
+    recorder.record_method("Runtime.evaluate", {"expression": "2"},
+                           {"id": 1003, "result": {"result": {"value": 2}}})
+    recorder.record_method("DOM.getDocument", {},
+                           {"id": 1004, "error": {"message": "No document"}})
+    recorder.close()
+
+
+def test_replay_methods(tmpdir):
+    path = tmpdir.join("recording.jsonl.gz")
+    write_recording(path)
+
+    tab = pychrome.ReplayTab(str(path))
+    assert tab.annotations == {"url": "http://www.fatezero.org"}
+
+    tab.start()
+    assert tab.Page.navigate(url="http://www.fatezero.org")["frameId"] == "A"
+    assert tab.Runtime.evaluate(expression="2")["result"]["value"] == 2
+    assert tab.Runtime.evaluate(expression="1", _timeout=5)["result"]["value"] == 1
+    # Unknown parameters get the responses of the method in their order.
+    assert tab.Runtime.evaluate(expression="3")["result"]["value"] == 1
+    assert tab.Runtime.evaluate(expression="3")["result"]["value"] == 2
+    assert tab.Runtime.evaluate(expression="3")["result"]["value"] == 2
+
+    with pytest.raises(pychrome.CallMethodException):
+        tab.DOM.getDocument()
+    with pytest.raises(pychrome.CallMethodException):
+        tab.Page.reload()
+
+    tab.stop()
+
+
+def test_replay_events(tmpdir):
+    path = tmpdir.join("recording.jsonl.gz")
+    write_recording(path)
+
+    request_ids = []
+
+    def request_will_be_sent(**kwargs):
+        request_ids.append(kwargs["requestId"])
+
+    tab = pychrome.ReplayTab(str(path))
+    tab.Network.requestWillBeSent = request_will_be_sent
+    tab.start()
+    tab.replay_events()
+    tab.stop()
+
+    assert request_ids == ["1", "2"]
+    assert tab.wait(1)
+
+
+def test_replay_browser(tmpdir):
+    path = tmpdir.join("recording.jsonl.gz")
+    write_recording(path)
+
+    tab = pychrome.ReplayTab(str(path))
+    browser = pychrome.ReplayBrowser(tab)
+    assert browser.new_tab() is tab
+    tab.start()
+    browser.close_tab(tab.id)
+    assert tab.status == pychrome.Tab.status_stopped
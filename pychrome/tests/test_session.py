@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import threading
+
+import pytest
+import pychrome
+
+from fake_chrome import FakeChrome
+
+
+class FakeBrowser(FakeChrome):
+    """The browser target of FakeChrome, which supports flattened sessions.
+
+    Test.attachChild attaches an iframe target to the session it is
+    sent on, like Target.setAutoAttach does.
+    """
+
+    def __init__(self):
+        super(FakeBrowser, self).__init__()
+        self.targets = {}
+        self.sessions = {}
+        self._ids = itertools.count()
+
+    def _attach(self, target_id, parent_session_id=None):
+        session_id = "session-%d" % next(self._ids)
+        self.sessions[session_id] = target_id
+        event = {"method": "Target.attachedToTarget", "params": {
+            "sessionId": session_id, "targetInfo": self.targets[target_id], "waitingForDebugger": False}}
+        if parent_session_id is not None:
+            event["sessionId"] = parent_session_id
+        return session_id, event
+
+    def _detach(self, session_id):
+        del self.sessions[session_id]
+        return {"method": "Target.detachedFromTarget", "params": {"sessionId": session_id}}
+
+    def respond(self, message):
+        method, params = message["method"], message["params"]
+        session_id = message.get("sessionId")
+        responses = []
+        result = {}
+        if method == "Target.createTarget":
+            target_id = "target-%d" % next(self._ids)
+            self.targets[target_id] = {"targetId": target_id, "type": "page", "url": params["url"]}
+            result = {"targetId": target_id}
+        elif method == "Target.attachToTarget":
+            assert params["flatten"]
+            result["sessionId"], event = self._attach(params["targetId"])
+            responses.append(event)
+        elif method == "Target.detachFromTarget":
+            responses.append(self._detach(params["sessionId"]))
+        elif method == "Target.closeTarget":
+            for other_session_id, target_id in list(self.sessions.items()):
+                if target_id == params["targetId"]:
+                    responses.append(self._detach(other_session_id))
+            del self.targets[params["targetId"]]
+            result = {"success": True}
+        elif method == "Target.getTargets":
+            result = {"targetInfos": list(self.targets.values())}
+        elif method == "Browser.getVersion":
+            result = {"product": "FakeChrome"}
+        elif method == "Test.attachChild":
+            target_id = "iframe-%d" % next(self._ids)
+            self.targets[target_id] = {"targetId": target_id, "type": "iframe", "url": ""}
+            responses.append(self._attach(target_id, session_id)[1])
+        else:
+            assert session_id in self.sessions
+            responses = super(FakeBrowser, self).respond(message)
+            for response in responses:
+                response["sessionId"] = session_id
+            return responses
+        responses.append({"id": message["id"], "result": result})
+        for response in responses:
+            if session_id is not None:
+                response.setdefault("sessionId", session_id)
+        return responses
+
+
+@pytest.fixture
+def browser():
+    fake_browser = FakeBrowser()
+    browser = pychrome.FlatBrowser(websocket_url=fake_browser.url)
+    browser.fake = fake_browser
+    yield browser
+    browser.close()
+    fake_browser.close()
+
+
+@pytest.mark.filterwarnings("ignore:Test.fail error")
+def test_sessions(browser):
+    tab1 = browser.new_tab()
+    tab2 = browser.new_tab("http://example.com")
+    assert isinstance(tab1, pychrome.Tab)
+    assert sorted(tab.id for tab in browser.list_tab()) == sorted([tab1.id, tab2.id])
+    assert browser.version() == {"product": "FakeChrome"}
+
+    received = []
+    tab1.Test.event = lambda value: received.append((tab1.id, value))
+    tab2.Test.event = lambda value: received.append((tab2.id, value))
+    tab1.start()
+    tab2.start()
+    assert tab1.session_id != tab2.session_id
+    assert tab1.Test.echo(value=1) == {"value": 1}
+    assert tab2.Test.echo(value=2) == {"value": 2}
+    with pytest.raises(pychrome.CallMethodException):
+        tab1.Test.fail()
+    tab1.Test.emit(events=[{"method": "Test.event", "params": {"value": 1}}])
+    tab2.Test.emit(events=[{"method": "Test.event", "params": {"value": 2}}])
+    assert not tab1.wait(0.2)
+    assert sorted(received) == sorted([(tab1.id, 1), (tab2.id, 2)])
+
+    browser.close_tab(tab1)
+    assert tab1.status == pychrome.Tab.status_stopped
+    assert tab1.wait()
+    assert [tab.id for tab in browser.list_tab()] == [tab2.id]
+    assert tab2.Test.echo(value=3) == {"value": 3}
+    results = tab2.call_methods([("Test.echo", {"value": 4}), ("Test.fail", {})])
+    assert results[0] == {"value": 4}
+    assert isinstance(results[1], pychrome.CallMethodException)
+    # All sessions used one connection.
+    assert list(browser.fake.sessions) == [tab2.session_id]
+
+
+def test_concurrent_calls(browser):
+    tabs = [browser.new_tab() for _ in range(4)]
+    errors = []
+
+    def call(tab):
+        try:
+            tab.start()
+            for i in range(50):
+                assert tab.Test.echo(value=i, tab=tab.id) == {"value": i, "tab": tab.id}
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(tab,)) for tab in tabs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def test_child_sessions(browser):
+    tab = browser.new_tab()
+    tab.start()
+    tab.Test.attachChild()
+    children = tab.get_child_sessions()
+    assert len(children) == 1
+    child = children[0]
+    assert child.target_info["type"] == "iframe"
+    assert browser.browser_tab.get_session(child.session_id) is child
+
+    received = []
+    child.Test.event = lambda value: received.append(value)
+    child.start()
+    assert child.Test.echo(value=1) == {"value": 1}
+    child.Test.emit(events=[{"method": "Test.event", "params": {"value": child.id}}])
+    assert not child.wait(0.2)
+    assert received == [child.id]
+
+    child.stop()
+    assert tab.get_child_sessions() == []
+
+
+def test_browser_closed(browser):
+    tab = browser.new_tab()
+    tab.start()
+    browser.close()
+    assert tab.wait(2)
+    assert tab.status == pychrome.Tab.status_stopped
@@ -60,16 +60,117 @@ CREATE TABLE scanner_scan (
 CREATE INDEX latest_scans ON scanner_scan USING btree (is_latest) WHERE is_latest;
 CREATE INDEX scanner_scan_site ON scanner_scan(site_id);
 
+-- Results of the scan modules, one row per key. scanner_scan.result only
+-- holds the initial data of a scan, e.g., the site_url.
+CREATE TABLE scanner_scanresult (
+    scan_id integer NOT NULL REFERENCES scanner_scan(id),
+    key character varying(200) NOT NULL,
+    value jsonb,
+    scan_module character varying(80) NOT NULL,
+    PRIMARY KEY (scan_id, key)
+);
+
+-- Merged result document of a scan, i.e., what was stored in
+-- scanner_scan.result before results were stored per key.
+CREATE VIEW scanner_scan_merged AS
+SELECT s.id, s.time_started, s.time_finished,
+       COALESCE(s.result, '{}'::jsonb) || COALESCE(r.result, '{}'::jsonb) AS result,
+       s.is_latest, s.site_id
+FROM scanner_scan AS s
+LEFT JOIN LATERAL (
+    SELECT jsonb_object_agg(sr.key, sr.value) AS result
+    FROM scanner_scanresult AS sr
+    WHERE sr.scan_id = s.id
+) AS r ON true;
+
 CREATE TABLE scanner_scanjob (
     id serial NOT NULL PRIMARY KEY,
     scan_module character varying(80) NOT NULL,
     priority integer NOT NULL,
     dependency_order integer NOT NULL,
     scan_id integer NOT NULL REFERENCES scanner_scan(id),
-    not_before timestamp with time zone
+    not_before timestamp with time zone,
+    -- Host and pid of the worker which claimed the job, and until when
+    -- the claim is valid unless the master of the worker extends it.
+    lease_owner character varying(80),
+    lease_worker integer,
+    lease_expires timestamp with time zone
 );
 
 CREATE INDEX scanner_scanjob_scan ON scanner_scanjob(scan_id);
+CREATE INDEX scanner_scanjob_lease_expires ON scanner_scanjob(lease_expires) WHERE lease_expires IS NOT NULL;
+CREATE INDEX scanner_scanjob_lease_owner ON scanner_scanjob(lease_owner, lease_worker) WHERE lease_owner IS NOT NULL;
+
+-- Jobs whose dependencies are processed, i.e., the jobs with the lowest
+-- dependency_order of their scan. Maintained by the triggers on
+-- scanner_scanjob, so that fetching a job is an index-ordered pop.
+CREATE TABLE scanner_readyjob (
+    job_id integer NOT NULL PRIMARY KEY REFERENCES scanner_scanjob(id) ON DELETE CASCADE,
+    scan_module character varying(80) NOT NULL,
+    priority integer NOT NULL,
+    dependency_order integer NOT NULL,
+    scan_id integer NOT NULL,
+    not_before timestamp with time zone,
+    lease_owner character varying(80)
+);
+
+CREATE INDEX scanner_readyjob_order ON scanner_readyjob(priority DESC, scan_id)
+    INCLUDE (job_id, scan_module, dependency_order, not_before) WHERE lease_owner IS NULL;
+CREATE INDEX scanner_readyjob_scan ON scanner_readyjob(scan_id);
+
+CREATE FUNCTION update_ready_jobs() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+        DECLARE
+          next_order integer;
+        BEGIN
+          IF (TG_OP = 'INSERT') THEN
+            PERFORM pg_advisory_xact_lock(NEW.scan_id);
+            IF EXISTS (SELECT 1 FROM scanner_scanjob
+                       WHERE scan_id = NEW.scan_id AND dependency_order < NEW.dependency_order) THEN
+              RETURN NEW;
+            END IF;
+            -- Jobs which were ready before have to wait for the new job now.
+            DELETE FROM scanner_readyjob
+              WHERE scan_id = NEW.scan_id AND dependency_order > NEW.dependency_order;
+            INSERT INTO scanner_readyjob (job_id, scan_module, priority, dependency_order, scan_id, not_before,
+                                          lease_owner)
+              VALUES (NEW.id, NEW.scan_module, NEW.priority, NEW.dependency_order, NEW.scan_id, NEW.not_before,
+                      NEW.lease_owner);
+            RETURN NEW;
+          ELSIF (TG_OP = 'UPDATE') THEN
+            UPDATE scanner_readyjob
+              SET priority = NEW.priority, not_before = NEW.not_before, lease_owner = NEW.lease_owner
+              WHERE job_id = NEW.id;
+            RETURN NEW;
+          ELSIF (TG_OP = 'DELETE') THEN
+            -- Without the lock, the transactions deleting the last jobs of
+            -- a dependency_order at the same time would each still see the
+            -- other job and none of them would make the next ones ready.
+            -- The queries of this function see the jobs deleted by the
+            -- transaction holding the lock before, as it has committed.
+            PERFORM pg_advisory_xact_lock(OLD.scan_id);
+            IF EXISTS (SELECT 1 FROM scanner_scanjob
+                       WHERE scan_id = OLD.scan_id AND dependency_order <= OLD.dependency_order) THEN
+              RETURN OLD;
+            END IF;
+            -- The last job of this dependency_order is gone, so the next
+            -- ones are ready now.
+            SELECT MIN(dependency_order) FROM scanner_scanjob WHERE scan_id = OLD.scan_id INTO next_order;
+            IF next_order IS NOT NULL THEN
+              INSERT INTO scanner_readyjob (job_id, scan_module, priority, dependency_order, scan_id, not_before,
+                                            lease_owner)
+                SELECT id, scan_module, priority, dependency_order, scan_id, not_before, lease_owner
+                FROM scanner_scanjob
+                WHERE scan_id = OLD.scan_id AND dependency_order = next_order
+                ON CONFLICT (job_id) DO NOTHING;
+            END IF;
+            RETURN OLD;
+          END IF;
+        END
+        $$;
+
+CREATE TRIGGER scanjob_ready AFTER INSERT OR DELETE OR UPDATE OF priority, not_before, lease_owner ON scanner_scanjob FOR EACH ROW EXECUTE PROCEDURE update_ready_jobs();
 
 CREATE TABLE scanner_scaninfo (
     id serial NOT NULL PRIMARY KEY,
@@ -78,7 +179,8 @@ CREATE TABLE scanner_scaninfo (
     time_started timestamp with time zone,
     time_finished timestamp with time zone,
     scan_id integer NOT NULL REFERENCES scanner_scan(id),
-    num_tries integer NOT NULL
+    num_tries integer NOT NULL,
+    spans jsonb
 );
 
 CREATE INDEX scanner_scaninfo_scan ON scanner_scaninfo(scan_id);
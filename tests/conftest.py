@@ -0,0 +1,87 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psycopg2
+import pytest
+
+
+SCHEMA_FILE = Path(__file__).resolve().parent.parent / 'schema.sql'
+
+
+@pytest.fixture
+def db_dsn():
+    """Return the DSN of a fresh schema.sql in a schema of its own.
+
+    The tests which need PostgreSQL run only if PRIVACYSCANNER_TEST_DSN
+    is set to the DSN of a database in which they may create schemas,
+    e.g., 'dbname=privacyscanner_test user=privacyscanner'.
+    """
+    dsn = os.environ.get('PRIVACYSCANNER_TEST_DSN')
+    if not dsn:
+        pytest.skip('PRIVACYSCANNER_TEST_DSN is not set')
+    schema = 'test_' + uuid.uuid4().hex[:12]
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as c:
+            c.execute('CREATE SCHEMA {}'.format(schema))
+            c.execute('SET search_path TO {}'.format(schema))
+            c.execute(SCHEMA_FILE.read_text())
+        conn.commit()
+        yield "{} options='-c search_path={}'".format(dsn, schema)
+    finally:
+        conn.rollback()
+        with conn.cursor() as c:
+            c.execute('DROP SCHEMA {} CASCADE'.format(schema))
+        conn.commit()
+        conn.close()
+
+
+@pytest.fixture
+def db_conn(db_dsn):
+    conn = psycopg2.connect(db_dsn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def create_scan(db_conn):
+    """Return a function which creates a scan with jobs and returns its id.
+
+    jobs maps the scan modules to their dependency_order.
+    """
+    def create_scan(jobs, site_url='https://example.com/', priority=0):
+        now = datetime.now(timezone.utc)
+        site_id = uuid.uuid4().hex
+        with db_conn.cursor() as c:
+            c.execute("INSERT INTO sites_site (id, url, is_private, date_created, num_views) "
+                      "VALUES (%s, %s, false, %s, 0)", (site_id, site_url, now))
+            c.execute("INSERT INTO scanner_scan (time_started, result, is_latest, site_id) "
+                      "VALUES (%s, %s, true, %s) RETURNING id",
+                      (now, '{{"site_url": "{}"}}'.format(site_url), site_id))
+            scan_id = c.fetchone()[0]
+            for scan_module, dependency_order in jobs.items():
+                c.execute("INSERT INTO scanner_scaninfo (scan_module, scan_id, num_tries) "
+                          "VALUES (%s, %s, 0)", (scan_module, scan_id))
+                c.execute("INSERT INTO scanner_scanjob "
+                          "(scan_module, priority, dependency_order, scan_id) "
+                          "VALUES (%s, %s, %s, %s)",
+                          (scan_module, priority, dependency_order, scan_id))
+        db_conn.commit()
+        return scan_id
+
+    return create_scan
+
+
+@pytest.fixture
+def fetch_all(db_conn):
+    """Return a function which returns the rows of a query in a new transaction."""
+    def fetch_all(query, params=None):
+        with db_conn.cursor() as c:
+            c.execute(query, params)
+            rows = c.fetchall()
+        db_conn.commit()
+        return rows
+
+    return fetch_all
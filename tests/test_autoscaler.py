@@ -0,0 +1,40 @@
+import pytest
+
+from privacyscanner.autoscaler import Autoscaler
+
+MIB = 1024 * 1024
+
+
+@pytest.fixture
+def autoscaler(monkeypatch):
+    autoscaler = Autoscaler(min_workers=2, max_workers=4, memory_reserve=1024, max_load=1.0)
+    autoscaler.sample = {'load': 0.5, 'available': 4096 * MIB, 'worker_rss': 512 * MIB}
+    monkeypatch.setattr(autoscaler, '_sample', lambda worker_pids: dict(autoscaler.sample))
+    return autoscaler
+
+
+def test_add_worker_when_all_are_busy(autoscaler):
+    assert autoscaler.get_num_workers(2, [1, 2], num_busy=2) == 3
+    assert autoscaler.get_num_workers(3, [1, 2, 3], num_busy=2) == 3
+    assert autoscaler.get_num_workers(4, [1, 2, 3, 4], num_busy=4) == 4
+
+
+def test_add_worker_only_if_memory_suffices(autoscaler):
+    autoscaler.sample['worker_rss'] = 3072 * MIB
+    assert autoscaler.get_num_workers(2, [1, 2], num_busy=2) == 2
+
+
+def test_remove_worker_under_pressure(autoscaler):
+    autoscaler.sample['available'] = 512 * MIB
+    assert autoscaler.get_num_workers(4, [1, 2, 3, 4], num_busy=4) == 3
+    assert autoscaler.get_num_workers(2, [1, 2], num_busy=2) == 2
+    autoscaler.sample['available'] = 4096 * MIB
+    autoscaler.sample['load'] = 1.5
+    assert autoscaler.get_num_workers(3, [1, 2, 3], num_busy=3) == 2
+    assert autoscaler.last_sample['load'] == 1.5
+
+
+def test_keep_within_limits(autoscaler):
+    assert autoscaler.get_num_workers(0, [], num_busy=0) == 2
+    assert autoscaler.get_num_workers(8, [1], num_busy=0) == 4
+    assert Autoscaler(min_workers=0, max_workers=0).max_workers == 1
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from privacyscanner.scanmodules.chromedevtools import chromescan
+from privacyscanner.scanmodules.chromedevtools.chromescan import get_persistent_browser
+
+
+class FakeBrowser(chromescan.PersistentChromeBrowser):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_stops = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.num_stops += 1
+
+    def is_usable(self):
+        return True
+
+
+class FakeBrowserContext:
+    def __init__(self, browser_tab, debugging_port, tab_class, flatten):
+        pass
+
+    def dispose(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def browsers(monkeypatch):
+    browsers = []
+    monkeypatch.setattr(chromescan, 'PersistentChromeBrowser', FakeBrowser)
+    monkeypatch.setattr(chromescan, 'BrowserContext', FakeBrowserContext)
+    monkeypatch.setattr(chromescan, '_persistent_browsers', browsers)
+    return browsers
+
+
+def test_browser_per_config(browsers):
+    options = chromescan.CHROME_OPTIONS + ['--hide-scrollbars']
+    for _ in range(3):
+        devtools_browser = get_persistent_browser(9222, 'chrome')
+        cookiebanner_browser = get_persistent_browser(9222, 'chrome', chrome_options=options)
+    assert browsers == [devtools_browser, cookiebanner_browser]
+    assert devtools_browser._debugging_port == 9222
+    assert cookiebanner_browser._debugging_port != 9222
+    assert cookiebanner_browser._chrome_options == options
+    assert devtools_browser.num_stops == cookiebanner_browser.num_stops == 0
+
+
+def test_stop_persistent_browsers(browsers):
+    browser = get_persistent_browser(9222, 'chrome', max_scans=10)
+    assert browser.max_scans == 10
+    assert get_persistent_browser(9222, 'chrome', max_scans=20) is browser
+    assert browser.max_scans == 20
+    chromescan.stop_persistent_browsers()
+    assert browser.num_stops == 1
+    assert browsers == []
+
+
+def test_browser_with_open_context_is_not_stopped(browsers):
+    browser = get_persistent_browser(9222, 'chrome')
+    entered = threading.Event()
+    done = threading.Event()
+
+    def scan():
+        with browser.new_context():
+            entered.set()
+            done.wait()
+
+    scan_thread = threading.Thread(target=scan)
+    scan_thread.start()
+    entered.wait()
+    get_persistent_browser(9222, 'chrome', chrome_options=['--hide-scrollbars'])
+    stop_thread = threading.Thread(target=chromescan.stop_persistent_browsers)
+    stop_thread.start()
+    stop_thread.join(0.2)
+    assert stop_thread.is_alive()
+    assert browser.num_stops == 0
+    done.set()
+    scan_thread.join()
+    stop_thread.join()
+    assert browser.num_stops == 1
@@ -0,0 +1,146 @@
+from types import SimpleNamespace
+
+import pytest
+
+from privacyscanner.jobqueue import JobQueue, LeaseKeeper
+
+
+def make_modules(**claim_sizes):
+    return {name: SimpleNamespace(name=name, required_keys=['site_url'],
+                                  options={'claim_size': claim_size})
+            for name, claim_size in claim_sizes.items()}
+
+
+@pytest.fixture
+def make_queue(db_dsn):
+    queues = []
+
+    def make_queue(scan_modules, lease_worker=1, max_tries=3):
+        queue = JobQueue(db_dsn, scan_modules, max_tries, lease_owner='test',
+                         lease_worker=lease_worker)
+        queues.append(queue)
+        return queue
+
+    yield make_queue
+    for queue in queues:
+        queue._conn.close()
+        queue._listen_conn.close()
+
+
+def test_claim_respects_claim_size(make_queue, create_scan, fetch_all):
+    scan_ids = [create_scan({'dns': 1}) for _ in range(3)]
+    queue = make_queue(make_modules(dns=2))
+    job = queue.get_job_nowait()
+    assert job.scan_id == scan_ids[0]
+    assert job.current_result == {'site_url': 'https://example.com/'}
+    assert [claimed_job.scan_id for claimed_job in queue._buffer] == [scan_ids[1]]
+    assert fetch_all('SELECT scan_id, lease_worker FROM scanner_scanjob '
+                     'WHERE lease_owner IS NOT NULL ORDER BY scan_id') == [
+        (scan_ids[0], 1), (scan_ids[1], 1)]
+
+    # Claimed jobs are hidden from other workers.
+    other_queue = make_queue(make_modules(dns=2), lease_worker=2)
+    assert other_queue.get_job_nowait().scan_id == scan_ids[2]
+    other_queue.report_failure()
+
+
+def test_claim_limits_every_module(make_queue, create_scan):
+    for _ in range(3):
+        create_scan({'dns': 1, 'mail': 1})
+    queue = make_queue(make_modules(dns=1, mail=2))
+    queue._claim_jobs()
+    claimed = sorted(claimed_job.scan_module_name for claimed_job in queue._buffer)
+    assert claimed == ['dns', 'mail']
+
+
+def test_release_returns_buffered_jobs(make_queue, create_scan, fetch_all):
+    scan_ids = [create_scan({'dns': 1}) for _ in range(2)]
+    queue = make_queue(make_modules(dns=2))
+    queue.get_job_nowait()
+    queue.release()
+    assert fetch_all('SELECT scan_id FROM scanner_scanjob WHERE lease_owner IS NULL') == [
+        (scan_ids[1],)]
+    queue.report_failure()
+    other_queue = make_queue(make_modules(dns=2), lease_worker=2)
+    assert other_queue.get_job_nowait().scan_id == scan_ids[0]
+    other_queue.report_failure()
+
+
+def test_dependent_job_waits(make_queue, create_scan):
+    create_scan({'chromedevtools': 1, 'dns': 2})
+    queue = make_queue(make_modules(chromedevtools=1, dns=1))
+    job = queue.get_job_nowait()
+    assert job.scan_module.name == 'chromedevtools'
+    assert make_queue(make_modules(dns=1), lease_worker=2).get_job_nowait() is None
+    queue.report_result({'redirect_chain': []})
+    job = queue.get_job_nowait()
+    assert job.scan_module.name == 'dns'
+    queue.report_result({})
+    assert queue.get_job_nowait() is None
+
+
+def test_claim_counts_try(make_queue, create_scan, fetch_all):
+    scan_id = create_scan({'dns': 1})
+    queue = make_queue(make_modules(dns=1), max_tries=2)
+    for num_tries in range(2):
+        job = queue.get_job_nowait()
+        assert job.num_tries == num_tries
+        assert fetch_all('SELECT num_tries FROM scanner_scaninfo WHERE scan_id = %s',
+                         (scan_id,)) == [(num_tries + 1,)]
+        queue.report_failure()
+    assert queue.get_job_nowait() is None
+
+
+def test_release_does_not_count_try(make_queue, create_scan, fetch_all):
+    scan_ids = [create_scan({'dns': 1}) for _ in range(2)]
+    queue = make_queue(make_modules(dns=2))
+    queue.get_job_nowait()
+    queue.release()
+    queue.report_failure()
+    assert fetch_all('SELECT scan_id, num_tries FROM scanner_scaninfo ORDER BY scan_id') == [
+        (scan_ids[0], 1), (scan_ids[1], 0)]
+
+
+EXPIRE_LEASES_QUERY = "UPDATE scanner_scanjob SET lease_expires = NOW() - INTERVAL '1 second'"
+
+
+@pytest.fixture
+def lease_keeper(db_dsn):
+    lease_keeper = LeaseKeeper(db_dsn, 'test', lease_duration=60)
+    yield lease_keeper
+    if lease_keeper._conn is not None:
+        lease_keeper._conn.close()
+
+
+def test_report_result_after_lease_was_reaped(make_queue, create_scan, lease_keeper,
+                                              db_conn, fetch_all):
+    scan_id = create_scan({'dns': 1})
+    queue = make_queue(make_modules(dns=1))
+    queue.get_job_nowait()
+    with db_conn.cursor() as c:
+        c.execute(EXPIRE_LEASES_QUERY)
+    db_conn.commit()
+    assert len(lease_keeper.reap()) == 1
+    other_queue = make_queue(make_modules(dns=1), lease_worker=2)
+    assert other_queue.get_job_nowait().scan_id == scan_id
+    assert not queue.report_result({'dns': 'stale'})
+    assert fetch_all('SELECT key FROM scanner_scanresult') == []
+    assert other_queue.report_result({'dns': 'fresh'})
+    assert fetch_all('SELECT key, value FROM scanner_scanresult') == [('dns', 'fresh')]
+    assert fetch_all('SELECT id FROM scanner_scanjob') == []
+
+
+def test_lease_keeper(make_queue, create_scan, lease_keeper, db_conn, fetch_all):
+    for _ in range(2):
+        create_scan({'dns': 1})
+    make_queue(make_modules(dns=1), lease_worker=1).get_job_nowait()
+    make_queue(make_modules(dns=1), lease_worker=2).get_job_nowait()
+    with db_conn.cursor() as c:
+        c.execute(EXPIRE_LEASES_QUERY)
+    db_conn.commit()
+    lease_keeper.extend([1])
+    assert [lease_owner for _, lease_owner in lease_keeper.reap()] == ['test']
+    assert fetch_all('SELECT lease_worker, lease_expires > NOW() FROM scanner_scanjob '
+                     'WHERE lease_owner IS NOT NULL') == [(1, True)]
+    lease_keeper.release_worker(1)
+    assert fetch_all('SELECT id FROM scanner_scanjob WHERE lease_owner IS NOT NULL') == []
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from privacyscanner.journal import JOURNAL_FILENAME, RESULTS_FILENAME, ResultJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = ResultJournal(tmp_path)
+    yield journal
+    journal.close()
+
+
+def test_replay(journal):
+    journal.start({'site_url': 'https://example.com/'})
+    journal.append('chromedevtools', {'cookies': [], 'redirect_chain': ['https://example.com/']})
+    journal.append('dns', {'dns': {'a': ['192.0.2.1']}}, removed={'cookies'})
+    journal.close()
+    assert ResultJournal(journal.results_dir).replay() == {
+        'site_url': 'https://example.com/',
+        'redirect_chain': ['https://example.com/'],
+        'dns': {'a': ['192.0.2.1']}}
+
+
+def test_replay_ignores_torn_last_line(journal):
+    journal.start({'site_url': 'https://example.com/'})
+    journal.append('dns', {'dns': {}})
+    journal.close()
+    with journal.path.open('a') as f:
+        f.write('{"scan_module":"mail","updates":{"mail"')
+    assert journal.replay() == {'site_url': 'https://example.com/', 'dns': {}}
+
+
+def test_replay_rejects_broken_line_in_the_middle(journal):
+    journal.start({'site_url': 'https://example.com/'})
+    journal.close()
+    with journal.path.open('a') as f:
+        f.write('{"scan_module":\n')
+    journal.append('dns', {'dns': {}})
+    journal.close()
+    with pytest.raises(ValueError):
+        journal.replay()
+
+
+def test_materialize(journal):
+    journal.start({'site_url': 'https://example.com/'})
+    journal.append('dns', {'dns': {}})
+    results_file = journal.materialize(journal.replay())
+    assert results_file == journal.results_dir / RESULTS_FILENAME
+    assert json.loads(results_file.read_text()) == {'site_url': 'https://example.com/', 'dns': {}}
+    assert not (journal.results_dir / JOURNAL_FILENAME).exists()
+    # A new scan removes the results of the previous one.
+    journal.start({'site_url': 'https://example.com/'})
+    assert not results_file.exists()
@@ -0,0 +1,52 @@
+from urllib.request import urlopen
+
+from privacyscanner.metrics import MetricsServer, Registry
+
+
+def test_render():
+    registry = Registry()
+    jobs = registry.counter('jobs_total', 'Finished jobs.', ['scan_module'])
+    workers = registry.gauge('workers', 'Running workers.', ['pool'])
+    jobs.inc('dns')
+    jobs.inc('dns', amount=2)
+    jobs.inc('chrome "devtools"')
+    workers.set(2, 'light')
+    workers.set(None, 'browser')
+    assert registry.render() == (
+        '# HELP jobs_total Finished jobs.\n'
+        '# TYPE jobs_total counter\n'
+        'jobs_total{scan_module="chrome \\"devtools\\""} 1.0\n'
+        'jobs_total{scan_module="dns"} 3.0\n'
+        '# HELP workers Running workers.\n'
+        '# TYPE workers gauge\n'
+        'workers{pool="light"} 2.0\n')
+    workers.replace({('browser',): 1})
+    assert 'workers{pool="browser"} 1.0\n' in registry.render()
+    assert 'light' not in registry.render()
+
+
+def test_render_histogram():
+    registry = Registry()
+    duration = registry.histogram('duration_seconds', 'Job duration.', [5, 1])
+    duration.observe(0.5)
+    duration.observe(3)
+    duration.observe(10)
+    assert registry.render().splitlines()[2:] == [
+        'duration_seconds_bucket{le="1.0"} 1',
+        'duration_seconds_bucket{le="5.0"} 2',
+        'duration_seconds_bucket{le="+Inf"} 3',
+        'duration_seconds_sum 13.5',
+        'duration_seconds_count 3']
+
+
+def test_server():
+    registry = Registry()
+    registry.counter('jobs_total', 'Finished jobs.').inc()
+    server = MetricsServer(registry, port=0)
+    server.start()
+    try:
+        host, port = server.address
+        with urlopen('http://{}:{}/metrics'.format(host, port)) as response:
+            assert response.read().decode() == registry.render()
+    finally:
+        server.stop()
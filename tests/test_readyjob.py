@@ -0,0 +1,55 @@
+import threading
+
+import psycopg2
+
+
+READY_JOBS_QUERY = 'SELECT scan_module FROM scanner_readyjob ORDER BY scan_module'
+
+
+def delete_job(conn, scan_id, scan_module):
+    with conn.cursor() as c:
+        c.execute('DELETE FROM scanner_scanjob WHERE scan_id = %s AND scan_module = %s',
+                  (scan_id, scan_module))
+
+
+def test_ready_jobs_follow_dependency_order(db_conn, create_scan, fetch_all):
+    scan_id = create_scan({'dns': 2, 'chromedevtools': 1, 'mail': 2, 'testsslsh_https': 3})
+    assert fetch_all(READY_JOBS_QUERY) == [('chromedevtools',)]
+    delete_job(db_conn, scan_id, 'chromedevtools')
+    db_conn.commit()
+    assert fetch_all(READY_JOBS_QUERY) == [('dns',), ('mail',)]
+    delete_job(db_conn, scan_id, 'dns')
+    db_conn.commit()
+    assert fetch_all(READY_JOBS_QUERY) == [('mail',)]
+    delete_job(db_conn, scan_id, 'mail')
+    db_conn.commit()
+    assert fetch_all(READY_JOBS_QUERY) == [('testsslsh_https',)]
+
+
+def test_inserted_job_blocks_later_jobs(db_conn, create_scan, fetch_all):
+    scan_id = create_scan({'dns': 2})
+    assert fetch_all(READY_JOBS_QUERY) == [('dns',)]
+    with db_conn.cursor() as c:
+        c.execute("INSERT INTO scanner_scanjob (scan_module, priority, dependency_order, scan_id) "
+                  "VALUES ('chromedevtools', 0, 1, %s)", (scan_id,))
+    db_conn.commit()
+    assert fetch_all(READY_JOBS_QUERY) == [('chromedevtools',)]
+
+
+def test_concurrent_deletes_make_next_jobs_ready(db_dsn, db_conn, create_scan, fetch_all):
+    scan_id = create_scan({'dns': 1, 'mail': 1, 'chromedevtools': 2})
+    other_conn = psycopg2.connect(db_dsn)
+    try:
+        delete_job(db_conn, scan_id, 'dns')
+        # The trigger of the other transaction has to wait for this one,
+        # otherwise each would still see the job of the other.
+        thread = threading.Thread(target=delete_job, args=(other_conn, scan_id, 'mail'))
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        db_conn.commit()
+        thread.join()
+        other_conn.commit()
+    finally:
+        other_conn.close()
+    assert fetch_all(READY_JOBS_QUERY) == [('chromedevtools',)]
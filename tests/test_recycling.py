@@ -0,0 +1,28 @@
+from privacyscanner.recycling import RecyclingPolicy, ResourceUsage
+
+MIB = 1024 * 1024
+
+
+def test_first_job_sets_baseline():
+    policy = RecyclingPolicy(max_rss_growth=100, max_fds=10, max_threads=4)
+    assert policy.get_recycle_reason(ResourceUsage(1000 * MIB, 5, 2)) is None
+    assert policy.get_recycle_reason(ResourceUsage(1100 * MIB, 10, 4)) is None
+    assert policy.get_recycle_reason(ResourceUsage(1101 * MIB, 5, 2)) == 'RSS grew by 101 MiB'
+
+
+def test_fd_and_thread_limits():
+    policy = RecyclingPolicy(max_fds=10, max_threads=4)
+    policy.get_recycle_reason(ResourceUsage(100 * MIB, 5, 2))
+    assert policy.get_recycle_reason(ResourceUsage(100 * MIB, 11, 2)) == '11 open file descriptors'
+    assert policy.get_recycle_reason(ResourceUsage(100 * MIB, 5, 5)) == '5 threads'
+
+
+def test_no_limits():
+    policy = RecyclingPolicy()
+    policy.get_recycle_reason(ResourceUsage(100 * MIB, 5, 2))
+    assert policy.get_recycle_reason(ResourceUsage(10000 * MIB, 5000, 500)) is None
+
+
+def test_measure():
+    usage = RecyclingPolicy().measure()
+    assert usage.rss > 0 and usage.num_fds > 0 and usage.num_threads >= 1
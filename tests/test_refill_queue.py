@@ -0,0 +1,54 @@
+from argparse import Namespace
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extras
+import pytest
+
+pytest.importorskip('pandas')
+
+from privacyscanner import scanner  # noqa: E402
+from privacyscanner.db import postgre_sql_connection, refill_queue  # noqa: E402
+
+
+@pytest.fixture
+def refill(db_dsn, monkeypatch):
+    def connect(db_config):
+        # PostgreSQLConnection rebuilds the DSN without the search_path of
+        # the test schema.
+        conn = postgre_sql_connection.PostgreSQLConnection.__new__(
+            postgre_sql_connection.PostgreSQLConnection)
+        conn.conn = psycopg2.connect(db_dsn)
+        conn.cursor = conn.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        return conn
+
+    monkeypatch.setattr(refill_queue, 'PostgreSQLConnection', connect)
+    monkeypatch.setattr(scanner, 'load_config', lambda filename: {'QUEUE_DB_DSN': db_dsn})
+    monkeypatch.setattr(refill_queue, 'module_exists',
+                        lambda config, module_names: (True, None, [module_names]))
+
+    def refill(module):
+        refill_queue.main(Namespace(module=module, config=None))
+
+    return refill
+
+
+def test_refill_queue(refill, db_conn, fetch_all):
+    now = datetime.now(timezone.utc)
+    with db_conn.cursor() as c:
+        for site_id, url in [('a', 'https://a.example/'), ('b', 'https://b.example/')]:
+            c.execute("INSERT INTO sites_site (id, url, is_private, date_created, num_views) "
+                      "VALUES (%s, %s, false, %s, 0)", (site_id, url, now))
+    db_conn.commit()
+    refill('cookiebanner')
+    scans = fetch_all("SELECT id, site_id, result->>'site_url' FROM scanner_scan ORDER BY id")
+    assert [(site_id, site_url) for _, site_id, site_url in scans] == [
+        ('a', 'https://a.example/'), ('b', 'https://b.example/')]
+    scan_ids = [scan_id for scan_id, _, _ in scans]
+    assert fetch_all('SELECT scan_id, scan_module, num_tries, spans FROM scanner_scaninfo '
+                     'ORDER BY scan_id') == [(scan_id, 'cookiebanner', 0, None) for scan_id in scan_ids]
+    assert fetch_all('SELECT scan_id, scan_module, lease_owner, lease_worker, lease_expires '
+                     'FROM scanner_scanjob ORDER BY scan_id') == [
+        (scan_id, 'cookiebanner', None, None, None) for scan_id in scan_ids]
+    assert fetch_all('SELECT scan_id FROM scanner_readyjob ORDER BY scan_id') == [
+        (scan_id,) for scan_id in scan_ids]
@@ -0,0 +1,79 @@
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from privacyscanner.scanlist import QUEUE_FILENAME, SiteQueue, read_site_list
+from privacyscanner.scanner import CommandError, QueueEntry
+
+
+@pytest.fixture
+def queue_file(tmp_path):
+    return tmp_path / QUEUE_FILENAME
+
+
+@pytest.fixture
+def site_queue(queue_file):
+    site_queue = SiteQueue(queue_file)
+    yield site_queue
+    site_queue.close()
+
+
+def test_read_site_list(tmp_path):
+    site_list = tmp_path / 'sites.csv'
+    site_list.write_text('rank,domain\n1,example.com\n2,http://example.org/\n3,example.net\n')
+    assert read_site_list(str(site_list), 2) == ['https://example.com', 'http://example.org/']
+
+
+def test_add_sites_ignores_known_sites(site_queue):
+    assert site_queue.add_sites(['https://a.example', 'https://b.example']) == 2
+    assert site_queue.add_sites(['https://b.example', 'https://c.example']) == 1
+    assert site_queue.count() == 3
+
+
+def test_resume(queue_file):
+    site_queue = SiteQueue(queue_file)
+    site_queue.add_sites(['https://a.example', 'https://b.example', 'https://c.example'])
+    (a_id, _, _, _), (b_id, _, _, _) = site_queue.claim(2)
+    site_queue.finish(a_id, has_error=False)
+    site_queue.close()
+
+    # b was interrupted while it was running.
+    site_queue = SiteQueue(queue_file)
+    try:
+        assert site_queue.reset_running() == 1
+        assert [site_url for _, site_url, _, _ in site_queue.claim(5)] == [
+            'https://b.example', 'https://c.example']
+        assert site_queue.count('finished') == 1
+    finally:
+        site_queue.close()
+
+
+def test_release_until_not_before(site_queue):
+    site_queue.add_sites(['https://a.example', 'https://b.example'])
+    (site_id, _, scan_queue, has_error), = site_queue.claim(1)
+    assert scan_queue is None and not has_error
+    not_before = datetime.utcnow() + timedelta(hours=1)
+    scan_queue = [QueueEntry('dns', 0, None), QueueEntry('chromedevtools', 1, not_before)]
+    site_queue.release(site_id, scan_queue, has_error=True)
+    assert [site_url for _, site_url, _, _ in site_queue.claim(5)] == ['https://b.example']
+    assert site_queue.claim(5) == []
+    assert site_queue.get_next_not_before() == pytest.approx(
+        (not_before - datetime(1970, 1, 1)).total_seconds())
+    site_queue._conn.execute('UPDATE site SET not_before = 0')
+    (_, _, restored_queue, has_error), = site_queue.claim(5)
+    assert has_error
+    assert [entry.scan_module_name for entry in restored_queue] == ['dns', 'chromedevtools']
+    assert restored_queue[1].not_before == pytest.approx(not_before, abs=timedelta(seconds=1))
+
+
+def test_queue_is_locked(site_queue, queue_file):
+    # The lock is held per process, so another process has to try it.
+    code = ('import sys; from privacyscanner.scanlist import SiteQueue; '
+            'from privacyscanner.scanner import CommandError\n'
+            'try:\n    SiteQueue(sys.argv[1])\n'
+            'except CommandError as e:\n    print(e)')
+    output = subprocess.run([sys.executable, '-c', code, str(queue_file)],
+                            stdout=subprocess.PIPE, check=True).stdout
+    assert output.startswith(b'Another scan_list is running')
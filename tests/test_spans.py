@@ -0,0 +1,50 @@
+import threading
+
+from privacyscanner.spans import Spans
+
+
+def test_nesting():
+    spans = Spans()
+    with spans.span('chrome'):
+        with spans.span('navigate'):
+            pass
+        for _ in range(2):
+            with spans.span('extract'):
+                pass
+    with spans.span('db_report_result'):
+        pass
+    spans.add('chrome/extract', 1.0)
+    totals = spans.to_dict()
+    assert list(totals) == ['chrome', 'chrome/navigate', 'chrome/extract', 'db_report_result']
+    assert [count for _, count in totals.values()] == [1, 1, 3, 1]
+    assert totals['chrome/extract'][0] >= 1.0
+    assert [line.split()[0] for line in spans.format().splitlines()] == [
+        'chrome', 'navigate', 'extract', 'db_report_result']
+    assert spans.format().splitlines()[2].startswith('  extract')
+    assert spans.format().splitlines()[2].endswith('(3x)')
+
+
+def test_threads_have_own_paths():
+    spans = Spans()
+
+    def run():
+        with spans.span('site'):
+            pass
+
+    with spans.span('scan'):
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+    assert list(spans.to_dict()) == ['scan', 'site']
+
+
+def test_span_is_recorded_on_error():
+    spans = Spans()
+    try:
+        with spans.span('chrome'):
+            raise ValueError
+    except ValueError:
+        pass
+    with spans.span('dns'):
+        pass
+    assert list(spans.to_dict()) == ['chrome', 'dns']
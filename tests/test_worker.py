@@ -0,0 +1,61 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from privacyscanner import worker
+from privacyscanner.worker import WorkerInfo, WorkerMaster
+
+
+class FakeWriteBuffer:
+    def __init__(self):
+        self.entries = []
+
+    def add(self, kind, params):
+        self.entries.append((kind, params))
+
+
+@pytest.fixture
+def master(monkeypatch):
+    killed = []
+    monkeypatch.setattr(worker, 'kill_everything', killed.append)
+    master = WorkerMaster.__new__(WorkerMaster)
+    master.max_execution_times = {None: 60}
+    master.max_execution_time = 60
+    master._workers = {}
+    master._terminated_worker_pids = set()
+    master._write_buffer = FakeWriteBuffer()
+    master._setup_metrics()
+    master.killed = killed
+    return master
+
+
+def add_worker(master, pid):
+    worker_info = WorkerInfo(pid, SimpleNamespace(pid=pid), None, None, None, None)
+    master._workers[pid] = worker_info
+    return worker_info
+
+
+def test_idle_worker_is_not_killed(master):
+    worker_info = add_worker(master, 1)
+    worker_info.notify_job_started(42, 'dns')
+    worker_info._last_execution_time -= 120
+    worker_info.notify_job_finished()
+    master._check_hanging()
+    assert master.killed == []
+    assert master._terminated_worker_pids == set()
+    assert master._metric_hang_kills._values == {}
+    assert master._metric_jobs_failed._values == {}
+    assert master._write_buffer.entries == []
+
+
+def test_hanging_worker_is_killed(master):
+    worker_info = add_worker(master, 2)
+    worker_info.notify_job_started(42, 'dns')
+    worker_info._last_execution_time = time.time() - 120
+    master._check_hanging()
+    assert master.killed == [2]
+    assert master._terminated_worker_pids == {2}
+    assert master._metric_hang_kills._values == {('dns',): 1}
+    assert master._write_buffer.entries == [('job_failed', (42, 'dns', None))]
+    assert worker_info.scan_id is None
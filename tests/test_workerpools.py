@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from privacyscanner.jobqueue import JobQueue
+from privacyscanner.scanner import CommandError, _check_worker_pools
+from privacyscanner.workerpools import WorkerPool, allocate_workers, create_pools
+
+
+def test_default_pool():
+    pools = create_pools(None)
+    assert [(pool.name, pool.scan_modules) for pool in pools] == [('default', None)]
+    assert allocate_workers(3, pools) == {'default': 3}
+
+
+def test_allocate_by_weight():
+    pools = create_pools({
+        'browser': {'scan_modules': ['chromedevtools'], 'weight': 2},
+        'light': {'scan_modules': ['dns', 'mail']},
+    })
+    assert allocate_workers(6, pools) == {'browser': 4, 'light': 2}
+    assert allocate_workers(1, pools) == {'browser': 1, 'light': 0}
+
+
+def test_allocate_within_limits():
+    pools = [WorkerPool('browser', max_workers=2, weight=4),
+             WorkerPool('light', min_workers=2),
+             WorkerPool('subprocess', min_workers=0)]
+    assert allocate_workers(8, pools) == {'browser': 2, 'light': 3, 'subprocess': 3}
+    assert allocate_workers(8, pools, limits={'light': 2}) == {
+        'browser': 2, 'light': 2, 'subprocess': 4}
+    assert allocate_workers(2, [WorkerPool('browser', max_workers=1)]) == {'browser': 1}
+
+
+def test_check_worker_pools():
+    scan_module_names = ['chromedevtools', 'dns']
+    _check_worker_pools(None, scan_module_names)
+    _check_worker_pools({'all': {}, 'dns': {'scan_modules': ['dns']}}, scan_module_names)
+    with pytest.raises(CommandError, match='no scan modules'):
+        _check_worker_pools({'empty': {'scan_modules': []}}, scan_module_names)
+    with pytest.raises(CommandError, match='unknown scan modules: mail'):
+        _check_worker_pools({'light': {'scan_modules': ['dns', 'mail']}}, scan_module_names)
+
+
+def test_queue_without_modules_claims_nothing():
+    queue = JobQueue.__new__(JobQueue)
+    queue._claim_sizes = {}
+    queue._buffer = []
+    queue._conn = SimpleNamespace(cursor=None)
+    queue._claim_jobs()
+    assert queue._buffer == []
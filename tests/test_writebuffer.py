@@ -0,0 +1,104 @@
+import psycopg2
+import pytest
+
+from privacyscanner import writebuffer
+from privacyscanner.writebuffer import WriteBehindBuffer
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def execute(self, query):
+        self.conn.statements.append(query)
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self):
+        self.statements = []
+        self.committed = []
+        self.pending = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.committed.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = FakeConnection()
+
+    def execute_values(cur, query, rows, template=None, page_size=100):
+        for row in rows:
+            if any(isinstance(value, str) and '\x00' in value for value in row):
+                raise ValueError('A string literal cannot contain NUL (0x00) characters.')
+        conn.pending.extend(rows)
+
+    monkeypatch.setattr(writebuffer.psycopg2, 'connect', lambda *args, **kwargs: conn)
+    monkeypatch.setattr(writebuffer, 'execute_values', execute_values)
+    return conn
+
+
+def test_flush(conn):
+    buffer = WriteBehindBuffer('')
+    buffer.add('job_started', ('host', '2020-01-01', 1, 'dns'))
+    buffer.add('log', (1, 'dns', 'host', '2020-01-01', 20, 'message'))
+    assert buffer.flush()
+    assert len(buffer) == 0
+    assert conn.committed == [('host', '2020-01-01', 1, 'dns'),
+                              (1, 'dns', 'host', '2020-01-01', 20, 'message')]
+
+
+def test_flush_drops_bad_entry(conn):
+    buffer = WriteBehindBuffer('')
+    buffer.add('job_started', ('host', '2020-01-01', 1, 'dns'))
+    buffer.add('log', (1, 'dns', 'host', '2020-01-01', 20, 'bad\x00message'))
+    buffer.add('log', (1, 'dns', 'host', '2020-01-01', 20, 'good message'))
+    assert buffer.flush()
+    assert len(buffer) == 0
+    assert buffer.num_dropped == 1
+    assert conn.committed == [('host', '2020-01-01', 1, 'dns'),
+                              (1, 'dns', 'host', '2020-01-01', 20, 'good message')]
+    assert conn.statements.count('ROLLBACK TO SAVEPOINT entry') == 1
+
+
+def test_flush_retries_when_database_is_unavailable(conn, monkeypatch):
+    def execute_values(*args, **kwargs):
+        raise psycopg2.OperationalError('server closed the connection')
+
+    monkeypatch.setattr(writebuffer, 'execute_values', execute_values)
+    buffer = WriteBehindBuffer('')
+    buffer.add('job_failed', (1, 'dns', None))
+    assert not buffer.flush()
+    assert len(buffer) == 1
+    assert buffer.num_dropped == 0
+
+
+def test_flush_splits_batch_for_same_job(conn, monkeypatch):
+    batches = []
+    monkeypatch.setattr(writebuffer, 'execute_values',
+                        lambda cur, query, rows, **kwargs: batches.append(rows))
+    buffer = WriteBehindBuffer('')
+    buffer.add('job_finished', ('2020-01-01', 1, 'dns', None))
+    buffer.add('job_finished', ('2020-01-01', 2, 'dns', None))
+    buffer.add('job_finished', ('2020-01-02', 1, 'dns', '{"scan": 1}'))
+    assert buffer.flush()
+    assert batches == [[('2020-01-01', 1, 'dns', None), ('2020-01-01', 2, 'dns', None)],
+                       [('2020-01-02', 1, 'dns', '{"scan": 1}')]]